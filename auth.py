@@ -1,54 +1,211 @@
 # auth.py
 import streamlit as st
-import json
-import os
+import hmac
+import re
+import threading
 from datetime import datetime
 
-def load_user_relationships():
-    """加载用户关系数据"""
+from journal import JsonJournal
+from shared_storage import root_path
+from event_bus import get_event_bus
+from instrumentation import timed
+from credentials import hash_password, verify_password, needs_rehash, login_throttle, session_tokens
+
+RELATIONSHIPS_FILE = root_path("user_relationships.json")
+RELATIONSHIPS_LOG = root_path("user_relationships.log")
+
+_relationship_journal = JsonJournal(RELATIONSHIPS_FILE, RELATIONSHIPS_LOG)
+
+# 进程内常驻的关系表：新会话从这里复制，不必每次从磁盘读取快照和重放日志
+_warm_relationships = None
+_warm_relationships_lock = threading.Lock()
+
+class RelationshipTable(dict):
+    """用户关系表 - 记录自上次保存以来的边级变更，以及已同步到的日志位置"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pending_ops = []
+        self.position = None
+
+def _empty_relationship():
+    return {
+        "sent_requests": [],
+        "received_requests": [],
+        "binded_users": []
+    }
+
+def _record_op(user_relationships, op, from_user, to_user):
+    """记录一条关系变更，等待保存时追加到日志"""
+    if isinstance(user_relationships, RelationshipTable):
+        user_relationships.pending_ops.append({"op": op, "from": from_user, "to": to_user})
+
+def _discard(items, value):
+    if value in items:
+        items.remove(value)
+
+def _add(items, value):
+    if value not in items:
+        items.append(value)
+
+def apply_relationship_op(user_relationships, op):
+    """把一条关系操作应用到关系表（用于日志重放，缺失的数据会被容忍）"""
+    from_user, to_user = op.get("from"), op.get("to")
+    if not from_user or not to_user:
+        return
+    from_rels = user_relationships.setdefault(from_user, _empty_relationship())
+    to_rels = user_relationships.setdefault(to_user, _empty_relationship())
+
+    kind = op.get("op")
+    if kind == "send":
+        _add(from_rels["sent_requests"], to_user)
+        _add(to_rels["received_requests"], from_user)
+    elif kind in ("accept", "reject"):
+        # from_user 发出的请求被 to_user 处理
+        _discard(to_rels["received_requests"], from_user)
+        _discard(from_rels["sent_requests"], to_user)
+        if kind == "accept":
+            _add(to_rels["binded_users"], from_user)
+            _add(from_rels["binded_users"], to_user)
+    elif kind == "bind":
+        # 旧版本批量导入写入的直接绑定，仅用于重放已有日志
+        for a_rels, b_user in ((from_rels, to_user), (to_rels, from_user)):
+            _discard(a_rels["sent_requests"], b_user)
+            _discard(a_rels["received_requests"], b_user)
+            _add(a_rels["binded_users"], b_user)
+    elif kind == "unbind":
+        _discard(from_rels["binded_users"], to_user)
+        _discard(to_rels["binded_users"], from_user)
+
+def _read_user_relationships():
+    """从磁盘读取用户关系数据（快照 + 变更日志）"""
     try:
-        if os.path.exists("user_relationships.json"):
-            with open("user_relationships.json", 'r', encoding='utf-8') as f:
-                return json.load(f)
-        else:
-            return {}
+        user_relationships, position = _relationship_journal.load_with_position(apply_relationship_op, RelationshipTable())
+        user_relationships.position = position
+        return user_relationships
     except Exception as e:
         st.error(f"加载用户关系数据失败: {str(e)}")
-        return {}
+        return RelationshipTable()
+
+def _copy_relationships(user_relationships):
+    table = RelationshipTable({
+        user: {key: list(users) for key, users in rels.items()}
+        for user, rels in user_relationships.items()
+    })
+    table.position = user_relationships.position
+    return table
+
+@timed()
+def load_user_relationships():
+    """加载用户关系数据：复制进程内常驻的关系表，常驻表先按日志位置同步到最新"""
+    global _warm_relationships
+    with _warm_relationships_lock:
+        if _warm_relationships is None:
+            _warm_relationships = _read_user_relationships()
+        else:
+            _warm_relationships = refresh_user_relationships(_warm_relationships)
+        return _copy_relationships(_warm_relationships)
+
+def refresh_user_relationships(user_relationships):
+    """同步其他会话/进程保存的关系变更，返回最新的关系表（无法增量同步时重新加载）"""
+    if not isinstance(user_relationships, RelationshipTable) or user_relationships.pending_ops:
+        return user_relationships
+    if not _relationship_journal.changed(user_relationships.position):
+        return user_relationships
+    position = _relationship_journal.sync(user_relationships, apply_relationship_op, user_relationships.position)
+    if position is None:
+        return _read_user_relationships()
+    user_relationships.position = position
+    return user_relationships
 
+@timed()
 def save_user_relationships(user_relationships):
-    """保存用户关系数据"""
+    """保存用户关系数据 - 只追加本次变更的边，日志过长时压缩为快照"""
     try:
-        with open("user_relationships.json", 'w', encoding='utf-8') as f:
-            json.dump(user_relationships, f, ensure_ascii=False, indent=2)
+        if isinstance(user_relationships, RelationshipTable):
+            ops = user_relationships.pending_ops
+            user_relationships.position = _relationship_journal.append(ops, user_relationships.position)
+            user_relationships.pending_ops = []
+            if _relationship_journal.needs_compaction():
+                user_relationships.position = _relationship_journal.compact(
+                    user_relationships, apply_relationship_op, user_relationships.position
+                )
+            # 通知对方（请求、接受、解除等）
+            get_event_bus().publish_relationship_ops(ops)
+        else:
+            # 普通字典没有变更记录，只能整体写入快照
+            _relationship_journal.compact(user_relationships)
         return True
     except Exception as e:
         st.error(f"保存用户关系数据失败: {str(e)}")
         return False
 
-def authenticate_user(username, password, users):
-    """用户认证"""
-    if username in users:
-        stored_password = users[username].get("password")
-        return stored_password == password
-    return False
+@timed()
+def authenticate_user(username, password, users, on_migrate=None):
+    """用户认证 - 校验加盐哈希，明文密码在登录成功时迁移为哈希"""
+    # 锁定期内直接拒绝，避免暴力尝试消耗CPU
+    if login_throttle.retry_after(username) > 0:
+        return False
+    
+    entry = users[username] if username in users else None
+    verified = False
+    if entry is not None:
+        if "password_hash" in entry:
+            verified = verify_password(password or "", entry["password_hash"])
+        elif "password" in entry:
+            verified = hmac.compare_digest(str(entry["password"]).encode('utf-8'), (password or "").encode('utf-8'))
+    
+    if not verified:
+        login_throttle.record_failure(username)
+        return False
+    
+    login_throttle.record_success(username)
+    
+    # 迁移旧的明文密码或按新的成本参数重新哈希
+    if "password" in entry or needs_rehash(entry["password_hash"]):
+        migrated = {key: value for key, value in entry.items() if key != "password"}
+        migrated["password_hash"] = hash_password(password)
+        users[username] = migrated
+        if on_migrate:
+            on_migrate(username, migrated)
+    return True
+
+def get_login_retry_after(username):
+    """登录被限流时的剩余等待秒数"""
+    remaining = login_throttle.retry_after(username)
+    return int(remaining) + 1 if remaining > 0 else 0
+
+def start_user_session(username):
+    """登录成功后签发会话令牌"""
+    return session_tokens.issue(username)
+
+def resolve_session_user(token):
+    """根据会话令牌取得已验证的用户名"""
+    return session_tokens.validate(token)
+
+def end_user_session(token):
+    """退出登录时作废会话令牌"""
+    session_tokens.revoke(token)
 
 def register_user(username, password, users):
-    """用户注册 - 移除邀请码功能"""
+    """用户注册 - 密码以加盐哈希保存"""
     if not username or not password:
         return False, "请输入用户名和密码"
     
     if username in users:
         return False, "用户名已存在"
     
-    users[username] = {
-        "password": password,
+    record = {
+        "password_hash": hash_password(password),
         "created_at": datetime.now().isoformat()
     }
+    # 其他进程可能同时注册了同名用户，以写入时的检查为准
+    if users.setdefault(username, record) is not record:
+        return False, "用户名已存在"
     
     return True, "注册成功！"
 
-def send_binding_request(target_username, current_user, user_relationships):
+def send_binding_request(target_username, current_user, user_relationships, users=None):
     """发送绑定请求"""
     if not current_user:
         return False, "请先登录"
@@ -56,20 +213,15 @@ def send_binding_request(target_username, current_user, user_relationships):
     if target_username == current_user:
         return False, "不能绑定自己"
     
+    if users is not None and target_username not in users:
+        return False, "用户不存在"
+    
     # 初始化用户关系
     if current_user not in user_relationships:
-        user_relationships[current_user] = {
-            "sent_requests": [],
-            "received_requests": [],
-            "binded_users": []
-        }
+        user_relationships[current_user] = _empty_relationship()
     
     if target_username not in user_relationships:
-        user_relationships[target_username] = {
-            "sent_requests": [],
-            "received_requests": [],
-            "binded_users": []
-        }
+        user_relationships[target_username] = _empty_relationship()
     
     # 检查是否已经绑定
     if target_username in user_relationships[current_user]["binded_users"]:
@@ -82,6 +234,7 @@ def send_binding_request(target_username, current_user, user_relationships):
     # 发送请求
     user_relationships[current_user]["sent_requests"].append(target_username)
     user_relationships[target_username]["received_requests"].append(current_user)
+    _record_op(user_relationships, "send", current_user, target_username)
     
     return True, f"已向 {target_username} 发送绑定请求"
 
@@ -97,6 +250,7 @@ def accept_binding_request(from_username, current_user, user_relationships):
     # 建立绑定关系
     user_relationships[current_user]["binded_users"].append(from_username)
     user_relationships[from_username]["binded_users"].append(current_user)
+    _record_op(user_relationships, "accept", from_username, current_user)
     
     return True, f"已与 {from_username} 建立绑定关系"
 
@@ -108,6 +262,7 @@ def reject_binding_request(from_username, current_user, user_relationships):
     # 移除请求
     user_relationships[current_user]["received_requests"].remove(from_username)
     user_relationships[from_username]["sent_requests"].remove(current_user)
+    _record_op(user_relationships, "reject", from_username, current_user)
     
     return True, f"已拒绝 {from_username} 的绑定请求"
 
@@ -129,6 +284,7 @@ def unbind_user(target_username, current_user, user_relationships):
     
     if target_username in user_relationships and "binded_users" in user_relationships[target_username]:
         user_relationships[target_username]["binded_users"].remove(current_user)
+    _record_op(user_relationships, "unbind", current_user, target_username)
     
     return True, f"已解除与 {target_username} 的绑定关系"
 
@@ -146,4 +302,75 @@ def is_user_binded(username, current_user, user_relationships):
         return False
     
     binded_users = get_binded_users(current_user, user_relationships)
-    return username in binded_users
\ No newline at end of file
+    return username in binded_users
+
+def _apply_batch(user_relationships, ops):
+    """一次性应用一批已校验的操作，并记入待保存的变更"""
+    for op in ops:
+        apply_relationship_op(user_relationships, op)
+    if isinstance(user_relationships, RelationshipTable):
+        user_relationships.pending_ops.extend(ops)
+
+def parse_username_list(text):
+    """解析用户名列表，支持换行、逗号、分号和空格分隔"""
+    names = []
+    seen = set()
+    for name in re.split(r"[\s,，;；、]+", text or ""):
+        if name and name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names
+
+def bind_many(usernames, current_user, user_relationships, users=None):
+    """向多个用户批量发送绑定请求（如班级名单），对方接受后才建立绑定，一次提交"""
+    if not current_user:
+        return False, "请先登录"
+
+    user_rels = user_relationships.get(current_user, {})
+    binded = set(user_rels.get("binded_users", []))
+    sent = set(user_rels.get("sent_requests", []))
+    ops = []
+    skipped = []
+    for username in dict.fromkeys(usernames):
+        if username == current_user or username in binded or username in sent:
+            continue
+        if users is not None and username not in users:
+            skipped.append(username)
+            continue
+        ops.append({"op": "send", "from": current_user, "to": username})
+
+    if not ops:
+        return False, "没有可以邀请的新用户"
+    _apply_batch(user_relationships, ops)
+    message = f"已向 {len(ops)} 位用户发送绑定请求"
+    if skipped:
+        message += f"，{len(skipped)} 位用户不存在: {', '.join(skipped)}"
+    return True, message
+
+def accept_all(current_user, user_relationships):
+    """接受所有待处理的绑定请求，一次提交"""
+    if not current_user:
+        return False, "请先登录"
+
+    received = user_relationships.get(current_user, {}).get("received_requests", [])
+    if not received:
+        return False, "暂无待处理请求"
+    ops = [{"op": "accept", "from": from_user, "to": current_user} for from_user in received]
+    _apply_batch(user_relationships, ops)
+    return True, f"已接受 {len(ops)} 个绑定请求"
+
+def unbind_all(current_user, user_relationships):
+    """解除与所有用户的绑定关系，一次提交"""
+    if not current_user:
+        return False, "请先登录"
+
+    binded = get_binded_users(current_user, user_relationships)
+    if not binded:
+        return False, "暂无绑定关系"
+    ops = [{"op": "unbind", "from": current_user, "to": target} for target in binded]
+    _apply_batch(user_relationships, ops)
+    return True, f"已解除与 {len(ops)} 位用户的绑定关系"
+
+def invite_from_list(text, current_user, user_relationships, users=None):
+    """按名单批量发送绑定请求，一次提交"""
+    return bind_many(parse_username_list(text), current_user, user_relationships, users)
@@ -0,0 +1,72 @@
+# benchmarks/bench_login.py
+"""登录延迟基准：测量当前scrypt成本参数下的哈希与校验耗时
+
+用法: python benchmarks/bench_login.py [--rounds 20] [--n 16384 32768]
+输出为JSON，便于比较不同成本参数。
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import credentials
+
+
+def time_calls(func, rounds):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "rounds": rounds,
+        "mean_ms": round(statistics.mean(samples), 3),
+        "p50_ms": round(statistics.median(samples), 3),
+        "max_ms": round(max(samples), 3),
+    }
+
+
+def bench_cost(n, r, p, rounds):
+    encoded = credentials.hash_password("correct horse battery", n=n, r=r, p=p)
+    return {
+        "n": n,
+        "r": r,
+        "p": p,
+        "hash": time_calls(lambda: credentials.hash_password("correct horse battery", n=n, r=r, p=p), rounds),
+        "verify": time_calls(lambda: credentials.verify_password("correct horse battery", encoded), rounds),
+    }
+
+
+def bench_cached_paths(rounds):
+    """令牌缓存校验与限流拒绝的耗时，二者都不应计算哈希"""
+    cache = credentials.SessionTokenCache()
+    token = cache.issue("bench_user")
+    throttle = credentials.LoginThrottle(max_attempts=1)
+    throttle.record_failure("bench_user")
+    return {
+        "session_token_validate": time_calls(lambda: cache.validate(token), rounds * 100),
+        "throttled_reject": time_calls(lambda: throttle.retry_after("bench_user"), rounds * 100),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--n", type=int, nargs="*", default=[credentials.SCRYPT_N])
+    args = parser.parse_args()
+
+    results = {
+        "benchmark": "login",
+        "chosen_cost": {"n": credentials.SCRYPT_N, "r": credentials.SCRYPT_R, "p": credentials.SCRYPT_P},
+        "costs": [bench_cost(n, credentials.SCRYPT_R, credentials.SCRYPT_P, args.rounds) for n in args.n],
+        "cached": bench_cached_paths(args.rounds),
+    }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
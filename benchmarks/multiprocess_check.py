@@ -0,0 +1,181 @@
+# benchmarks/multiprocess_check.py
+"""多进程一致性检查：N 个工作进程同时读写同一个数据目录
+
+用法: python benchmarks/multiprocess_check.py [--workers 4] [--ops 50] [--data-root DIR]
+
+每个工作进程都像一个独立的服务进程一样导入项目模块，同时进行用户注册、发送绑定请求、
+保存日程、上传课表和发布通知，结束后检查数据目录中的结果是否完整：
+没有丢失的写入、日程和事件ID不重复、同名注册只有一个成功、各进程发布的事件都能收到，
+课表日志末尾的残缺记录在恢复时被截掉。
+输出为JSON，有问题时退出码为1。
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+HUB_USER = "hub"
+
+
+def _worker(index, ops, data_root, barrier, results):
+    # 数据根目录必须在导入项目模块之前设置
+    os.environ["LIZHI_DATA_ROOT"] = data_root
+    import pandas as pd
+    import auth
+    import course2
+    import event_bus
+    import schedule
+    import user_directory
+
+    directory = user_directory.UserDirectory()
+    bus = event_bus.EventBus()
+    if index == 0:
+        bus.subscribe("check-session", HUB_USER, [])
+    barrier.wait()
+
+    start = time.perf_counter()
+    registered_shared = auth.register_user("shared_name", "pw", directory)[0]
+    relationships = auth.load_user_relationships()
+    for op in range(ops):
+        username = f"w{index}_u{op}"
+        directory[username] = {"password_hash": "", "created_at": ""}
+
+        relationships = auth.refresh_user_relationships(relationships)
+        auth.send_binding_request(HUB_USER, username, relationships)
+        auth.save_user_relationships(relationships)
+
+        schedule.update_schedule_data(lambda data, op=op: data.append({
+            "id": max((text["id"] for text in data), default=-1) + 1,
+            "title": f"w{index}_s{op}",
+            "content": "",
+            "author": username,
+        }))
+
+        bus.publish("schedule", username, [HUB_USER], action="发布", title=f"w{index}_s{op}")
+
+        if op % 10 == 0:
+            df = pd.DataFrame({"星期一": [f"课程{index}_{op}(教师；必修；1-16周；一教101)"]})
+            file = io.BytesIO(f"{index}-{op}".encode())
+            file.name = f"w{index}_t{op}.xlsx"
+            record = course2.build_timetable_record(file, df, username, False, {"Sheet1": df})
+            course2.commit_timetable(file.name.rsplit(".", 1)[0], record)
+    elapsed = time.perf_counter() - start
+
+    barrier.wait()
+    received = 0
+    if index == 0:
+        # 等待事件循环读取其他进程写入的事件
+        deadline = time.time() + 10
+        expected = len(results) * ops
+        while time.time() < deadline and received < expected:
+            time.sleep(event_bus.OUTBOX_POLL_SECONDS)
+            received += sum(1 for event in bus.poll("check-session") if event["kind"] == "schedule")
+    results[index] = {"seconds": round(elapsed, 3), "registered_shared": registered_shared, "received": received}
+
+
+def check(data_root, workers, ops, results):
+    """读取数据目录，返回发现的问题列表"""
+    os.environ["LIZHI_DATA_ROOT"] = data_root
+    import auth
+    import event_bus
+    import schedule
+    import timetable_store
+    import user_directory
+
+    problems = []
+    directory = user_directory.UserDirectory()
+    missing = [f"w{i}_u{op}" for i in range(workers) for op in range(ops) if f"w{i}_u{op}" not in directory]
+    if missing:
+        problems.append(f"丢失 {len(missing)} 个注册用户")
+    if sum(result["registered_shared"] for result in results) != 1:
+        problems.append("同名用户注册成功的次数不为1")
+
+    relationships = auth.load_user_relationships()
+    requests = set(relationships.get(HUB_USER, {}).get("received_requests", []))
+    if len(requests) != workers * ops:
+        problems.append(f"绑定请求 {len(requests)} 条，应为 {workers * ops} 条")
+
+    texts = schedule.load_schedule_data()
+    ids = [text["id"] for text in texts]
+    if len(texts) != workers * ops or len(set(ids)) != len(ids):
+        problems.append(f"日程 {len(texts)} 条（不重复ID {len(set(ids))} 个），应为 {workers * ops} 条")
+
+    timetables = timetable_store.TimetableStore().records()
+    expected_timetables = workers * len(range(0, ops, 10))
+    if len(timetables) != expected_timetables:
+        problems.append(f"课表 {len(timetables)} 个，应为 {expected_timetables} 个")
+
+    # 模拟写入日志时崩溃：末尾留下半条记录，恢复后课表不变且残缺部分被截掉
+    wal_size = os.path.getsize(timetable_store.WAL_FILE)
+    with open(timetable_store.WAL_FILE, "ab") as f:
+        f.write(timetable_store.WAL_RECORD.pack(1000, 0) + b"torn")
+    recovered = timetable_store.TimetableStore()
+    if len(recovered.records()) != expected_timetables or os.path.getsize(timetable_store.WAL_FILE) != wal_size:
+        problems.append("课表日志残缺尾部的恢复结果不正确")
+
+    with open(event_bus.OUTBOX_FILE, "r", encoding="utf-8") as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    event_ids = [event["id"] for event in events]
+    if len(set(event_ids)) != len(event_ids):
+        problems.append("发件箱中有重复的事件ID")
+    if results[0]["received"] < workers * ops:
+        problems.append(f"进程0只收到 {results[0]['received']} 个日程事件，应为 {workers * ops} 个")
+    return problems, {
+        "users": len(directory),
+        "binding_requests": len(requests),
+        "schedules": len(texts),
+        "timetables": len(timetables),
+        "outbox_events": len(events),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--ops", type=int, default=50)
+    parser.add_argument("--data-root", help="数据目录，默认使用临时目录并在结束后删除")
+    args = parser.parse_args()
+
+    data_root = args.data_root or tempfile.mkdtemp(prefix="lizhi-mp-")
+    os.makedirs(data_root, exist_ok=True)
+    context = multiprocessing.get_context("spawn")
+    try:
+        with context.Manager() as manager:
+            results = manager.list([None] * args.workers)
+            barrier = context.Barrier(args.workers)
+            processes = [context.Process(target=_worker, args=(i, args.ops, data_root, barrier, results))
+                         for i in range(args.workers)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            failed = [i for i, process in enumerate(processes) if process.exitcode != 0]
+            results = list(results)
+
+        if failed:
+            problems, counts = [f"工作进程 {failed} 异常退出"], {}
+        else:
+            problems, counts = check(data_root, args.workers, args.ops, results)
+        print(json.dumps({
+            "workers": args.workers,
+            "ops_per_worker": args.ops,
+            "results": results,
+            "counts": counts,
+            "problems": problems,
+        }, ensure_ascii=False, indent=2))
+    finally:
+        if not args.data_root:
+            shutil.rmtree(data_root, ignore_errors=True)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,436 @@
+# benchmarks/run_benchmarks.py
+"""离线基准测试套件：存储、解析、导出、日程筛选、绑定操作与页面渲染
+
+用法:
+    python benchmarks/run_benchmarks.py --scale small
+    python benchmarks/run_benchmarks.py --scale medium --only storage --output bench.json
+
+所有数据都是合成的，运行在临时目录中，不会触碰项目的 timetable_data。
+结果以JSON输出，便于比较存储后端和发现性能回退。
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic
+
+SCALES = {
+    "small": {"rounds": 5, "timetables": 20, "users": 50, "schedules": 200, "sheets": 4, "extra_rows": 200},
+    "medium": {"rounds": 5, "timetables": 200, "users": 500, "schedules": 2000, "sheets": 20, "extra_rows": 2000},
+    "large": {"rounds": 3, "timetables": 1000, "users": 2000, "schedules": 20000, "sheets": 60, "extra_rows": 10000},
+}
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def measure(func, rounds, setup=None):
+    """重复执行并返回毫秒样本统计；setup 的返回值作为 func 的参数，不计入耗时"""
+    samples = []
+    for _ in range(rounds):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        func(arg) if setup else func()
+        samples.append((time.perf_counter() - start) * 1000)
+    ordered = sorted(samples)
+    return {
+        "rounds": rounds,
+        "mean_ms": round(statistics.mean(samples), 3),
+        "p50_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        "min_ms": round(ordered[0], 3),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+
+def synthetic_timetables(count):
+    """构造 session_state.timetables 结构的课表记录"""
+    import course2
+    records = {}
+    for i in range(count):
+        data = synthetic.timetable_workbook_bytes(seed=i)
+        upload = synthetic.FakeUpload(data, f"课表{i}.xlsx")
+        df, _ = course2.read_excel_file(upload)
+        records[f"课表{i}_student{i:04d}"] = {
+            "file_name": upload.name,
+            "dataframe": df,
+            "upload_time": "2025-09-01 08:00:00",
+            "uploaded_by": f"student{i:04d}",
+            "is_locked": False,
+            "file_hash": course2.get_file_hash(upload),
+        }
+    return records
+
+
+def compare_engines(data, file_name, rounds):
+    """分别用每个可用引擎读取同一文件，与 pandas 原始路径对比"""
+    import excel_reader
+    engines = {}
+    for engine in excel_reader.available_engines():
+        engines[engine] = measure(lambda: excel_reader.read_excel_bytes(data, file_name, engine=engine), rounds)
+    baseline = engines["pandas"]["mean_ms"]
+    for stats in engines.values():
+        stats["speedup_vs_pandas"] = round(baseline / stats["mean_ms"], 2) if stats["mean_ms"] else None
+    return engines
+
+
+@benchmark("excel.read_small")
+def bench_read_small(scale):
+    import course2
+    upload = synthetic.FakeUpload(synthetic.timetable_workbook_bytes(seed=1), "small.xlsx")
+    result = measure(lambda: course2.read_excel_file(upload), scale["rounds"])
+    result["bytes"] = upload.size
+    result["engines"] = compare_engines(upload.getvalue(), upload.name, scale["rounds"])
+    return result
+
+
+@benchmark("excel.read_large")
+def bench_read_large(scale):
+    import course2
+    data = synthetic.timetable_workbook_bytes(seed=2, sheets=scale["sheets"], extra_rows=scale["extra_rows"])
+    upload = synthetic.FakeUpload(data, "department.xlsx")
+    result = measure(lambda: course2.read_excel_file(upload), scale["rounds"])
+    result["bytes"] = upload.size
+    result["sheets"] = scale["sheets"]
+    result["engines"] = compare_engines(data, upload.name, scale["rounds"])
+    return result
+
+
+@benchmark("excel.read_workbook")
+def bench_read_workbook(scale):
+    """多工作表工作簿：逐表解析与进程池并行解析对比"""
+    import excel_reader
+    data = synthetic.timetable_workbook_bytes(seed=2, sheets=scale["sheets"], extra_rows=scale["extra_rows"])
+    # 先启动进程池，避免把子进程启动时间计入第一轮
+    excel_reader.read_workbook(data, "department.xlsx", parallel=True)
+    result = {
+        "bytes": len(data),
+        "sheets": scale["sheets"],
+        "workers": excel_reader.MAX_PARSE_WORKERS,
+        "sequential": measure(lambda: excel_reader.read_workbook(data, "department.xlsx", parallel=False), scale["rounds"]),
+        "parallel": measure(lambda: excel_reader.read_workbook(data, "department.xlsx", parallel=True), scale["rounds"]),
+    }
+    result["mean_ms"] = result["parallel"]["mean_ms"]
+    result["speedup"] = round(result["sequential"]["mean_ms"] / result["mean_ms"], 2) if result["mean_ms"] else None
+    return result
+
+
+@benchmark("storage.save")
+def bench_storage_save(scale):
+    """重新上传一个课表：commit_timetable 读取最新状态、合并为新版本并只向日志追加这一条记录"""
+    import course2
+    import timetable_store
+    course2.ensure_data_dir()
+    records = synthetic_timetables(scale["timetables"])
+    store = timetable_store.get_timetable_store()
+    store.apply([timetable_store.put_op(name, record) for name, record in records.items()])
+    names = iter(list(records) * scale["rounds"])
+    seeds = iter(range(10000, 10000 + scale["rounds"]))
+
+    def setup():
+        # 同一用户重新上传同名但内容不同的文件，与上传队列提交的记录相同
+        record = records[next(names)]
+        upload = synthetic.FakeUpload(synthetic.timetable_workbook_bytes(seed=next(seeds)), record["file_name"])
+        df, _ = course2.read_excel_file(upload)
+        return course2.build_timetable_record(upload, df, record["uploaded_by"])
+
+    result = measure(lambda record: course2.commit_timetable(record["file_name"], record), scale["rounds"], setup)
+    stats = store.stats()
+    result["timetables"] = scale["timetables"]
+    result["bytes"] = stats["snapshot_bytes"] + stats["wal_bytes"]
+    result["wal_records"] = stats["wal_records"]
+    return result
+
+
+@benchmark("storage.load")
+def bench_storage_load(scale):
+    """启动恢复：读取快照并重放日志"""
+    import timetable_store
+    if not os.path.exists(timetable_store.SNAPSHOT_FILE) and not os.path.exists(timetable_store.WAL_FILE):
+        bench_storage_save(scale)
+
+    stores = []
+    result = measure(lambda: stores.append(timetable_store.TimetableStore()), scale["rounds"])
+    result["timetables"] = len(stores[-1].records())
+    result["wal_records"] = stores[-1].wal_records
+    return result
+
+
+def _traced_load(payload):
+    """反序列化并返回 (对象, 新分配的字节数)"""
+    import pickle
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        obj = pickle.loads(payload)
+        return obj, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+@benchmark("memory.timetable_records")
+def bench_record_memory(scale):
+    """每个会话加载课表数据后占用的内存：字典+DataFrame 记录与紧凑记录对比"""
+    import pickle
+    import sys as _sys
+    import timetable_record
+    records = synthetic_timetables(scale["timetables"])
+    compact = {name: timetable_record.TimetableRecord.from_mapping(r) for name, r in records.items()}
+    dict_payload = pickle.dumps(records)
+    compact_payload = pickle.dumps(compact)
+
+    # 第一次加载会把取值并入进程内的取值池，之后的会话只分配编码数组
+    _, dict_bytes = _traced_load(dict_payload)
+    _traced_load(compact_payload)
+    _, compact_bytes = _traced_load(compact_payload)
+
+    pool = timetable_record.current_string_pool()
+    count = len(records)
+    load_compact = measure(lambda: pickle.loads(compact_payload), scale["rounds"])
+    return {
+        "mean_ms": load_compact["mean_ms"],
+        "timetables": count,
+        "dict_bytes_per_timetable": dict_bytes // count,
+        "compact_bytes_per_timetable": compact_bytes // count,
+        "reduction": round(dict_bytes / compact_bytes, 1) if compact_bytes else None,
+        "grid_bytes_per_timetable": sum(r.nbytes() for r in compact.values()) // count,
+        "pickle_bytes": {"dict": len(dict_payload), "compact": len(compact_payload)},
+        "pool_values": len(pool),
+        "pool_bytes": sum(_sys.getsizeof(value) for value in pool._values),
+        "load_dict": measure(lambda: pickle.loads(dict_payload), scale["rounds"]),
+        "load_compact": load_compact,
+    }
+
+
+@benchmark("export.download_button")
+def bench_download_button(scale):
+    import course2
+    upload = synthetic.FakeUpload(synthetic.timetable_workbook_bytes(seed=3), "export.xlsx")
+    df, _ = course2.read_excel_file(upload)
+    return measure(lambda: course2.create_download_button(df, upload.name, "bench"), scale["rounds"])
+
+
+@benchmark("export.formats")
+def bench_export_formats(scale):
+    """由课程模型生成各导出格式（不经过磁盘缓存），与 export.download_button 的xlsx导出对比"""
+    import exporters
+    records = list(synthetic_timetables(min(scale["timetables"], 20)).items())
+    result = {"timetables": len(records)}
+    for fmt, generator in exporters.GENERATORS.items():
+        result[fmt] = measure(lambda: sum(len(chunk) for chunk in generator(records)), scale["rounds"])
+    result["mean_ms"] = result["ics"]["mean_ms"]
+    return result
+
+
+@benchmark("schedule.filter_sort")
+def bench_schedule_filter(scale):
+    import schedule
+    texts = synthetic.schedules(scale["schedules"], synthetic.usernames(scale["users"]))
+    result = measure(lambda: schedule.filter_schedule_texts(texts, "复习", "学习", "标题A-Z"), scale["rounds"])
+    result["entries"] = len(texts)
+    return result
+
+
+@benchmark("schedule.range_query")
+def bench_schedule_range(scale):
+    """查询伙伴一周内的日程：时间索引与逐条展开比较的对比"""
+    from datetime import datetime, timedelta
+    import schedule_index
+    authors = synthetic.usernames(scale["users"])
+    texts = synthetic.schedules(scale["schedules"], authors, timed=True)
+    partners = authors[:20]
+    week_start = datetime(2025, 10, 6)
+    week_end = week_start + timedelta(weeks=1)
+    index = schedule_index.ScheduleIndex(texts)
+
+    def scan():
+        return [entry for entry in texts if entry.get('author') in partners
+                for start_at, end_at in schedule_index.occurrences(entry)
+                if start_at < week_end and week_start < end_at]
+
+    result = measure(lambda: index.overlapping(partners, week_start, week_end), scale["rounds"])
+    result["build"] = measure(lambda: schedule_index.ScheduleIndex(texts), scale["rounds"])
+    result["scan"] = measure(scan, scale["rounds"])
+    result["entries"] = len(texts)
+    return result
+
+
+def seed_relationships(count):
+    """把 synthetic.relationships(count) 写为关系快照（清空日志），返回加载后的关系表"""
+    import auth
+    for path in (auth.RELATIONSHIPS_FILE, auth.RELATIONSHIPS_LOG):
+        if os.path.exists(path):
+            os.remove(path)
+    auth.save_user_relationships(synthetic.relationships(count))
+    return auth.load_user_relationships()
+
+
+# 加入已有关系网络的新用户，与其中每个用户建立绑定
+NEWCOMER = "newcomer"
+
+
+@benchmark("binding.single_ops")
+def bench_binding_single(scale):
+    import auth
+    names = synthetic.usernames(scale["users"])
+
+    def run(rels):
+        # 逐个发送并接受请求，每次操作都保存一次（与页面上的按钮一致）
+        for name in names:
+            auth.send_binding_request(name, NEWCOMER, rels)
+            auth.save_user_relationships(rels)
+            auth.accept_binding_request(NEWCOMER, name, rels)
+            auth.save_user_relationships(rels)
+
+    result = measure(run, scale["rounds"], lambda: seed_relationships(scale["users"]))
+    result["operations"] = 2 * len(names)
+    return result
+
+
+@benchmark("binding.bulk_ops")
+def bench_binding_bulk(scale):
+    import auth
+    names = synthetic.usernames(scale["users"])
+
+    def run(rels):
+        auth.bind_many(names, NEWCOMER, rels)
+        auth.save_user_relationships(rels)
+        for name in names:
+            auth.accept_binding_request(NEWCOMER, name, rels)
+        auth.save_user_relationships(rels)
+        auth.unbind_all(NEWCOMER, rels)
+        auth.save_user_relationships(rels)
+
+    result = measure(run, scale["rounds"], lambda: seed_relationships(scale["users"]))
+    result["operations"] = 3 * len(names)
+    return result
+
+
+@benchmark("session.warm_load")
+def bench_session_warm_load(scale):
+    """新会话加载关系表和小组表：复制进程内常驻表，与每次从磁盘读取对比"""
+    import auth
+    import groups
+    names = synthetic.usernames(scale["users"])
+    seed_relationships(scale["users"])
+
+    def load():
+        auth.load_user_relationships()
+        groups.load_groups()
+
+    def read():
+        auth._read_user_relationships()
+        groups._read_groups()
+
+    load()
+    result = measure(load, scale["rounds"])
+    result["cold"] = measure(read, scale["rounds"])
+    result["users"] = len(names)
+    return result
+
+
+def _schedule_page(root, entries, viewer):
+    import sys
+    sys.path.insert(0, root)
+    import streamlit as st
+    from schedule import display_schedule_section
+    st.session_state.saved_texts = entries
+    display_schedule_section(viewer, lambda: {e["author"] for e in entries})
+
+
+@benchmark("render.schedule_page")
+def bench_render_schedule(scale):
+    from streamlit.testing.v1 import AppTest
+    names = synthetic.usernames(min(scale["users"], 20))
+    # 页面渲染成本与条目数成正比，这里限制条目数以保持可重复
+    entries = synthetic.schedules(min(scale["schedules"], 200), names)
+
+    def run():
+        app = AppTest.from_function(_schedule_page, args=(ROOT, entries, names[0]), default_timeout=120)
+        app.run()
+        if app.exception:
+            raise RuntimeError(app.exception[0].value)
+
+    result = measure(run, scale["rounds"])
+    result["entries"] = len(entries)
+    return result
+
+
+@benchmark("auth.login")
+def bench_auth_login(scale):
+    import bench_login
+    import credentials
+    cost = bench_login.bench_cost(credentials.SCRYPT_N, credentials.SCRYPT_R, credentials.SCRYPT_P, scale["rounds"])
+    # 以校验耗时作为登录延迟，同时保留哈希耗时和成本参数
+    result = dict(cost["verify"])
+    result["hash_mean_ms"] = cost["hash"]["mean_ms"]
+    result["cost"] = {"n": cost["n"], "r": cost["r"], "p": cost["p"]}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--rounds", type=int, help="覆盖预设的重复次数")
+    parser.add_argument("--only", nargs="*", help="只运行名称以这些前缀开头的基准")
+    parser.add_argument("--output", help="结果写入的JSON文件，默认输出到标准输出")
+    args = parser.parse_args()
+
+    scale = dict(SCALES[args.scale])
+    if args.rounds:
+        scale["rounds"] = args.rounds
+
+    selected = [name for name in BENCHMARKS
+                if not args.only or any(name.startswith(prefix) for prefix in args.only)]
+
+    workdir = tempfile.mkdtemp(prefix="lizhi-bench-")
+    original_cwd = os.getcwd()
+    os.chdir(workdir)
+    results = {}
+    try:
+        for name in selected:
+            try:
+                results[name] = BENCHMARKS[name](scale)
+            except Exception as e:
+                results[name] = {"error": f"{type(e).__name__}: {e}"}
+            print(f"{name}: {results[name].get('mean_ms', results[name].get('error'))}", file=sys.stderr)
+    finally:
+        os.chdir(original_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "suite": "lizhi-benchmarks",
+        "scale": args.scale,
+        "params": scale,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# benchmarks/startup_profile.py
+"""启动剖析：新进程中首次渲染页面的耗时和 -X importtime 导入开销分解
+
+用法: python benchmarks/startup_profile.py [--top 15] [--output startup.json]
+
+分别以未登录访客和已登录用户在全新的解释器里渲染一次 main_modern.py（数据目录为临时目录），
+记录首次渲染耗时、各顶层模块的累计导入耗时，以及 pandas/openpyxl/xlrd 等较重的依赖是否被加载。
+输出为JSON。
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ("pandas", "numpy", "openpyxl", "xlrd", "pyarrow")
+
+RENDER_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file({app!r}, default_timeout=120)
+if {user!r}:
+    app.session_state.current_user = {user!r}
+app.run()
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "first_render_ms": round(elapsed * 1000, 1),
+    "exceptions": [str(e.value) for e in app.exception],
+    "heavy_modules": {{name: name in sys.modules for name in {heavy!r}}},
+}}))
+"""
+
+SCENARIOS = {
+    "visitor": None,
+    "member": "profile_user",
+}
+
+
+def parse_importtime(stderr):
+    """解析 -X importtime 输出，返回 [(模块, 自身微秒, 累计微秒, 层级)]"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        self_us, cumulative_us, name = parts
+        # 名称前的空格表示嵌套层级：顶层模块为一个空格，每深一层多两个
+        level = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), level))
+    return rows
+
+
+def run_scenario(user, top):
+    data_root = tempfile.mkdtemp(prefix="lizhi-startup-")
+    env = dict(os.environ, LIZHI_DATA_ROOT=data_root)
+    script = RENDER_SCRIPT.format(root=ROOT, app=os.path.join(ROOT, "main_modern.py"), user=user, heavy=HEAVY_MODULES)
+    try:
+        completed = subprocess.run([sys.executable, "-X", "importtime", "-c", script],
+                                   cwd=data_root, env=env, capture_output=True, text=True)
+    finally:
+        shutil.rmtree(data_root, ignore_errors=True)
+    if completed.returncode != 0:
+        return {"error": completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "failed"}
+
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    rows = parse_importtime(completed.stderr)
+    top_level = [row for row in rows if row[3] == 0]
+    result["import_ms"] = round(sum(row[2] for row in top_level) / 1000, 1)
+    result["modules_imported"] = len(rows)
+    result["top_imports"] = [
+        {"module": name, "cumulative_ms": round(cumulative / 1000, 1), "self_ms": round(self_us / 1000, 1)}
+        for name, self_us, cumulative, _ in sorted(top_level, key=lambda row: -row[2])[:top]
+    ]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--top", type=int, default=15, help="列出累计导入耗时最高的顶层模块数")
+    parser.add_argument("--output", help="结果写入的JSON文件，默认输出到标准输出")
+    args = parser.parse_args()
+
+    report = {name: run_scenario(user, args.top) for name, user in SCENARIOS.items()}
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# benchmarks/synthetic.py
+"""基准测试用的合成数据：真实 第N节 × 星期X 布局的课表、用户、关系和日程"""
+import io
+import random
+from datetime import datetime, timedelta
+
+from openpyxl import Workbook
+
+WEEKDAYS = ["星期一", "星期二", "星期三", "星期四", "星期五", "星期六", "星期日"]
+COURSE_NAMES = [
+    "微积分A(1)", "线性代数", "离散数学(1)", "程序设计基础", "思想道德与法治", "英语阅读写作（B）",
+    "体育(1)", "计算机科学基础", "创意软件", "形势与政策（1）-秋", "大学物理B(1)", "概率论与数理统计",
+    "数据结构", "电路原理", "中国近现代史纲要", "写作与沟通",
+]
+TEACHERS = ["杨晶", "马昱春", "徐明星", "王雯姝", "陈渝", "刘璘", "车宗凯", "杨利军", "王俊林"]
+COURSE_TYPES = ["必修", "限选", "任选"]
+WEEK_SPECS = ["全周", "全周", "全周", "前八周", "后八周", "1-8周", "2-16周", "单周", "双周", "9-16周", "4周"]
+ROOMS = ["六教6A016", "三教2101", "明理楼214", "一教101", "三教2301", "六教6B105", "东区体育活动中心"]
+CATEGORIES = ["未分类", "工作", "个人", "学习", "想法", "其他"]
+
+
+def course_cell(rng):
+    """生成一个课表单元格，偶尔一个时段里有两门课"""
+    def one():
+        return (f"{rng.choice(COURSE_NAMES)}({rng.choice(TEACHERS)}；{rng.choice(COURSE_TYPES)}；"
+                f"{rng.choice(WEEK_SPECS)}；{rng.choice(ROOMS)})")
+    if rng.random() < 0.1:
+        return one() + "\r\n" + one()
+    return one()
+
+
+def timetable_rows(rng, periods=6, fill_ratio=0.5):
+    """课表网格：首行为星期，首列为第N节，空时段为None"""
+    rows = [[None] + WEEKDAYS]
+    for period in range(1, periods + 1):
+        row = [f"第{period}节"]
+        for _ in WEEKDAYS:
+            row.append(course_cell(rng) if rng.random() < fill_ratio else None)
+        rows.append(row)
+    return rows
+
+
+def timetable_workbook_bytes(seed=0, sheets=1, periods=6, fill_ratio=0.5, extra_rows=0):
+    """生成xlsx文件内容；sheets>1 时模拟按周/按班分表的院系导出，extra_rows 模拟带名单的大表"""
+    rng = random.Random(seed)
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    for index in range(sheets):
+        sheet = workbook.create_sheet(title=f"第{index + 1}周" if sheets > 1 else "课程表")
+        for row in timetable_rows(rng, periods, fill_ratio):
+            sheet.append(row)
+        for extra in range(extra_rows):
+            sheet.append([f"备注{extra}"] + [course_cell(rng) for _ in WEEKDAYS])
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
+class FakeUpload(io.BytesIO):
+    """模拟 st.file_uploader 返回的 UploadedFile"""
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+        self.file_id = f"bench-{name}"
+
+
+def usernames(count):
+    return [f"student{i:04d}" for i in range(count)]
+
+
+def relationships(count, partners_per_user=5, seed=0):
+    """每个用户随机绑定若干伙伴的关系表"""
+    rng = random.Random(seed)
+    names = usernames(count)
+    table = {name: {"sent_requests": [], "received_requests": [], "binded_users": []} for name in names}
+    for name in names:
+        for partner in rng.sample(names, min(partners_per_user, count)):
+            if partner != name and partner not in table[name]["binded_users"]:
+                table[name]["binded_users"].append(partner)
+                table[partner]["binded_users"].append(name)
+    return table
+
+
+def schedules(count, authors, seed=0, timed=False):
+    """日程条目列表，字段与 schedule.py 保存的一致；timed=True 时大部分条目带时间段，部分为每周重复"""
+    rng = random.Random(seed)
+    start = datetime(2025, 9, 1, 8, 0)
+    entries = []
+    for i in range(count):
+        created = (start + timedelta(minutes=rng.randint(0, 60 * 24 * 120))).strftime("%Y-%m-%d %H:%M:%S")
+        content = f"复习{rng.choice(COURSE_NAMES)}第{rng.randint(1, 12)}章，完成习题{rng.randint(1, 50)}"
+        entries.append({
+            "id": i,
+            "title": f"日程_{i}",
+            "content": content,
+            "tags": rng.sample(["重要", "作业", "考试", "小组"], rng.randint(0, 2)),
+            "category": rng.choice(CATEGORIES),
+            "author": rng.choice(authors),
+            "created_at": created,
+            "updated_at": created,
+            "char_count": len(content),
+        })
+        if timed and rng.random() < 0.8:
+            begin = start + timedelta(days=rng.randint(0, 120), hours=rng.randint(0, 13))
+            entries[-1]["start_at"] = begin.strftime("%Y-%m-%d %H:%M")
+            entries[-1]["end_at"] = (begin + timedelta(minutes=rng.choice([30, 60, 90, 120]))).strftime("%Y-%m-%d %H:%M")
+            if rng.random() < 0.1:
+                entries[-1]["recurrence"] = "weekly"
+                entries[-1]["recurrence_until"] = (begin + timedelta(weeks=8)).strftime("%Y-%m-%d")
+    return entries
@@ -0,0 +1,128 @@
+# conflicts.py
+import threading
+
+from period_config import get_period_schedule
+from schedule_index import occurrences
+from timetable_model import WEEKDAYS, get_timetable_model, week_of, weeks_to_text, semester_start, semester_end
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def _slot_label(slot, timetable_name):
+    return f"{slot.name}（{timetable_name}，{slot.weeks_text}）"
+
+
+def find_course_conflicts(user_timetables):
+    """课程与课程的冲突：同一星期同一节次、上课周有交集的两门课
+
+    user_timetables 为 {课表名: 课表记录}。先按 (星期, 节次) 分组，组内用周次位掩码的交集判断冲突。
+    """
+    cells = {}
+    for name, record in user_timetables.items():
+        for slot in get_timetable_model(record).slots:
+            cells.setdefault((slot.day, slot.period), []).append((name, slot))
+
+    conflicts = []
+    for (day, period), entries in sorted(cells.items()):
+        if len(entries) < 2:
+            continue
+        for i, (name_a, slot_a) in enumerate(entries):
+            for name_b, slot_b in entries[i + 1:]:
+                overlap = slot_a.weeks & slot_b.weeks
+                if overlap:
+                    conflicts.append({
+                        'kind': 'course',
+                        'day': day,
+                        'period': period,
+                        'weeks': overlap,
+                        'description': f"{WEEKDAYS[day]} 第{period}节 {weeks_to_text(overlap)}: "
+                                       f"{_slot_label(slot_a, name_a)} 与 {_slot_label(slot_b, name_b)}",
+                    })
+    return conflicts
+
+
+def find_schedule_conflicts(user_timetables, schedules, first_monday=None):
+    """日程与课程的冲突：日程的时间段与当天某节课的上课时间重叠
+
+    重复日程逐次检查，同一门课的多次冲突合并为一条，描述中给出第一次冲突的时间和次数。
+    学期和作息在开始时取一次，逐条日程比较时不再重复读取。
+    """
+    models = [(name, get_timetable_model(record)) for name, record in user_timetables.items()]
+    period_schedule = get_period_schedule()
+    first_monday = first_monday or semester_start()
+    last_day = semester_end(first_monday)
+    conflicts = []
+    for entry in schedules:
+        found = {}
+        for start_at, end_at in occurrences(entry, last_day):
+            week = week_of(start_at, first_monday)
+            if week is None:
+                continue
+            for name, model in models:
+                for slot in model.courses_on_day(start_at.weekday(), week):
+                    bounds = period_schedule.bounds(start_at.date(), slot.period)
+                    if bounds and start_at < bounds[1] and bounds[0] < end_at:
+                        found.setdefault((name, slot.day, slot.period, slot.name), []).append((start_at, slot))
+        for (name, _, _, _), hits in found.items():
+            start_at, slot = hits[0]
+            times = f"（共{len(hits)}次）" if len(hits) > 1 else ""
+            conflicts.append({
+                'kind': 'schedule',
+                'day': slot.day,
+                'period': slot.period,
+                'schedule_id': entry.get('id'),
+                'description': f"{start_at.strftime('%m-%d %H:%M')} 日程「{entry.get('title', '')}」"
+                               f"与第{slot.period}节 {_slot_label(slot, name)} 冲突{times}",
+            })
+    return conflicts
+
+
+def _timetable_signature(user_timetables):
+    return frozenset((name, record.get('file_hash')) for name, record in user_timetables.items())
+
+
+def _schedule_signature(schedules):
+    return tuple((entry.get('id'), entry.get('title'), entry.get('start_at'), entry.get('end_at'),
+                  entry.get('recurrence'), entry.get('recurrence_until')) for entry in schedules)
+
+
+def get_user_conflicts(timetables, schedules, user):
+    """用户自己的课表之间、课表与日程之间的冲突，按用户缓存
+
+    课程冲突和日程冲突分别缓存：只修改日程时不会重新比较课表。
+    缓存同时校验课表/日程的签名，即使漏掉失效通知也不会返回过期结果。
+    """
+    user_timetables = {name: record for name, record in timetables.items() if record.get('uploaded_by') == user}
+    user_schedules = [entry for entry in schedules if entry.get('author') == user and entry.get('start_at')]
+    timetable_signature = _timetable_signature(user_timetables)
+    # 日程冲突还取决于作息时间和学期，变化后重新计算
+    first_monday = semester_start()
+    schedule_signature = (timetable_signature, get_period_schedule().digest, first_monday,
+                          _schedule_signature(user_schedules))
+
+    with _lock:
+        cached = dict(_cache.get(user, {}))
+
+    if cached.get('timetable_signature') != timetable_signature:
+        cached['course'] = find_course_conflicts(user_timetables)
+        cached['timetable_signature'] = timetable_signature
+    if cached.get('schedule_signature') != schedule_signature:
+        cached['schedule'] = find_schedule_conflicts(user_timetables, user_schedules, first_monday)
+        cached['schedule_signature'] = schedule_signature
+
+    with _lock:
+        _cache[user] = cached
+    return cached['course'] + cached['schedule']
+
+
+def invalidate_user_conflicts(user, timetables=True, schedules=True):
+    """课表或日程变化时只清除该用户的缓存"""
+    with _lock:
+        cached = _cache.get(user)
+        if cached is None:
+            return
+        if timetables:
+            _cache.pop(user, None)
+        elif schedules:
+            cached.pop('schedule_signature', None)
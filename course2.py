@@ -5,17 +5,32 @@ from io import BytesIO
 import datetime
 import uuid
 import hashlib
+import importlib.util
 import os
-import json
-import pickle
-import random
-import string
+import threading
 
-# 定义数据存储目录和文件
-DATA_DIR = "./timetable_data"
-TIMETABLES_FILE = os.path.join(DATA_DIR, "timetables.pkl")
-METADATA_FILE = os.path.join(DATA_DIR, "metadata.json")
-USERS_FILE = os.path.join(DATA_DIR, "users.json")
+from fragments import rerun_section, invalidate, consume_invalidation, in_fragment_rerun
+from instrumentation import timed, count_bytes
+from excel_reader import read_excel_bytes, read_workbook
+from upload_jobs import UploadQueue, STATUS_LABELS
+from timetable_model import (
+    WEEKDAYS, SEMESTER_WEEKS, week_of, semester_start, semester_end, courses_on_date, current_course, next_class,
+)
+from period_config import get_period_schedule, get_period_config_error
+from conflicts import get_user_conflicts, invalidate_user_conflicts
+from schedule import load_schedule_data
+from timetable_diff import add_version, changes_since_previous
+from week_view import render_week_grid, free_slots
+from timetable_record import TimetableRecord
+from exporters import EXPORT_FORMATS, export_file
+from event_bus import get_event_bus
+from shared_storage import DATA_DIR
+from timetable_store import get_timetable_store, put_op, delete_op
+from storage_maintenance import check_write_quota, last_maintenance_report
+
+# 数据根目录见 shared_storage.DATA_ROOT；用户数据只由 user_directory.UserDirectory 读写
+# 同一进程内各会话与后台导入任务共用的存储锁；跨进程由课表存储在文件锁内读写（见 timetable_store）
+STORAGE_LOCK = threading.RLock()
 
 def ensure_data_dir():
     """确保数据目录存在"""
@@ -40,77 +55,78 @@ def init_timetable_session_state():
     if 'last_upload_time' not in st.session_state:
         st.session_state.last_upload_time = None
     
-    # 从本地存储加载数据
-    load_timetables_from_storage()
-
-def load_users():
-    """加载用户数据"""
-    try:
-        if os.path.exists(USERS_FILE):
-            with open(USERS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        else:
-            return {}
-    except Exception as e:
-        st.error(f"加载用户数据失败: {str(e)}")
-        return {}
-
-def save_users(users_data=None):
-    """保存用户数据"""
+    # 从本地存储加载数据：只有存储（可能由其他进程）变化或被其他区块标记过期时才重新加载
+    store = get_timetable_store()
     try:
-        if users_data is None:
-            users_data = st.session_state.users
-        
-        with open(USERS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(users_data, f, ensure_ascii=False, indent=2)
-        return True
+        store.refresh()
     except Exception as e:
-        st.error(f"保存用户数据失败: {str(e)}")
-        return False
-
-def save_timetables_to_storage():
-    """将课表数据保存到本地存储"""
-    try:
-        # 保存课表数据
-        with open(TIMETABLES_FILE, 'wb') as f:
-            # 使用pickle保存DataFrame数据
-            pickle.dump(st.session_state.timetables, f)
-        
-        # 保存元数据（文件哈希值）
-        metadata = {
-            'uploaded_file_hashes': list(st.session_state.uploaded_file_hashes),
-            'last_saved': datetime.datetime.now().isoformat()
-        }
-        with open(METADATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, ensure_ascii=False, indent=2)
-        
-        return True
-    except Exception as e:
-        st.error(f"保存数据时出错: {str(e)}")
-        return False
+        st.warning(f"读取课表存储时遇到问题: {str(e)}")
+    invalidated = consume_invalidation("timetable")
+    if invalidated or st.session_state.get('timetables_version') != store.version:
+        load_timetables_from_storage()
 
+@timed()
 def load_timetables_from_storage():
     """从本地存储加载课表数据"""
     try:
-        # 加载课表数据
-        if os.path.exists(TIMETABLES_FILE):
-            with open(TIMETABLES_FILE, 'rb') as f:
-                loaded_timetables = pickle.load(f)
-                # 清空当前数据，用加载的数据替换
-                st.session_state.timetables.clear()
-                st.session_state.timetables.update(loaded_timetables)
-        
-        # 加载元数据
-        if os.path.exists(METADATA_FILE):
-            with open(METADATA_FILE, 'r', encoding='utf-8') as f:
-                metadata = json.load(f)
-                st.session_state.uploaded_file_hashes.update(metadata.get('uploaded_file_hashes', []))
+        # 课表存储在进程内常驻，这里只取出当前状态的副本
+        loaded_timetables, file_hashes, version = get_timetable_store().snapshot()
+        # 清空当前数据，用加载的数据替换
+        st.session_state.timetables.clear()
+        st.session_state.timetables.update(loaded_timetables)
+        st.session_state.uploaded_file_hashes.update(file_hashes)
+        st.session_state.timetables_version = version
         
         return True
     except Exception as e:
         st.warning(f"加载保存的数据时遇到问题: {str(e)}")
         return False
 
+def find_previous_upload(records, file_name, user):
+    """同一用户之前上传的同名文件对应的课表名称（重新上传时作为新版本），没有则返回 None"""
+    matches = [name for name, record in records.items()
+               if record.get('uploaded_by') == user and record.get('file_name') == file_name]
+    if not matches:
+        return None
+    return max(matches, key=lambda name: records[name].get('upload_time', ''))
+
+def merge_upload(records, timetable_name, record):
+    """把新上传的课表放入 records：重新上传的文件替换旧版本并记录差异，返回 (课表名称, 是否有变化)"""
+    previous_name = find_previous_upload(records, record['file_name'], record.get('uploaded_by'))
+    if previous_name is None:
+        timetable_name = unique_timetable_name(timetable_name, record.get('uploaded_by'), records)
+        records[timetable_name] = record
+        return timetable_name, True
+    
+    previous = records[previous_name]
+    if previous.get('file_hash') == record['file_hash']:
+        # 内容完全相同，无需保存新版本
+        return previous_name, False
+    records[previous_name] = TimetableRecord.from_mapping(add_version(previous, record))
+    return previous_name, True
+
+def commit_timetable(timetable_name, record):
+    """把后台任务生成的课表记录合并写入存储（读取最新状态-合并-追加日志），返回最终的课表名称"""
+    store = get_timetable_store()
+    with STORAGE_LOCK, store.transaction():
+        stored = store.records()
+        records = dict(stored)
+        timetable_name, changed = merge_upload(records, timetable_name, record)
+        if not changed:
+            return timetable_name
+        # 重新上传的文件作为已有课表的新版本，不计入课表数量配额
+        ops = [put_op(timetable_name, records[timetable_name])]
+        allowed, message = check_write_quota(stored, ops)
+        if not allowed:
+            raise ValueError(message)
+        store.apply(ops)
+        is_locked = records[timetable_name].get('is_locked', False)
+    invalidate_user_conflicts(record.get('uploaded_by'))
+    # 上锁的课表仅自己可见，不向伙伴通知，避免泄露名称和动态
+    if not is_locked:
+        get_event_bus().publish("timetable", record.get('uploaded_by'), action="更新", name=timetable_name)
+    return timetable_name
+
 def get_file_hash(file):
     """生成文件的哈希值用于唯一标识"""
     return hashlib.md5(file.getvalue()).hexdigest()
@@ -120,59 +136,98 @@ def validate_excel_file(file):
     valid_extensions = ('.xlsx', '.xls')
     return any(file.name.lower().endswith(ext) for ext in valid_extensions)
 
+@timed()
 def read_excel_file(file):
-    """读取Excel文件，自动选择引擎"""
+    """读取Excel文件，优先使用流式读取引擎，失败时回退到 pandas"""
+    data = file.getvalue()
+    count_bytes("read", len(data))
+    if not file.name.lower().endswith(('.xlsx', '.xls')):
+        return None, "不支持的文件格式"
     try:
-        # 根据文件扩展名选择引擎
-        if file.name.lower().endswith('.xlsx'):
-            df = pd.read_excel(file, engine='openpyxl')
-        elif file.name.lower().endswith('.xls'):
-            try:
-                df = pd.read_excel(file, engine='xlrd')
-            except ImportError:
-                return None, "读取.xls文件需要安装xlrd库，请运行: pip install xlrd"
-        else:
-            return None, "不支持的文件格式"
+        df, _ = read_excel_bytes(data, file.name)
         return df, None
+    except ImportError:
+        return None, "读取.xls文件需要安装xlrd库，请运行: pip install xlrd"
+    except Exception:
+        pass
+    
+    # 流式引擎无法处理的文件，回退到完整的 pandas 读取
+    try:
+        engine = 'openpyxl' if file.name.lower().endswith('.xlsx') else 'xlrd'
+        df = pd.read_excel(BytesIO(data), engine=engine)
+        return df, None
+    except ImportError:
+        return None, "读取.xls文件需要安装xlrd库，请运行: pip install xlrd"
     except Exception as e:
         return None, f"读取文件时出错: {str(e)}"
 
-def save_timetable(file, df, timetable_name, is_locked=False):
-    """保存课表到session state和本地存储"""
-    # 确保timetable_name是唯一的
-    if timetable_name in st.session_state.timetables:
+@timed()
+def read_excel_workbook(file, progress=None):
+    """读取Excel文件中的全部工作表，返回 ({工作表名: DataFrame}, 错误信息)"""
+    data = file.getvalue()
+    if not file.name.lower().endswith(('.xlsx', '.xls')):
+        return None, "不支持的文件格式"
+    try:
+        sheets = read_workbook(data, file.name, progress=progress)
+        count_bytes("read", len(data))
+        return sheets, None
+    except ImportError:
+        return None, "读取.xls文件需要安装xlrd库，请运行: pip install xlrd"
+    except Exception:
+        pass
+
+    # 无法逐表读取时按单表处理
+    df, error = read_excel_file(file)
+    if error:
+        return None, error
+    return {"课程表": df}, None
+
+def unique_timetable_name(timetable_name, user, existing):
+    """生成不与已有课表冲突的课表名称"""
+    if timetable_name in existing:
         # 如果名称已存在，添加时间戳和用户名
         timestamp = datetime.datetime.now().strftime("%H%M%S")
-        user_suffix = f"_{st.session_state.current_user}" if st.session_state.current_user else ""
-        timetable_name = f"{timetable_name}{user_suffix}_{timestamp}"
-    elif st.session_state.current_user:
+        user_suffix = f"_{user}" if user else ""
+        return f"{timetable_name}{user_suffix}_{timestamp}"
+    if user:
         # 添加用户标识
-        timetable_name = f"{timetable_name}_{st.session_state.current_user}"
-    
-    # 生成文件哈希值
-    file_hash = get_file_hash(file)
-    
-    st.session_state.timetables[timetable_name] = {
+        return f"{timetable_name}_{user}"
+    return timetable_name
+
+def build_timetable_record(file, df, uploaded_by, is_locked=False, sheets=None):
+    """构造课表记录"""
+    record = {
         'file_name': file.name,
         'dataframe': df,
         'upload_time': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        'uploaded_by': st.session_state.current_user or "匿名用户",
+        'uploaded_by': uploaded_by or "匿名用户",
         'is_locked': is_locked,  # 上锁状态
-        'file_hash': file_hash   # 存储文件哈希值
+        'file_hash': get_file_hash(file)   # 存储文件哈希值
     }
-    
-    # 记录文件哈希值，避免重复上传
-    st.session_state.uploaded_file_hashes.add(file_hash)
-    
-    # 保存到本地存储
-    save_timetables_to_storage()
-    
-    # 设置强制刷新标志
-    st.session_state.force_refresh = True
-    st.session_state.last_upload_time = datetime.datetime.now()
-    
-    return timetable_name
+    if sheets and len(sheets) > 1:
+        # 按周/按班分表的工作簿作为一个课表保存，'dataframe' 保留第一个工作表以兼容旧逻辑
+        record['sheets'] = sheets
+    return TimetableRecord.from_mapping(record)
 
+def process_upload_job(job):
+    """后台导入任务：解析 → 整理 → 保存，返回最终的课表名称"""
+    sheets, error = read_excel_workbook(job.file, job.report_parse_progress)
+    if error:
+        raise ValueError(error)
+    if not sheets:
+        raise ValueError("文件为空文件或读取失败")
+    
+    job.set_stage("storing", 0.9, "正在保存")
+    df = next(iter(sheets.values()))
+    record = build_timetable_record(job.file, df, job.user, job.is_locked, sheets)
+    return commit_timetable(job.file.name.rsplit('.', 1)[0], record)
+
+@st.cache_resource
+def get_upload_queue():
+    """进程内共享的后台导入队列"""
+    return UploadQueue(process_upload_job)
+
+@timed()
 def delete_timetable(timetable_name, binded_users):
     """删除指定的课表 - 简化权限检查逻辑"""
     if timetable_name not in st.session_state.timetables:
@@ -183,9 +238,6 @@ def delete_timetable(timetable_name, binded_users):
     uploader = timetable_data.get('uploaded_by')
     is_locked = timetable_data.get('is_locked', False)
     
-    # 调试信息
-    print(f"删除检查: 当前用户={current_user}, 上传者={uploader}, 是否上锁={is_locked}, 绑定用户={binded_users}")
-    
     # 权限检查：上传者可以删除自己的课表（无论是否上锁）
     if current_user == uploader:
         # 上传者可以删除自己的课表
@@ -201,16 +253,21 @@ def delete_timetable(timetable_name, binded_users):
             return False, "您只能删除自己上传的课表或绑定用户的课表"
     
     try:
-        # 从uploaded_file_hashes中移除对应的哈希值，允许重新上传
+        # 在存储锁内按最新数据删除，其他会话或进程刚保存的课表不会被覆盖；
+        # 同时移除对应的哈希值，允许重新上传
         file_hash = timetable_data.get('file_hash')
-        if file_hash and file_hash in st.session_state.uploaded_file_hashes:
-            st.session_state.uploaded_file_hashes.remove(file_hash)
-        
-        # 删除课表
-        del st.session_state.timetables[timetable_name]
+        store = get_timetable_store()
+        with STORAGE_LOCK, store.transaction():
+            store.apply([delete_op(timetable_name, file_hash)])
+            records, file_hashes, version = store.snapshot()
         
-        # 更新本地存储
-        save_timetables_to_storage()
+        st.session_state.timetables.clear()
+        st.session_state.timetables.update(records)
+        st.session_state.timetables_version = version
+        st.session_state.uploaded_file_hashes = file_hashes
+        invalidate_user_conflicts(uploader)
+        if not is_locked:
+            get_event_bus().publish("timetable", current_user, action="删除", name=timetable_name)
         
         # 设置状态标志
         st.session_state.delete_success = True
@@ -219,17 +276,23 @@ def delete_timetable(timetable_name, binded_users):
         return True, f"成功删除课表: {timetable_name}"
     except Exception as e:
         return False, f"删除课表时出错: {str(e)}"
-def create_download_button(df, file_name, context=""):
-    """创建下载按钮 - 动态生成唯一key"""
+@timed()
+def create_download_button(df, file_name, context="", sheets=None):
+    """创建下载按钮 - 动态生成唯一key；多工作表的课表按原工作表导出"""
     output = BytesIO()
     
     # 统一使用.xlsx格式下载，避免依赖问题
     download_name = file_name.rsplit('.', 1)[0] + '.xlsx'
     
     with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='课程表')
+        if sheets:
+            for sheet_name, sheet_df in sheets.items():
+                sheet_df.to_excel(writer, index=False, sheet_name=str(sheet_name)[:31])
+        else:
+            df.to_excel(writer, index=False, sheet_name='课程表')
     
     processed_data = output.getvalue()
+    count_bytes("written", len(processed_data))
     
     # 动态生成唯一key，包含上下文信息避免重复
     button_key = f"download_{context}_{uuid.uuid4().hex[:8]}"
@@ -242,8 +305,92 @@ def create_download_button(df, file_name, context=""):
         key=button_key
     )
 
-def display_timetable_main_modified(binded_users):
-    """修改后的主界面显示课程表 - 只显示绑定用户的课表，考虑上锁状态"""
+def create_export_button(records, file_stem, fmt, context=""):
+    """按课程模型导出 ics/csv/json 的下载按钮；导出文件按 file_hash 和格式缓存在磁盘上"""
+    path = export_file(records, fmt)
+    with open(path, 'rb') as f:
+        st.download_button(
+            label=f"📥 下载 {file_stem}.{fmt}",
+            data=f,
+            file_name=f"{file_stem}.{fmt}",
+            mime=EXPORT_FORMATS[fmt]["mime"],
+            key=f"export_{context}_{fmt}"
+        )
+
+def filter_visible_timetables(timetables, current_user, visible_users):
+    """过滤可见课表：自己的课表总是可见，可见用户的课表只有未上锁时可见"""
+    visible_timetables = {}
+    for name, data in timetables.items():
+        uploader = data.get('uploaded_by')
+        if uploader == current_user:
+            visible_timetables[name] = data
+        elif uploader in visible_users and not data.get('is_locked', False):
+            visible_timetables[name] = data
+    return visible_timetables
+
+def display_next_class():
+    """显示当前用户今天的课程和下一节课（基于缓存的课表编译结果，不扫描DataFrame）"""
+    user = st.session_state.current_user
+    if not user:
+        return
+    now = datetime.datetime.now()
+    upcoming = next_class(st.session_state.timetables, user, now)
+    if upcoming is None:
+        # 只有指定的开学日期已过期时学期才会在今天之前结束，提示管理员更新设置
+        last_day = semester_end(semester_start(now.date()))
+        if now.date() > last_day:
+            st.caption(f"📅 本学期已于 {last_day:%Y-%m-%d} 结束，请在作息配置的 semester.start 中设置新学期的开学日期")
+        return
+    
+    ongoing = current_course(st.session_state.timetables, user, now)
+    starts_at, slot = upcoming
+    when = "今天" if starts_at.date() == now.date() else f"{starts_at.strftime('%m-%d')} {WEEKDAYS[slot.day]}"
+    room = f" · {slot.room}" if slot.room else ""
+    message = f"📌 下一节课: **{slot.name}** · {when} 第{slot.period}节 {starts_at.strftime('%H:%M')}{room}"
+    if ongoing:
+        message = f"🟢 正在上课: **{ongoing.name}**（第{ongoing.period}节）　" + message
+    st.info(message)
+    
+    today_courses = courses_on_date(st.session_state.timetables, user, now)
+    if today_courses:
+        week = week_of(now)
+        period_schedule = get_period_schedule()
+        with st.expander(f"📅 今日课程（第{week}周 {WEEKDAYS[now.weekday()]}，共{len(today_courses)}节）"):
+            for course in today_courses:
+                start, end = course.time_range(period_schedule)
+                details = " · ".join(part for part in (course.teacher, course.room) if part)
+                st.markdown(f"- 第{course.period}节 {start}-{end} **{course.name}** {details}")
+
+def display_conflicts():
+    """显示当前用户课表之间、课表与日程之间的时间冲突"""
+    user = st.session_state.current_user
+    if not user:
+        return
+    if 'saved_texts' not in st.session_state:
+        st.session_state.saved_texts = load_schedule_data()
+    conflicts = get_user_conflicts(st.session_state.timetables, st.session_state.saved_texts, user)
+    if not conflicts:
+        return
+    
+    with st.expander(f"⚠️ 检测到 {len(conflicts)} 个时间冲突"):
+        for conflict in conflicts:
+            icon = "📚" if conflict['kind'] == 'course' else "📝"
+            st.markdown(f"- {icon} {conflict['description']}")
+
+def display_version_changes(timetable_data, changes, changed_cells):
+    """显示课表相对上一版本的变化"""
+    versions = timetable_data['versions']
+    label = f"🔄 自上一版本以来的变化（更新于 {timetable_data['upload_time']}，共 {len(versions)} 个历史版本）"
+    with st.expander(label):
+        icons = {'added': '➕', 'removed': '➖', 'changed': '✏️'}
+        for kind, description in changes:
+            st.markdown(f"- {icons[kind]} {description}")
+        if not changes:
+            st.caption("课程安排没有变化")
+        st.caption(f"共 {changed_cells} 个单元格发生变化，上一版本上传于 {versions[-1]['upload_time']}")
+
+def display_timetable_main_modified(visible_users):
+    """修改后的主界面显示课程表 - 只显示绑定用户和同组成员的课表，考虑上锁状态"""
     st.header("📅 课程表总览")
     
     # 检查删除成功状态
@@ -255,22 +402,13 @@ def display_timetable_main_modified(binded_users):
         st.info("📚 暂无课程表数据，请在导入页面上传课程表文件")
         return
     
-    # 显示存储状态信息
-    storage_info = get_storage_info()
-    st.sidebar.info(f"💾 本地存储: {storage_info}")
+    display_next_class()
+    display_conflicts()
     
-    # 过滤课表：只显示当前用户和绑定用户的课表，且绑定用户的课表必须未上锁
-    visible_timetables = {}
-    for name, data in st.session_state.timetables.items():
-        uploader = data.get('uploaded_by')
-        is_locked = data.get('is_locked', False)
-        
-        # 当前用户自己的课表总是可见
-        if uploader == st.session_state.current_user:
-            visible_timetables[name] = data
-        # 绑定用户的课表只有未上锁时才可见
-        elif uploader in binded_users and not is_locked:
-            visible_timetables[name] = data
+    # 过滤课表：只显示当前用户和可见用户的课表，且他人的课表必须未上锁
+    visible_timetables = filter_visible_timetables(
+        st.session_state.timetables, st.session_state.current_user, visible_users
+    )
     
     if not visible_timetables:
         st.info("📚 暂无可见的课程表数据，请先绑定账号或上传自己的课表")
@@ -284,14 +422,14 @@ def display_timetable_main_modified(binded_users):
     with col2:
         filter_option = st.selectbox(
             "筛选显示:",
-            ["所有课表", "我上传的课表", "绑定用户课表"]
+            ["所有课表", "我上传的课表", "伙伴课表"]
         )
     
     # 根据筛选条件过滤课表
     if filter_option == "我上传的课表" and st.session_state.current_user:
         timetable_names = [name for name in timetable_names 
                           if visible_timetables[name].get('uploaded_by') == st.session_state.current_user]
-    elif filter_option == "绑定用户课表" and st.session_state.current_user:
+    elif filter_option == "伙伴课表" and st.session_state.current_user:
         timetable_names = [name for name in timetable_names 
                           if visible_timetables[name].get('uploaded_by') != st.session_state.current_user]
     
@@ -306,6 +444,7 @@ def display_timetable_main_modified(binded_users):
         with tab:
             timetable_data = visible_timetables[timetable_name]
             df = timetable_data['dataframe']
+            sheets = timetable_data.get('sheets')
             
             # 课表信息
             col1, col2 = st.columns([3, 1])
@@ -323,7 +462,22 @@ def display_timetable_main_modified(binded_users):
                 st.caption(f"文件: {timetable_data['file_name']} | 上传时间: {timetable_data['upload_time']}{uploader_info}")
             
             with col2:
-                create_download_button(df, timetable_data['file_name'], f"main_{timetable_name}_{i}")
+                create_download_button(df, timetable_data['file_name'], f"main_{timetable_name}_{i}", sheets)
+            
+            # 多工作表课表：选择要查看的工作表（每次只渲染一个）
+            if sheets:
+                sheet_name = st.radio(
+                    f"工作表（共{len(sheets)}个）",
+                    list(sheets.keys()),
+                    horizontal=True,
+                    key=f"sheet_{timetable_name}"
+                )
+                df = sheets[sheet_name]
+            
+            # 重新上传过的课表：显示与上一版本相比的变化
+            changes = changes_since_previous(timetable_data)
+            if changes is not None:
+                display_version_changes(timetable_data, *changes)
             
             # 显示完整课表数据
             st.dataframe(df, use_container_width=True, height=400)
@@ -343,14 +497,74 @@ def display_timetable_main_modified(binded_users):
                     num_cols = len(df.select_dtypes(include=['number']).columns)
                     st.metric("数据类型", f"{text_cols}文本/{num_cols}数值")
 
+def display_group_week_view(visible_users):
+    """伙伴周视图：把自己和伙伴的课表合并为一张 星期 × 节次 的表格"""
+    st.header("👥 伙伴周视图")
+    current_user = st.session_state.current_user
+    visible_timetables = filter_visible_timetables(st.session_state.timetables, current_user, visible_users)
+    users = sorted({record.get('uploaded_by') for record in visible_timetables.values()},
+                   key=lambda user: (user != current_user, user))
+    if not users:
+        st.info("📚 暂无可见的课程表数据，请先绑定账号或上传自己的课表")
+        return
+    
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        selected_users = st.multiselect(
+            "显示的用户:",
+            users,
+            default=users,
+            format_func=lambda user: "我" if user == current_user else user,
+            key="week_view_users"
+        )
+    with col2:
+        current_week = week_of(datetime.date.today()) or 1
+        week = st.selectbox(
+            "周次:",
+            list(range(1, SEMESTER_WEEKS + 1)),
+            index=current_week - 1,
+            format_func=lambda number: f"第{number}周",
+            key="week_view_week"
+        )
+    
+    records = [(record['uploaded_by'], record) for record in visible_timetables.values()
+               if record.get('uploaded_by') in selected_users]
+    if not records:
+        st.info("请选择至少一位用户")
+        return
+    
+    st.markdown(render_week_grid(records, week, current_user), unsafe_allow_html=True)
+    
+    # 导出所选用户整个学期的课程日历：点击后才生成文件，浏览周视图时不写磁盘
+    names_by_record = {id(record): name for name, record in visible_timetables.items()}
+    export_records = [(names_by_record[id(record)], record) for _, record in records]
+    selection = tuple(sorted(name for name, _ in export_records))
+    if st.button("📅 生成伙伴学期日历", key="week_view_prepare_export"):
+        st.session_state.week_view_export = selection
+    if st.session_state.get('week_view_export') == selection:
+        create_export_button(export_records, "伙伴学期日历", "ics", "week_view")
+    
+    free = free_slots(records, week)
+    with st.expander(f"🕒 所有人都空闲的时段（{len(free)} 个）"):
+        period_schedule = get_period_schedule()
+        for period, day in free:
+            start, end = period_schedule.clock_range(period)
+            st.markdown(f"- {WEEKDAYS[day]} 第{period}节 {start}-{end}")
+
 def get_storage_info():
     """获取存储信息"""
     try:
-        if os.path.exists(TIMETABLES_FILE):
-            file_size = os.path.getsize(TIMETABLES_FILE)
-            file_size_kb = file_size / 1024
+        stats = get_timetable_store().stats()
+        if stats['snapshot_bytes'] or stats['wal_bytes']:
+            file_size_kb = (stats['snapshot_bytes'] + stats['wal_bytes']) / 1024
             user_count = len(set(data.get('uploaded_by', '未知') for data in st.session_state.timetables.values()))
-            return f"{len(st.session_state.timetables)}个课表, {user_count}个用户 ({file_size_kb:.1f}KB)"
+            info = (f"{len(st.session_state.timetables)}个课表, {user_count}个用户 "
+                    f"({file_size_kb:.1f}KB, 日志{stats['wal_records']}条)")
+            report = last_maintenance_report()
+            if report:
+                info += (f"；{report['time'][5:16]} 整理 {report['before']['total'] / 1024:.1f}KB"
+                         f" → {report['after']['total'] / 1024:.1f}KB")
+            return info
         else:
             return "未初始化"
     except:
@@ -365,13 +579,6 @@ def import_timetable_section():
         st.warning("请先登录以上传课表")
         return
     
-    # 依赖检查
-    try:
-        import xlrd
-        st.sidebar.success("✅ 支持.xls和.xlsx格式")
-    except ImportError:
-        st.sidebar.warning("⚠️ 仅支持.xlsx格式 (安装xlrd后可支持.xls)")
-    
     with st.expander("💡 使用说明", expanded=True):
         st.markdown("""
         ### 导入说明：
@@ -379,13 +586,20 @@ def import_timetable_section():
         - **依赖要求**: 
           - .xlsx格式: 已支持 ✅
           - .xls格式: 需要安装xlrd库 ⚠️
-        - 可以同时导入多个课程表
+        - 可以同时导入多个课程表，文件在后台解析保存，导入期间可以继续浏览其他页面
         - 导入后可以在主页面查看课程表
         - **数据持久化**: 课表数据会自动保存，下次打开页面时自动加载
         - **账号绑定**: 只有绑定的用户才能查看彼此的课表
         - **上锁功能**: 上锁的课表只有自己可见，绑定用户无法查看和删除
         """)
     
+    # 上锁选项对本次选择的所有文件生效
+    is_locked = st.checkbox(
+        "🔒 上锁本次导入的课表（仅自己可见，其他人无法删除）",
+        key="upload_lock",
+        help="上锁后，绑定用户将无法查看和删除这些课表"
+    )
+    
     # 文件上传
     uploaded_files = st.file_uploader(
         "选择Excel课程表文件",
@@ -395,73 +609,82 @@ def import_timetable_section():
         key="file_uploader"
     )
     
-    # 处理上传的文件
+    # 新选择的文件提交到后台导入队列，页面重新运行时不会重复导入
     if uploaded_files:
-        success_count = 0
+        submitted = st.session_state.setdefault('submitted_upload_ids', set())
+        job_ids = st.session_state.setdefault('upload_job_ids', [])
+        queue = get_upload_queue()
+        new_jobs = 0
         for file in uploaded_files:
-            # 检查文件是否已经上传过（但允许删除后重新上传）
-            file_hash = get_file_hash(file)
-            # 不再检查文件哈希值，允许重新上传同名文件
+            upload_id = getattr(file, 'file_id', None) or get_file_hash(file)
+            if upload_id in submitted:
+                continue
+            submitted.add(upload_id)
             
-            if validate_excel_file(file):
-                try:
-                    # 检查.xls文件的依赖
-                    if file.name.lower().endswith('.xls'):
-                        try:
-                            import xlrd
-                        except ImportError:
-                            st.error(f"❌ 无法读取 {file.name}: 需要安装xlrd库。请运行: pip install xlrd")
-                            continue
-                    
-                    # 读取Excel文件
-                    df, error = read_excel_file(file)
-                    
-                    if error:
-                        st.error(f"❌ 读取文件 {file.name} 时出错: {error}")
-                        continue
-                    
-                    if df is None or df.empty:
-                        st.warning(f"⚠️ 文件 {file.name} 为空文件或读取失败")
-                        continue
-                    
-                    # 添加上锁选项
-                    is_locked = st.checkbox(
-                        f"🔒 上锁此课表（仅自己可见，其他人无法删除）", 
-                        key=f"lock_{file.name}_{uuid.uuid4().hex[:8]}",  # 使用唯一key
-                        help="上锁后，绑定用户将无法查看和删除此课表"
-                    )
-                    
-                    # 生成课表名称
-                    timetable_name = file.name.rsplit('.', 1)[0]
-                    
-                    # 保存课表
-                    timetable_name = save_timetable(file, df, timetable_name, is_locked)
-                    success_count += 1
-                    
-                    st.success(f"✅ 成功导入: {file.name}")
-                    
-                    # 显示简要预览
-                    with st.expander(f"预览: {file.name}", expanded=False):
-                        st.write(f"数据维度: {df.shape[0]} 行 × {df.shape[1]} 列")
-                        st.dataframe(df.head(5), use_container_width=True)
-                    
-                except Exception as e:
-                    st.error(f"❌ 处理文件 {file.name} 时出错: {str(e)}")
-            else:
+            if not validate_excel_file(file):
                 st.error(f"❌ 文件 {file.name} 不是有效的Excel格式")
-        
-        if success_count > 0:
-            st.balloons()
-            st.success(f"🎉 成功导入 {success_count} 个课程表！")
+                continue
             
-            # 显示存储状态
-            storage_info = get_storage_info()
-            st.info(f"💾 课表数据已保存: {storage_info}")
+            # 检查.xls文件的依赖
+            if file.name.lower().endswith('.xls'):
+                if importlib.util.find_spec("xlrd") is None:
+                    st.error(f"❌ 无法读取 {file.name}: 需要安装xlrd库。请运行: pip install xlrd")
+                    continue
             
-            # 立即刷新页面
+            job = queue.submit(file, st.session_state.current_user, is_locked)
+            job_ids.append(job.id)
+            new_jobs += 1
+        
+        if new_jobs:
+            st.info(f"📥 已加入后台导入队列: {new_jobs} 个文件，导入期间可以继续浏览其他页面")
+    
+    upload_progress_panel()
+
+def upload_progress_panel():
+    """显示本会话提交的导入任务进度；有任务未完成时定时刷新"""
+    job_ids = st.session_state.get('upload_job_ids', [])
+    if not job_ids:
+        return
+    jobs = get_upload_queue().get_jobs(job_ids)
+    active = any(not job.finished for job in jobs)
+    st.fragment(_render_upload_progress, run_every=1.0 if active else None)()
+
+def _render_upload_progress():
+    jobs = get_upload_queue().get_jobs(st.session_state.get('upload_job_ids', []))
+    if not jobs:
+        return
+    
+    st.subheader("导入进度")
+    for job in jobs:
+        icon = {"done": "✅", "failed": "❌"}.get(job.status, "⏳")
+        detail = f" - {job.message}" if job.message else ""
+        st.progress(job.progress, text=f"{icon} {job.file_name}: {STATUS_LABELS[job.status]}{detail}")
+    
+    done_count = sum(1 for job in jobs if job.status == "done")
+    failed_count = sum(1 for job in jobs if job.status == "failed")
+    finished_count = done_count + failed_count
+    
+    # 有任务新完成时整页重新运行一次，让课表总览和侧边栏加载新保存的课表
+    if finished_count != st.session_state.get('upload_jobs_refreshed', 0):
+        st.session_state.upload_jobs_refreshed = finished_count
+        if in_fragment_rerun():
             st.rerun()
-        else:
-            st.info("没有新文件需要导入")
+    
+    if finished_count < len(jobs):
+        st.caption(f"已完成 {finished_count}/{len(jobs)} 个文件")
+        return
+    
+    if done_count > 0:
+        st.success(f"🎉 成功导入 {done_count} 个课程表！")
+        # 显示存储状态
+        st.info(f"💾 课表数据已保存: {get_storage_info()}")
+    if failed_count > 0:
+        st.warning(f"⚠️ {failed_count} 个文件导入失败")
+    
+    if st.button("清除导入记录", key="clear_upload_jobs"):
+        st.session_state.upload_job_ids = []
+        st.session_state.upload_jobs_refreshed = 0
+        rerun_section()
 
 def download_timetable_section():
     """下载课程表功能部分"""
@@ -483,7 +706,26 @@ def download_timetable_section():
         create_download_button(
             timetable_data['dataframe'], 
             timetable_data['file_name'],
-            f"download_page_{timetable_name}_{i}"
+            f"download_page_{timetable_name}_{i}",
+            timetable_data.get('sheets')
+        )
+    
+    # 其他格式：由课程模型生成，可导入手机日历
+    st.markdown("#### 其他格式")
+    col1, col2 = st.columns(2)
+    with col1:
+        export_name = st.selectbox("选择课表:", timetable_names, key="export_timetable")
+    with col2:
+        export_format = st.selectbox(
+            "导出格式:",
+            list(EXPORT_FORMATS),
+            format_func=lambda fmt: EXPORT_FORMATS[fmt]["label"],
+            key="export_format"
+        )
+    if export_name:
+        create_export_button(
+            [(export_name, st.session_state.timetables[export_name])],
+            export_name, export_format, "download_page"
         )
     
     # 批量下载
@@ -522,10 +764,13 @@ def process_pending_deletions(binded_users):
             else:
                 st.error(message)
         st.session_state.timetables_to_delete = []
-        st.rerun()
+        rerun_section()
 
-def timetable_management_tab_modified(binded_users):
-    """修改后的课程表管理标签页 - 只显示绑定用户的课表，支持绑定用户删除"""
+def timetable_management_tab_modified(binded_users, visible_users=None):
+    """修改后的课程表管理标签页 - 显示绑定用户和同组成员的课表，支持绑定用户删除"""
+    binded_users = set(binded_users)
+    if visible_users is None:
+        visible_users = binded_users
     # 初始化
     init_timetable_session_state()
     
@@ -535,7 +780,7 @@ def timetable_management_tab_modified(binded_users):
     # 检查是否需要强制刷新
     if st.session_state.force_refresh:
         st.session_state.force_refresh = False
-        st.rerun()
+        rerun_section()
     
     # 检查登录状态
     if not st.session_state.current_user:
@@ -543,97 +788,117 @@ def timetable_management_tab_modified(binded_users):
         return
     
     # 创建子标签页
-    tab_names = ["主页", "导入课程表", "下载课程表"]
+    tab_names = ["主页", "伙伴周视图", "导入课程表", "下载课程表"]
     
     tabs = st.tabs(tab_names)
     
     with tabs[0]:
-        display_timetable_main_modified(binded_users)
+        display_timetable_main_modified(visible_users)
     
     with tabs[1]:
-        import_timetable_section()
+        display_group_week_view(visible_users)
     
     with tabs[2]:
+        import_timetable_section()
+    
+    with tabs[3]:
         download_timetable_section()
+
+def timetable_sidebar(binded_users, visible_users=None):
+    """课程表侧边栏 - 存储信息、可见课表列表和删除操作，需在 with st.sidebar 中调用"""
+    init_timetable_session_state()
+    binded_users = set(binded_users)
+    if visible_users is None:
+        visible_users = binded_users
     
-    # 侧边栏信息
-    with st.sidebar:
-        st.header("📚 课程表管理")
-        
-        # 显示存储信息
-        storage_info = get_storage_info()
-        st.info(f"💾 数据存储: {storage_info}")
-        
-        # 显示绑定状态
-        if st.session_state.current_user:
-            if binded_users:
-                st.success(f"🔗 已绑定 {len(binded_users)} 个用户")
-            else:
-                st.info("🔗 暂无绑定用户")
+    if not st.session_state.current_user:
+        return
+    
+    st.header("📚 课程表管理")
+    
+    # 依赖检查：只查找是否安装，真正读取.xls文件时才导入
+    if importlib.util.find_spec("xlrd") is not None:
+        st.success("✅ 支持.xls和.xlsx格式")
+    else:
+        st.warning("⚠️ 仅支持.xlsx格式 (安装xlrd后可支持.xls)")
+    
+    # 显示存储信息
+    storage_info = get_storage_info()
+    st.info(f"💾 数据存储: {storage_info}")
+    
+    # 作息配置有误时提示（已退回默认作息）
+    period_config_error = get_period_config_error()
+    if period_config_error:
+        st.warning(f"⚠️ {period_config_error}")
+    else:
+        st.caption(f"🕐 作息时间: {get_period_schedule().institution}")
+    
+    # 显示绑定状态
+    if st.session_state.current_user:
+        if binded_users:
+            st.success(f"🔗 已绑定 {len(binded_users)} 个用户")
+        else:
+            st.info("🔗 暂无绑定用户")
+    
+    # 过滤可见课表：当前用户和可见用户的课表（他人的课表必须未上锁）
+    visible_timetables = filter_visible_timetables(
+        st.session_state.timetables, st.session_state.current_user, visible_users
+    )
+    
+    if visible_timetables:
+        st.subheader(f"可见课表 ({len(visible_timetables)})")
         
-        # 过滤可见课表：当前用户和绑定用户的课表（绑定用户的课表必须未上锁）
-        visible_timetables = {}
-        for name, data in st.session_state.timetables.items():
-            uploader = data.get('uploaded_by')
-            is_locked = data.get('is_locked', False)
-            
-            if uploader == st.session_state.current_user:
-                visible_timetables[name] = data
-            elif uploader in binded_users and not is_locked:
-                visible_timetables[name] = data
+        # 使用列表来避免迭代时修改字典的问题
+        timetable_items = list(visible_timetables.items())
         
-        if visible_timetables:
-            st.subheader(f"可见课表 ({len(visible_timetables)})")
-            
-            # 使用列表来避免迭代时修改字典的问题
-            timetable_items = list(visible_timetables.items())
-            
-            # 添加单个删除功能
-            for name, data in timetable_items:
-                with st.expander(f"📋 {name}"):
-                    # 显示锁状态
-                    is_locked = data.get('is_locked', False)
-                    lock_status = " 🔒" if is_locked else " 🔓"
-                    
-                    st.caption(f"文件: {data['file_name']}{lock_status}")
-                    st.caption(f"上传: {data['upload_time']}")
-                    uploader = data.get('uploaded_by', '未知')
-                    if uploader == st.session_state.current_user:
-                        uploader_info = " | 上传者: 👤 我"
-                    else:
-                        uploader_info = f" | 上传者: 👥 {uploader}"
-                    st.caption(f"数据: {len(data['dataframe'])}行 × {len(data['dataframe'].columns)}列{uploader_info}")
-                    
-                    # 检查删除权限
-                    current_user = st.session_state.current_user
-                    uploader = data.get('uploaded_by')
-                    is_locked = data.get('is_locked', False)
-                    
-                    can_delete = False
-                    if current_user == uploader:
-                        # 上传者可以删除自己的课表（无论是否上锁）
-                        can_delete = True
-                    elif not is_locked and uploader in binded_users:
-                        # 绑定用户只能删除未上锁的课表
-                        can_delete = True
-                    
-                    if can_delete:
-                        # 使用确认对话框防止误操作
-                        delete_confirmed = st.checkbox(f"确认删除 {name}", key=f"confirm_delete_{name}")
-                        if delete_confirmed:
-                            delete_key = f"delete_{name}"
-                            if st.button("🗑️ 确认删除此课表", key=delete_key, use_container_width=True, type="primary"):
-                                # 直接删除课表
-                                success, message = delete_timetable(name, binded_users)
-                                if success:
-                                    st.success(message)
-                                    st.rerun()
-                                else:
-                                    st.error(message)
+        # 添加单个删除功能
+        for name, data in timetable_items:
+            with st.expander(f"📋 {name}"):
+                # 显示锁状态
+                is_locked = data.get('is_locked', False)
+                lock_status = " 🔒" if is_locked else " 🔓"
+                
+                st.caption(f"文件: {data['file_name']}{lock_status}")
+                st.caption(f"上传: {data['upload_time']}")
+                uploader = data.get('uploaded_by', '未知')
+                if uploader == st.session_state.current_user:
+                    uploader_info = " | 上传者: 👤 我"
+                else:
+                    uploader_info = f" | 上传者: 👥 {uploader}"
+                rows, cols = data.shape
+                st.caption(f"数据: {rows}行 × {cols}列{uploader_info}")
+                
+                # 检查删除权限
+                current_user = st.session_state.current_user
+                uploader = data.get('uploaded_by')
+                is_locked = data.get('is_locked', False)
+                
+                can_delete = False
+                if current_user == uploader:
+                    # 上传者可以删除自己的课表（无论是否上锁）
+                    can_delete = True
+                elif not is_locked and uploader in binded_users:
+                    # 绑定用户只能删除未上锁的课表
+                    can_delete = True
+                
+                if can_delete:
+                    # 使用确认对话框防止误操作
+                    delete_confirmed = st.checkbox(f"确认删除 {name}", key=f"confirm_delete_{name}")
+                    if delete_confirmed:
+                        delete_key = f"delete_{name}"
+                        if st.button("🗑️ 确认删除此课表", key=delete_key, use_container_width=True, type="primary"):
+                            # 直接删除课表
+                            success, message = delete_timetable(name, binded_users)
+                            if success:
+                                st.success(message)
+                                # 课表主区块也需要刷新
+                                invalidate("timetable")
+                            else:
+                                st.error(message)
+                else:
+                    if is_locked:
+                        st.caption("❌ 课表已上锁，无法删除")
                     else:
-                        if is_locked:
-                            st.caption("❌ 课表已上锁，无法删除")
-                        else:
-                            st.caption("❌ 无删除权限")
-        else:
-            st.info("暂无可见课表数据")
\ No newline at end of file
+                        st.caption("❌ 无删除权限")
+    else:
+        st.info("暂无可见课表数据")
\ No newline at end of file
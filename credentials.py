@@ -0,0 +1,158 @@
+# credentials.py
+import base64
+import collections
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+
+# scrypt 成本参数，可通过环境变量调整（N 必须是2的幂）
+SCRYPT_N = int(os.environ.get("LIZHI_SCRYPT_N", 2 ** 14))
+SCRYPT_R = int(os.environ.get("LIZHI_SCRYPT_R", 8))
+SCRYPT_P = int(os.environ.get("LIZHI_SCRYPT_P", 1))
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+# 登录限流：连续失败达到次数后锁定，锁定时间逐次翻倍
+MAX_FAILED_ATTEMPTS = 5
+LOCKOUT_SECONDS = 30
+MAX_LOCKOUT_SECONDS = 15 * 60
+# 失败记录在最后一次失败后保留的时间，以及最多同时记录的用户名数（超出时丢弃最久未失败的）
+FAILURE_TTL_SECONDS = 60 * 60
+MAX_TRACKED_USERNAMES = 10000
+
+# 已验证会话的有效期
+SESSION_TTL_SECONDS = 12 * 60 * 60
+
+def _b64encode(data):
+    return base64.b64encode(data).decode('ascii')
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(
+        password.encode('utf-8'),
+        salt=salt,
+        n=n,
+        r=r,
+        p=p,
+        maxmem=256 * n * r + 1024 * 1024,
+        dklen=KEY_BYTES
+    )
+
+def hash_password(password, n=None, r=None, p=None):
+    """生成加盐的scrypt密码哈希，格式: scrypt$N$r$p$salt$hash"""
+    n = n or SCRYPT_N
+    r = r or SCRYPT_R
+    p = p or SCRYPT_P
+    salt = secrets.token_bytes(SALT_BYTES)
+    key = _scrypt(password, salt, n, r, p)
+    return f"scrypt${n}${r}${p}${_b64encode(salt)}${_b64encode(key)}"
+
+def verify_password(password, encoded):
+    """校验密码是否与哈希匹配"""
+    try:
+        algorithm, n, r, p, salt, key = encoded.split("$")
+        if algorithm != "scrypt":
+            return False
+        expected = base64.b64decode(key)
+        actual = _scrypt(password, base64.b64decode(salt), int(n), int(r), int(p))
+    except (ValueError, TypeError):
+        return False
+    return hmac.compare_digest(actual, expected)
+
+def needs_rehash(encoded):
+    """哈希参数与当前成本参数不一致时需要重新生成"""
+    try:
+        algorithm, n, r, p, _, _ = encoded.split("$")
+    except (ValueError, AttributeError):
+        return True
+    return algorithm != "scrypt" or (int(n), int(r), int(p)) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+class LoginThrottle:
+    """按用户名统计失败次数，锁定期内直接拒绝，不再计算哈希"""
+
+    def __init__(self, max_attempts=MAX_FAILED_ATTEMPTS, lockout=LOCKOUT_SECONDS, max_lockout=MAX_LOCKOUT_SECONDS,
+                 ttl=FAILURE_TTL_SECONDS, max_entries=MAX_TRACKED_USERNAMES):
+        self.max_attempts = max_attempts
+        self.lockout = lockout
+        self.max_lockout = max_lockout
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # 用户名 → (失败次数, 锁定截止时间, 最后一次失败时间)，按最后一次失败的先后排列
+        self._failures = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        """丢弃过期的记录；仍超出上限时丢弃最久未失败的记录（任意用户名都会产生记录，必须有上限）"""
+        while self._failures:
+            _, (_, locked_until, last_failure) = next(iter(self._failures.items()))
+            expired = locked_until <= now and now - last_failure > self.ttl
+            if not expired and len(self._failures) <= self.max_entries:
+                break
+            self._failures.popitem(last=False)
+
+    def retry_after(self, username):
+        """距离允许再次尝试的剩余秒数，0表示可以尝试"""
+        with self._lock:
+            _, locked_until, _ = self._failures.get(username, (0, 0.0, 0.0))
+        return max(0.0, locked_until - time.monotonic())
+
+    def record_failure(self, username):
+        now = time.monotonic()
+        with self._lock:
+            count, _, last_failure = self._failures.pop(username, (0, 0.0, 0.0))
+            if now - last_failure > self.ttl:
+                count = 0
+            count += 1
+            locked_until = 0.0
+            if count >= self.max_attempts:
+                rounds = count - self.max_attempts
+                locked_until = now + min(self.lockout * (2 ** rounds), self.max_lockout)
+            self._failures[username] = (count, locked_until, now)
+            self._expire(now)
+
+    def record_success(self, username):
+        with self._lock:
+            self._failures.pop(username, None)
+
+class SessionTokenCache:
+    """已验证会话令牌缓存 - 重新运行脚本时只需查表，无需再次校验密码"""
+
+    def __init__(self, ttl=SESSION_TTL_SECONDS):
+        self.ttl = ttl
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def issue(self, username):
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._tokens[token] = (username, time.monotonic() + self.ttl)
+        return token
+
+    def validate(self, token):
+        """返回令牌对应的用户名，无效或过期返回None"""
+        if not token:
+            return None
+        with self._lock:
+            entry = self._tokens.get(token)
+            if entry is None:
+                return None
+            username, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._tokens[token]
+                return None
+        return username
+
+    def revoke(self, token):
+        with self._lock:
+            self._tokens.pop(token, None)
+
+    def revoke_user(self, username):
+        with self._lock:
+            for token in [t for t, (u, _) in self._tokens.items() if u == username]:
+                del self._tokens[token]
+
+# 进程级实例，所有会话共享
+login_throttle = LoginThrottle()
+session_tokens = SessionTokenCache()
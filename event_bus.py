@@ -0,0 +1,321 @@
+# event_bus.py
+import asyncio
+import collections
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import streamlit as st
+
+from instrumentation import span, count_bytes
+from shared_storage import data_path, file_lock, file_signature, replace_file
+
+OUTBOX_FILE = data_path("outbox.jsonl")
+OUTBOX_CURSORS_FILE = data_path("outbox_cursors.json")
+
+# 内存中保留的最近事件数（新会话补发未读事件时只查这部分）
+RECENT_EVENTS = 500
+# 发件箱超过这么多条时压缩，只保留最近的事件
+OUTBOX_MAX_EVENTS = 2000
+# 会话超过这么久（秒）没有轮询视为已关闭
+SESSION_TTL = 600
+# 检查其他服务进程写入发件箱的间隔（秒）
+OUTBOX_POLL_SECONDS = 1.0
+
+logger = logging.getLogger(__name__)
+
+EVENT_LABELS = {
+    "binding_request": "{actor} 向你发送了连接请求",
+    "binding_accepted": "{actor} 接受了你的连接请求",
+    "binding_rejected": "{actor} 拒绝了连接请求",
+    "bound": "{actor} 与你建立了连接",
+    "unbound": "{actor} 解除了与你的连接",
+    "timetable": "{actor} {action}了课表「{name}」",
+    "schedule": "{actor} {action}了日程「{title}」",
+}
+
+# 各类事件影响的页面数据：binding 为关系表，其余为 fragments.invalidate 的区块名
+EVENT_SECTIONS = {
+    "binding_request": ("binding",),
+    "binding_accepted": ("binding", "timetable", "schedule"),
+    "binding_rejected": ("binding",),
+    "bound": ("binding", "timetable", "schedule"),
+    "unbound": ("binding", "timetable", "schedule"),
+    "timetable": ("timetable",),
+    "schedule": ("schedule",),
+}
+
+# 关系操作对应的通知：(事件类型, 操作者字段, 接收者字段)
+RELATIONSHIP_EVENTS = {
+    "send": ("binding_request", "from", "to"),
+    "accept": ("binding_accepted", "to", "from"),
+    "reject": ("binding_rejected", "to", "from"),
+    "bind": ("bound", "from", "to"),
+    "unbind": ("unbound", "from", "to"),
+}
+
+
+def describe_event(event):
+    """事件的通知文字"""
+    template = EVENT_LABELS.get(event.get('kind'), "{actor} 有新的动态")
+    try:
+        return template.format(actor=event.get('actor'), **event.get('payload', {}))
+    except KeyError:
+        return f"{event.get('actor')} 有新的动态"
+
+
+class Subscription:
+    """一个活动会话的订阅：用户、可见用户集合和待取走的事件队列"""
+
+    __slots__ = ("user", "visible", "queue", "last_seen")
+
+    def __init__(self, user, visible):
+        self.user = user
+        self.visible = frozenset(visible)
+        self.queue = queue.SimpleQueue()
+        self.last_seen = time.monotonic()
+
+    def wants(self, event):
+        if event['actor'] == self.user:
+            return False
+        if event['recipients'] is not None:
+            return self.user in event['recipients']
+        # 未指定接收者的共享更新发给能看到操作者的用户
+        return event['actor'] in self.visible
+
+
+class EventBus:
+    """进程内事件总线
+
+    publish 可以在任意线程调用，事件交给后台线程中的 asyncio 事件循环：
+    先批量追加到发件箱文件持久化，再分发到各活动会话的队列。
+    会话在轮询时取走自己队列中的事件，登录时补发上次标记已读之后的事件。
+
+    多个服务进程共用同一个发件箱：追加在文件锁内进行，事件ID在锁内接着文件中最大的ID分配；
+    事件循环定时读取其他进程追加的事件并分发给本进程的会话。
+    """
+
+    def __init__(self, outbox_path=OUTBOX_FILE, cursors_path=OUTBOX_CURSORS_FILE):
+        self.outbox_path = outbox_path
+        self.cursors_path = cursors_path
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._recent = collections.deque(maxlen=RECENT_EVENTS)
+        self._outbox_count = 0
+        self._outbox_inode = None
+        self._offset = 0
+        self._last_id = 0
+        self._cursors = self._load_cursors()
+        self._recent.extend(self._read_new())
+
+        self._loop = asyncio.new_event_loop()
+        self._inbox = None
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(ready,), name="event-bus", daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def _load_cursors(self):
+        try:
+            with open(self.cursors_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _read_new(self):
+        """读取发件箱中新追加的完整事件（只在构造时和事件循环线程中调用）"""
+        signature = file_signature(self.outbox_path)
+        if signature is None:
+            return []
+        inode, _, size = signature
+        if inode != self._outbox_inode or size < self._offset:
+            # 其他进程压缩过发件箱，从头读取，靠事件ID跳过已处理的事件
+            self._outbox_inode, self._offset, self._outbox_count = inode, 0, 0
+        if size == self._offset:
+            return []
+        with open(self.outbox_path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        # 最后一行可能还在写入中，只处理到最后一个换行符
+        end = data.rfind(b"\n") + 1
+        self._offset += end
+        count_bytes("read", end)
+        events = []
+        for line in data[:end].splitlines():
+            try:
+                event = json.loads(line)
+            except ValueError:
+                # 写入中断留下的半行
+                continue
+            self._outbox_count += 1
+            if event.get('id', 0) > self._last_id:
+                self._last_id = event['id']
+                events.append(event)
+        return events
+
+    def _run(self, ready):
+        asyncio.set_event_loop(self._loop)
+        self._inbox = asyncio.Queue()
+        self._loop.create_task(self._pump())
+        self._loop.create_task(self._watch())
+        ready.set()
+        self._loop.run_forever()
+
+    async def _pump(self):
+        while True:
+            batch = [await self._inbox.get()]
+            while not self._inbox.empty():
+                batch.append(self._inbox.get_nowait())
+            foreign = []
+            try:
+                with file_lock(self.outbox_path):
+                    # 先读入其他进程追加的事件，再接着最大的ID编号
+                    foreign = self._read_new()
+                    for event in batch:
+                        self._last_id += 1
+                        event['id'] = self._last_id
+                    self._append_outbox(batch)
+                    if self._outbox_count > OUTBOX_MAX_EVENTS:
+                        self._compact_outbox(foreign + batch)
+            except Exception:
+                # 持久化失败时仍然推送给在线会话；任何异常都不能让事件循环的任务退出
+                logger.exception("写入发件箱失败")
+                for event in batch:
+                    if 'id' not in event:
+                        self._last_id += 1
+                        event['id'] = self._last_id
+            try:
+                self._dispatch(foreign + batch)
+            except Exception:
+                logger.exception("分发事件失败")
+
+    async def _watch(self):
+        """定时分发其他服务进程写入的事件"""
+        while True:
+            await asyncio.sleep(OUTBOX_POLL_SECONDS)
+            try:
+                foreign = self._read_new()
+                if foreign:
+                    self._dispatch(foreign)
+            except Exception:
+                logger.exception("读取其他进程的事件失败")
+
+    def _append_outbox(self, batch):
+        payload = "".join(json.dumps(event, ensure_ascii=False) + "\n" for event in batch)
+        with span("event_bus.append", events=len(batch)):
+            os.makedirs(os.path.dirname(self.outbox_path) or ".", exist_ok=True)
+            with open(self.outbox_path, 'a', encoding='utf-8') as f:
+                f.write(payload)
+                f.flush()
+                self._outbox_inode = os.fstat(f.fileno()).st_ino
+                self._offset = f.tell()
+        count_bytes("written", len(payload.encode('utf-8')))
+        self._outbox_count += len(batch)
+
+    def _compact_outbox(self, pending):
+        """发件箱只保留最近的事件（包括刚读入或写入、尚未分发的事件）"""
+        with self._lock:
+            events = (list(self._recent) + pending)[-RECENT_EVENTS:]
+        replace_file(self.outbox_path, lambda f: f.writelines(
+            json.dumps(event, ensure_ascii=False) + "\n" for event in events
+        ))
+        signature = file_signature(self.outbox_path)
+        self._outbox_inode, self._offset = signature[0], signature[2]
+        self._outbox_count = len(events)
+
+    def _dispatch(self, batch):
+        now = time.monotonic()
+        with self._lock:
+            self._recent.extend(batch)
+            for session_id, subscription in list(self._sessions.items()):
+                if now - subscription.last_seen > SESSION_TTL:
+                    del self._sessions[session_id]
+                    continue
+                for event in batch:
+                    if subscription.wants(event):
+                        subscription.queue.put(event)
+
+    def publish(self, kind, actor, recipients=None, **payload):
+        """发布事件；recipients 为 None 时发给能看到 actor 的所有用户"""
+        event = {
+            'kind': kind,
+            'actor': actor,
+            'recipients': sorted(recipients) if recipients is not None else None,
+            'payload': payload,
+            'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        self._loop.call_soon_threadsafe(self._inbox.put_nowait, event)
+
+    def subscribe(self, session_id, user, visible_users):
+        """登记或刷新会话的订阅；新订阅会收到该用户上次已读之后的事件"""
+        with self._lock:
+            subscription = self._sessions.get(session_id)
+            if subscription is not None and subscription.user == user:
+                subscription.visible = frozenset(visible_users)
+                subscription.last_seen = time.monotonic()
+                return subscription
+            subscription = Subscription(user, visible_users)
+            # 已读位置可能由其他进程更新过
+            cursor = max(self._cursors.get(user, 0), self._load_cursors().get(user, 0))
+            for event in self._recent:
+                if event['id'] > cursor and subscription.wants(event):
+                    subscription.queue.put(event)
+            self._sessions[session_id] = subscription
+            return subscription
+
+    def unsubscribe(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def poll(self, session_id):
+        """取走会话队列中的全部事件"""
+        with self._lock:
+            subscription = self._sessions.get(session_id)
+            if subscription is None:
+                return []
+            subscription.last_seen = time.monotonic()
+        events = []
+        while True:
+            try:
+                events.append(subscription.queue.get_nowait())
+            except queue.Empty:
+                return events
+
+    def acknowledge(self, user, event_id):
+        """标记用户已读到 event_id，之后登录的会话不再补发这些事件"""
+        with self._lock:
+            if event_id <= self._cursors.get(user, 0):
+                return
+            self._cursors[user] = event_id
+            cursors = dict(self._cursors)
+        self._loop.call_soon_threadsafe(self._save_cursors, cursors)
+
+    def _save_cursors(self, cursors):
+        try:
+            with file_lock(self.cursors_path):
+                # 与其他进程写入的已读位置合并，各用户取较大的值
+                for user, event_id in self._load_cursors().items():
+                    cursors[user] = max(cursors.get(user, 0), event_id)
+                replace_file(self.cursors_path, lambda f: json.dump(cursors, f, ensure_ascii=False))
+        except OSError:
+            pass
+
+    def publish_relationship_ops(self, ops):
+        """把已保存的关系操作转换为通知"""
+        for op in ops:
+            mapping = RELATIONSHIP_EVENTS.get(op.get("op"))
+            if mapping is None:
+                continue
+            kind, actor_field, recipient_field = mapping
+            if op.get(actor_field) and op.get(recipient_field):
+                self.publish(kind, op[actor_field], [op[recipient_field]])
+
+
+@st.cache_resource
+def get_event_bus():
+    """进程内共享的事件总线"""
+    return EventBus()
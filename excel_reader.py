@@ -0,0 +1,206 @@
+# excel_reader.py
+import contextlib
+import datetime
+import io
+import multiprocessing
+import os
+import sys
+import threading
+import types
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
+
+# 文件小于该大小时逐个解析工作表，进程间传输的开销比解析本身还大
+PARALLEL_MIN_BYTES = 256 * 1024
+MAX_PARSE_WORKERS = min(os.cpu_count() or 1, 8)
+
+_process_pool = None
+_pool_lock = threading.Lock()
+
+def available_engines():
+    """当前环境可用的读取引擎，按优先级排列"""
+    engines = ["calamine"] if CalamineWorkbook is not None else []
+    return engines + ["openpyxl-stream", "pandas"]
+
+def _normalize_cell(value):
+    """与 pandas 的单元格转换保持一致：空单元格为空串，整数值的浮点数转为整数"""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def _trim_rows(rows):
+    """裁掉每行末尾的空单元格和表格末尾的空行，只保留实际使用的区域"""
+    data = []
+    last_row_with_data = -1
+    for row_number, row in enumerate(rows):
+        while row and row[-1] == "":
+            row.pop()
+        if row:
+            last_row_with_data = row_number
+        data.append(row)
+    data = data[:last_row_with_data + 1]
+    if data:
+        max_width = max(len(row) for row in data)
+        data = [row + [""] * (max_width - len(row)) for row in data]
+    return data
+
+def _normalize_calamine_cell(value):
+    # calamine 对日期单元格返回 date，openpyxl 返回 datetime，这里统一为 datetime
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        return datetime.datetime.combine(value, datetime.time())
+    return _normalize_cell(value)
+
+def _calamine_rows(workbook, sheet):
+    worksheet = workbook.get_sheet_by_index(sheet) if isinstance(sheet, int) else workbook.get_sheet_by_name(sheet)
+    return [[_normalize_calamine_cell(value) for value in row] for row in worksheet.to_python(skip_empty_area=False)]
+
+def _openpyxl_rows(workbook, sheet):
+    from openpyxl.cell.cell import ERROR_CODES
+
+    worksheet = workbook.worksheets[sheet] if isinstance(sheet, int) else workbook[sheet]
+    # 文件里记录的表格尺寸可能不准确，按实际内容读取
+    worksheet.reset_dimensions()
+    rows = []
+    for row in worksheet.iter_rows(values_only=True):
+        rows.append([
+            "" if isinstance(value, str) and value in ERROR_CODES else _normalize_cell(value)
+            for value in row
+        ])
+    return rows
+
+def rows_to_dataframe(rows):
+    """把单元格行转换为DataFrame，首行作为列名，类型推断与 pd.read_excel 相同"""
+    rows = _trim_rows(rows)
+    if not rows:
+        return pd.DataFrame()
+    return TextParser(rows, header=0).read()
+
+def _default_engine(file_name):
+    if CalamineWorkbook is not None:
+        return "calamine"
+    return "openpyxl-stream" if file_name.lower().endswith('.xlsx') else "pandas"
+
+def _iter_sheets(data, file_name, sheets, engine):
+    """逐个解析工作表，生成 (工作表, DataFrame)；整个过程中工作簿只打开一次"""
+    if engine == "calamine":
+        workbook = CalamineWorkbook.from_filelike(io.BytesIO(data))
+        for sheet in sheets:
+            yield sheet, rows_to_dataframe(_calamine_rows(workbook, sheet))
+    elif engine == "openpyxl-stream":
+        from openpyxl import load_workbook
+
+        # 只读流式模式：不构建完整的对象模型，只逐行读取单元格的值
+        workbook = load_workbook(io.BytesIO(data), read_only=True, data_only=True, keep_links=False)
+        try:
+            for sheet in sheets:
+                yield sheet, rows_to_dataframe(_openpyxl_rows(workbook, sheet))
+        finally:
+            workbook.close()
+    else:
+        pandas_engine = 'openpyxl' if file_name.lower().endswith('.xlsx') else 'xlrd'
+        with pd.ExcelFile(io.BytesIO(data), engine=pandas_engine) as workbook:
+            for sheet in sheets:
+                yield sheet, workbook.parse(sheet)
+
+def read_excel_sheets(data, file_name, sheets, engine=None):
+    """读取Excel文件中的多个工作表，工作簿只打开一次，返回 ({工作表: DataFrame}, 使用的引擎)"""
+    engine = engine or _default_engine(file_name)
+    return dict(_iter_sheets(data, file_name, sheets, engine)), engine
+
+def read_excel_bytes(data, file_name, sheet=0, engine=None):
+    """读取Excel文件中的一个工作表，返回 (DataFrame, 使用的引擎)"""
+    frames, engine = read_excel_sheets(data, file_name, [sheet], engine)
+    return frames[sheet], engine
+
+def list_sheet_names(data, file_name):
+    """列出工作簿中所有工作表的名称"""
+    if CalamineWorkbook is not None:
+        return list(CalamineWorkbook.from_filelike(io.BytesIO(data)).sheet_names)
+    if file_name.lower().endswith('.xlsx'):
+        from openpyxl import load_workbook
+        workbook = load_workbook(io.BytesIO(data), read_only=True, keep_links=False)
+        try:
+            return list(workbook.sheetnames)
+        finally:
+            workbook.close()
+    import xlrd
+    return xlrd.open_workbook(file_contents=data, on_demand=True).sheet_names()
+
+def _read_sheets_task(data, file_name, sheets):
+    """进程池中执行的解析任务：打开一次工作簿，解析分配到的一组工作表"""
+    return read_excel_sheets(data, file_name, sheets)[0]
+
+@contextlib.contextmanager
+def _bare_main():
+    """启动解析进程期间换上空的 __main__ 模块
+
+    streamlit run 把 __main__ 换成了应用脚本，spawn 启动的子进程会把它当作 __mp_main__ 重新执行整个页面。
+    子进程在 submit 时按需启动，因此创建进程池和提交任务都要在此范围内进行（调用方持有 _pool_lock）。
+    """
+    main = sys.modules.get("__main__")
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+def get_process_pool():
+    """进程内共享的解析进程池（使用spawn，避免在多线程服务器中fork）；调用方需持有 _pool_lock"""
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=MAX_PARSE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _process_pool
+
+def _reset_process_pool():
+    global _process_pool
+    with _pool_lock:
+        _process_pool = None
+
+def read_workbook(data, file_name, progress=None, parallel=None):
+    """读取工作簿中的全部工作表，返回 {工作表名: DataFrame}（忽略空表，保持原顺序）
+
+    多个工作表且文件较大时在进程池中并行解析；progress(已完成数, 总数, 工作表名) 用于报告进度。
+    """
+    names = list_sheet_names(data, file_name)
+    if parallel is None:
+        parallel = MAX_PARSE_WORKERS > 1 and len(names) > 1 and len(data) >= PARALLEL_MIN_BYTES
+
+    results = {}
+    if parallel:
+        try:
+            # 每个解析进程一组工作表：工作簿的字节和元数据每组只传输、解析一次，而不是每个工作表一次
+            groups = [names[i::MAX_PARSE_WORKERS] for i in range(min(MAX_PARSE_WORKERS, len(names)))]
+            with _pool_lock, _bare_main():
+                pool = get_process_pool()
+                futures = [pool.submit(_read_sheets_task, data, file_name, group) for group in groups]
+            for future in as_completed(futures):
+                for name, df in future.result().items():
+                    results[name] = df
+                    if progress:
+                        progress(len(results), len(names), name)
+        except BrokenProcessPool:
+            # 进程池不可用时退回逐个解析
+            _reset_process_pool()
+            results = {}
+            parallel = False
+
+    if not parallel:
+        for done, (name, df) in enumerate(_iter_sheets(data, file_name, names, _default_engine(file_name)), 1):
+            results[name] = df
+            if progress:
+                progress(done, len(names), name)
+
+    return {name: results[name] for name in names if not results[name].empty}
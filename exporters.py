@@ -0,0 +1,186 @@
+# exporters.py
+import csv
+import datetime
+import hashlib
+import io
+import json
+import os
+
+from instrumentation import span
+from period_config import get_period_schedule
+from shared_storage import data_path, replace_file
+from timetable_model import (
+    WEEKDAYS, SEMESTER_WEEKS, get_timetable_model, date_of, semester_start, weeks_to_text,
+)
+
+EXPORT_DIR = data_path("exports")
+TIMEZONE = "Asia/Shanghai"
+
+EXPORT_FORMATS = {
+    "ics": {"label": "iCalendar 日历 (.ics)", "mime": "text/calendar"},
+    "csv": {"label": "CSV 课程列表 (.csv)", "mime": "text/csv"},
+    "json": {"label": "JSON 课程数据 (.json)", "mime": "application/json"},
+}
+
+CSV_HEADER = ["星期", "节次", "开始时间", "结束时间", "课程", "教师", "类型", "地点", "周次", "上课周"]
+
+
+def _courses(records):
+    """按星期、节次排序的 (课表名, 上传者, CourseSlot)"""
+    for name, record in records:
+        for slot in get_timetable_model(record).slots:
+            yield name, record.get('uploaded_by', ''), slot
+
+
+def _ics_escape(text):
+    return (str(text).replace("\\", "\\\\").replace(";", "\\;")
+            .replace(",", "\\,").replace("\n", "\\n"))
+
+
+def _ics_line(line):
+    """按 RFC 5545 把超过75字节的内容行折行"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + "\r\n"
+    parts = []
+    current = ""
+    limit = 75
+    for char in line:
+        if len((current + char).encode('utf-8')) > limit:
+            parts.append(current)
+            current = char
+            limit = 74  # 续行以一个空格开头
+        else:
+            current += char
+    parts.append(current)
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def iter_ics(records, calendar_name="课程表"):
+    """生成 iCalendar 日历：每门课按上课周展开为具体日期的事件"""
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    first_monday = semester_start()
+    schedule = get_period_schedule()
+    yield "".join(_ics_line(line) for line in (
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//lizhi-creativity//timetable//CN",
+        "CALSCALE:GREGORIAN",
+        f"X-WR-CALNAME:{_ics_escape(calendar_name)}",
+        f"X-WR-TIMEZONE:{TIMEZONE}",
+        "BEGIN:VTIMEZONE",
+        f"TZID:{TIMEZONE}",
+        "BEGIN:STANDARD",
+        "DTSTART:19700101T000000",
+        "TZOFFSETFROM:+0800",
+        "TZOFFSETTO:+0800",
+        "TZNAME:CST",
+        "END:STANDARD",
+        "END:VTIMEZONE",
+    ))
+    for name, uploader, slot in _courses(records):
+        start, end = slot.time_range(schedule)
+        if not start:
+            continue
+        summary = _ics_escape(slot.name)
+        location = _ics_escape(slot.room)
+        description = _ics_escape(" · ".join(part for part in (slot.teacher, slot.course_type, slot.weeks_text, uploader) if part))
+        uid_base = hashlib.md5(f"{name}|{slot.day}|{slot.period}|{slot.name}".encode('utf-8')).hexdigest()[:16]
+        start_clock = start.replace(":", "") + "00"
+        end_clock = end.replace(":", "") + "00"
+        for week in range(1, SEMESTER_WEEKS + 1):
+            if not slot.active_in(week):
+                continue
+            day = date_of(week, slot.day, first_monday).strftime("%Y%m%d")
+            yield "".join(_ics_line(line) for line in (
+                "BEGIN:VEVENT",
+                f"UID:{uid_base}-{week}@lizhi-creativity",
+                f"DTSTAMP:{stamp}",
+                f"DTSTART;TZID={TIMEZONE}:{day}T{start_clock}",
+                f"DTEND;TZID={TIMEZONE}:{day}T{end_clock}",
+                f"SUMMARY:{summary}",
+                f"LOCATION:{location}",
+                f"DESCRIPTION:{description}",
+                "END:VEVENT",
+            ))
+    yield _ics_line("END:VCALENDAR")
+
+
+def iter_csv(records):
+    """生成课程列表CSV（带BOM，Excel可直接打开）"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADER)
+    yield "\ufeff" + buffer.getvalue()
+    schedule = get_period_schedule()
+    for _, _, slot in _courses(records):
+        buffer.seek(0)
+        buffer.truncate()
+        start, end = slot.time_range(schedule)
+        writer.writerow([WEEKDAYS[slot.day], slot.period, start, end, slot.name, slot.teacher,
+                         slot.course_type, slot.room, slot.weeks_text, weeks_to_text(slot.weeks)])
+        yield buffer.getvalue()
+
+
+def iter_json(records):
+    """逐门课程生成JSON，不先构造完整的对象"""
+    yield '{"courses": ['
+    first = True
+    schedule = get_period_schedule()
+    for name, uploader, slot in _courses(records):
+        start, end = slot.time_range(schedule)
+        course = {
+            "timetable": name,
+            "uploaded_by": uploader,
+            "day": slot.day + 1,
+            "weekday": WEEKDAYS[slot.day],
+            "period": slot.period,
+            "start": start,
+            "end": end,
+            "name": slot.name,
+            "teacher": slot.teacher,
+            "type": slot.course_type,
+            "room": slot.room,
+            "weeks_text": slot.weeks_text,
+            "weeks": [week for week in range(1, SEMESTER_WEEKS + 1) if slot.active_in(week)],
+        }
+        yield ("" if first else ",") + "\n  " + json.dumps(course, ensure_ascii=False)
+        first = False
+    yield "\n]}\n"
+
+
+GENERATORS = {"ics": iter_ics, "csv": iter_csv, "json": iter_json}
+
+
+def _metadata_digest(records):
+    """导出内容中的课表名和上传者的摘要：相同文件由不同用户或以不同名称上传时导出内容也不同"""
+    parts = sorted(f"{name}\x1f{record.get('uploaded_by', '')}\x1f{record.get('file_hash', '')}"
+                   for name, record in records)
+    return hashlib.md5("\x1e".join(parts).encode('utf-8')).hexdigest()
+
+
+def export_key(records):
+    """导出缓存的键：单个课表为 file_hash-元数据摘要，多个课表为 group_全部内容的摘要"""
+    if len(records) == 1:
+        return f"{records[0][1].get('file_hash', '')}-{_metadata_digest(records)[:12]}"
+    return "group_" + _metadata_digest(records)
+
+
+def export_file(records, fmt):
+    """把导出内容逐块写入缓存文件并返回路径；相同课表和格式直接复用已有文件
+
+    records 为 [(课表名, 课表记录), ...]
+    """
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    # 日期和时间随学期设置、作息配置变化，两者也作为缓存键的一部分
+    path = os.path.join(
+        EXPORT_DIR, f"{export_key(records)}_{semester_start():%Y%m%d}_{get_period_schedule().digest}.{fmt}"
+    )
+    if os.path.exists(path):
+        return path
+
+    # 临时文件名区分进程和线程，同一进程内的多个会话同时导出时不会互相覆盖
+    with span("export", format=fmt, timetables=len(records)):
+        replace_file(path, lambda f: f.writelines(chunk.encode('utf-8') for chunk in GENERATORS[fmt](records)),
+                     binary=True)
+    return path
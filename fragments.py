@@ -0,0 +1,74 @@
+# fragments.py
+import streamlit as st
+import functools
+import time
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from instrumentation import span
+
+def section_fragment(name, run_every=None):
+    """把页面区块包装为可独立重新运行的fragment，并记录每次执行耗时；run_every 为定时重新运行的间隔（秒）"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                with span(f"section.{name}"):
+                    return func(*args, **kwargs)
+            finally:
+                record_section_timing(name, time.perf_counter() - start)
+        return st.fragment(wrapper, run_every=run_every)
+    return decorator
+
+def record_section_timing(name, seconds):
+    """记录区块最近一次执行的耗时"""
+    if 'section_timings' not in st.session_state:
+        st.session_state.section_timings = {}
+    timing = st.session_state.section_timings.setdefault(name, {"runs": 0, "last_ms": 0.0, "total_ms": 0.0})
+    timing["runs"] += 1
+    timing["last_ms"] = seconds * 1000
+    timing["total_ms"] += seconds * 1000
+
+def in_fragment_rerun():
+    """当前是否处于某个fragment的单独重新运行中"""
+    ctx = get_script_run_ctx()
+    return bool(ctx and ctx.current_fragment_id and ctx.fragment_ids_this_run)
+
+def current_session_id():
+    """当前浏览器会话的ID，不在Streamlit脚本中运行时为 None"""
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else None
+
+def rerun_section():
+    """只重新运行当前区块；不在fragment单独运行中时退化为整页重新运行"""
+    if in_fragment_rerun():
+        st.rerun(scope="fragment")
+    st.rerun()
+
+def invalidate(*sections):
+    """标记其他区块的数据已过期，并整页重新运行让它们重新渲染"""
+    if 'section_versions' not in st.session_state:
+        st.session_state.section_versions = {}
+    for section in sections:
+        st.session_state.section_versions[section] = st.session_state.section_versions.get(section, 0) + 1
+    st.rerun()
+
+def consume_invalidation(section):
+    """区块检查自己是否被其他区块标记为过期，检查后即视为已处理"""
+    versions = st.session_state.get('section_versions', {})
+    seen = st.session_state.setdefault('section_versions_seen', {})
+    current = versions.get(section, 0)
+    if seen.get(section, 0) != current:
+        seen[section] = current
+        return True
+    return False
+
+def display_section_timings():
+    """在侧边栏显示各区块的执行耗时"""
+    timings = st.session_state.get('section_timings', {})
+    if not timings:
+        return
+    with st.sidebar.expander("⏱️ 区块耗时"):
+        for name, timing in timings.items():
+            avg_ms = timing["total_ms"] / timing["runs"]
+            st.caption(f"{name}: 最近 {timing['last_ms']:.1f}ms · 平均 {avg_ms:.1f}ms · {timing['runs']} 次")
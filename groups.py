@@ -0,0 +1,204 @@
+# groups.py
+import streamlit as st
+import threading
+import uuid
+from datetime import datetime
+
+from journal import JsonJournal
+from shared_storage import root_path
+
+GROUPS_FILE = root_path("study_groups.json")
+GROUPS_LOG = root_path("study_groups.log")
+
+_groups_journal = JsonJournal(GROUPS_FILE, GROUPS_LOG)
+
+# 进程内常驻的小组表：新会话从这里复制，不必每次从磁盘读取
+_warm_groups = None
+_warm_groups_lock = threading.Lock()
+
+class GroupTable(dict):
+    """学习小组表 - 维护成员集合索引，记录待保存的变更"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pending_ops = []
+        self.position = None
+        self._members = {}
+        self._user_groups = {}
+        self._visible_cache = {}
+        self.rebuild_index()
+
+    def rebuild_index(self):
+        """根据小组数据重建成员索引"""
+        self._members = {gid: set(group.get("members", [])) for gid, group in self.items()}
+        self._user_groups = {}
+        for gid, members in self._members.items():
+            for member in members:
+                self._user_groups.setdefault(member, set()).add(gid)
+        self._visible_cache = {}
+
+    def index_op(self, op):
+        """按单条操作增量更新成员索引"""
+        group_id, user = op.get("group"), op.get("user")
+        if op.get("op") in ("create", "join") and group_id in self:
+            self._members.setdefault(group_id, set()).add(user)
+            self._user_groups.setdefault(user, set()).add(group_id)
+        elif op.get("op") == "leave":
+            self._members.get(group_id, set()).discard(user)
+            self._user_groups.get(user, set()).discard(group_id)
+            if group_id not in self:
+                self._members.pop(group_id, None)
+        self._visible_cache = {}
+
+    def members(self, group_id):
+        return self._members.get(group_id, set())
+
+    def groups_of(self, username):
+        return self._user_groups.get(username, set())
+
+    def visible_members(self, username):
+        """用户所在全部小组的成员集合（含自己）"""
+        if username not in self._visible_cache:
+            visible = {username}
+            for gid in self.groups_of(username):
+                visible |= self._members[gid]
+            self._visible_cache[username] = visible
+        return self._visible_cache[username]
+
+def apply_group_op(groups, op):
+    """把一条小组操作应用到小组表（用于日志重放）"""
+    group_id = op.get("group")
+    kind = op.get("op")
+    if kind == "create":
+        groups[group_id] = {
+            "name": op.get("name", group_id),
+            "owner": op.get("user"),
+            "members": [op.get("user")],
+            "created_at": op.get("at")
+        }
+    elif group_id not in groups:
+        return
+    elif kind == "join":
+        if op.get("user") not in groups[group_id]["members"]:
+            groups[group_id]["members"].append(op.get("user"))
+    elif kind == "leave":
+        if op.get("user") in groups[group_id]["members"]:
+            groups[group_id]["members"].remove(op.get("user"))
+        if not groups[group_id]["members"]:
+            del groups[group_id]
+
+def _commit_op(groups, op):
+    """应用一条操作并同步更新成员索引"""
+    apply_group_op(groups, op)
+    if isinstance(groups, GroupTable):
+        groups.pending_ops.append(op)
+        groups.index_op(op)
+
+def _read_groups():
+    """从磁盘读取学习小组数据（快照 + 变更日志）"""
+    try:
+        groups, position = _groups_journal.load_with_position(apply_group_op, GroupTable())
+        groups.position = position
+        groups.rebuild_index()
+        return groups
+    except Exception as e:
+        st.error(f"加载学习小组数据失败: {str(e)}")
+        return GroupTable()
+
+def load_groups():
+    """加载学习小组数据：复制进程内常驻的小组表，常驻表先按日志位置同步到最新"""
+    global _warm_groups
+    with _warm_groups_lock:
+        if _warm_groups is None:
+            _warm_groups = _read_groups()
+        else:
+            _warm_groups = refresh_groups(_warm_groups)
+        groups = GroupTable({gid: dict(group, members=list(group.get("members", [])))
+                             for gid, group in _warm_groups.items()})
+        groups.position = _warm_groups.position
+        return groups
+
+def refresh_groups(groups):
+    """同步其他会话/进程保存的小组变更，返回最新的小组表（无法增量同步时重新加载）"""
+    if not isinstance(groups, GroupTable) or groups.pending_ops:
+        return groups
+    if not _groups_journal.changed(groups.position):
+        return groups
+    position = _groups_journal.sync(groups, apply_group_op, groups.position)
+    if position is None:
+        return _read_groups()
+    groups.position = position
+    groups.rebuild_index()
+    return groups
+
+def save_groups(groups):
+    """保存学习小组数据 - 只追加本次变更"""
+    try:
+        if isinstance(groups, GroupTable):
+            groups.position = _groups_journal.append(groups.pending_ops, groups.position)
+            groups.pending_ops = []
+            if _groups_journal.needs_compaction():
+                groups.position = _groups_journal.compact(groups, apply_group_op, groups.position)
+                groups.rebuild_index()
+        else:
+            _groups_journal.compact(groups)
+        return True
+    except Exception as e:
+        st.error(f"保存学习小组数据失败: {str(e)}")
+        return False
+
+def create_group(group_name, current_user, groups):
+    """创建学习小组，创建者自动加入"""
+    if not current_user:
+        return False, "请先登录"
+    group_name = (group_name or "").strip()
+    if not group_name:
+        return False, "请输入小组名称"
+
+    group_id = uuid.uuid4().hex[:6]
+    while group_id in groups:
+        group_id = uuid.uuid4().hex[:6]
+    _commit_op(groups, {
+        "op": "create",
+        "group": group_id,
+        "name": group_name,
+        "user": current_user,
+        "at": datetime.now().isoformat()
+    })
+    return True, f"已创建小组 {group_name}，小组码: {group_id}"
+
+def join_group(group_id, current_user, groups):
+    """通过小组码加入学习小组"""
+    if not current_user:
+        return False, "请先登录"
+    group_id = (group_id or "").strip()
+    if group_id not in groups:
+        return False, "小组不存在"
+    if group_id in groups.groups_of(current_user):
+        return False, "已经在该小组中"
+
+    _commit_op(groups, {"op": "join", "group": group_id, "user": current_user})
+    return True, f"已加入小组 {groups[group_id]['name']}"
+
+def leave_group(group_id, current_user, groups):
+    """退出学习小组，最后一名成员退出后小组解散"""
+    if not current_user:
+        return False, "请先登录"
+    if group_id not in groups.groups_of(current_user):
+        return False, "不在该小组中"
+
+    group_name = groups[group_id]["name"]
+    _commit_op(groups, {"op": "leave", "group": group_id, "user": current_user})
+    return True, f"已退出小组 {group_name}"
+
+def get_user_groups(current_user, groups):
+    """获取用户所在的小组 {小组码: 小组数据}"""
+    if not current_user:
+        return {}
+    return {gid: groups[gid] for gid in sorted(groups.groups_of(current_user))}
+
+def get_visible_users(current_user, binded_users, groups):
+    """可见用户集合：自己 + 绑定用户 + 同组成员"""
+    if not current_user:
+        return set()
+    return groups.visible_members(current_user) | set(binded_users)
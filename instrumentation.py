@@ -0,0 +1,174 @@
+# instrumentation.py
+import streamlit as st
+import collections
+import contextlib
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from datetime import datetime
+
+# 设置后把每个计时片段以JSON行追加到该文件
+PERF_LOG_PATH = os.environ.get("LIZHI_PERF_LOG")
+# 设置后采集下一次脚本运行的cProfile数据
+PROFILE_RERUN = os.environ.get("LIZHI_PROFILE_RERUN", "") not in ("", "0")
+PROFILE_DIR = os.path.join("./timetable_data", "profiles")
+# 可以查看性能面板的管理员用户名，逗号分隔
+ADMIN_USERS = {name.strip() for name in os.environ.get("LIZHI_ADMINS", "").split(",") if name.strip()}
+
+_lock = threading.Lock()
+_recent_spans = collections.deque(maxlen=2000)
+_span_stats = {}
+_byte_counters = collections.Counter()
+_log_file = None
+_profile_requested = PROFILE_RERUN
+
+def _write_log(record):
+    global _log_file
+    if not PERF_LOG_PATH:
+        return
+    with _lock:
+        if _log_file is None:
+            _log_file = open(PERF_LOG_PATH, 'a', encoding='utf-8')
+        _log_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        _log_file.flush()
+
+def _record(name, elapsed_ms, attrs):
+    with _lock:
+        stats = _span_stats.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        stats["count"] += 1
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+        _recent_spans.append((name, elapsed_ms))
+    record = {"ts": datetime.now().isoformat(), "span": name, "ms": round(elapsed_ms, 3)}
+    record.update(attrs)
+    _write_log(record)
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    """计时片段，结束时记录耗时；可在片段内通过返回的字典补充属性"""
+    start = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        _record(name, (time.perf_counter() - start) * 1000, attrs)
+
+def timed(name=None):
+    """函数计时装饰器"""
+    def decorator(func):
+        span_name = name or func.__name__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count_bytes(kind, amount):
+    """累计读写字节数，kind 如 'read' / 'written'"""
+    if amount:
+        with _lock:
+            _byte_counters[kind] += amount
+
+def get_span_stats():
+    """各计时片段的汇总统计 {名称: {count, mean_ms, p95_ms, max_ms}}"""
+    with _lock:
+        recent = list(_recent_spans)
+        stats = {name: dict(value) for name, value in _span_stats.items()}
+    samples = collections.defaultdict(list)
+    for name, elapsed_ms in recent:
+        samples[name].append(elapsed_ms)
+    summary = {}
+    for name, value in stats.items():
+        ordered = sorted(samples.get(name, [])) or [0.0]
+        summary[name] = {
+            "count": value["count"],
+            "mean_ms": value["total_ms"] / value["count"],
+            "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            "max_ms": value["max_ms"],
+        }
+    return summary
+
+def get_byte_counters():
+    with _lock:
+        return dict(_byte_counters)
+
+def request_profile():
+    """请求采集下一次脚本运行的cProfile数据"""
+    global _profile_requested
+    _profile_requested = True
+
+@contextlib.contextmanager
+def profile_rerun():
+    """包裹一次脚本运行；被请求时用cProfile采集并写入 profiles 目录"""
+    global _profile_requested
+    if not _profile_requested:
+        with span("rerun"):
+            yield
+        return
+
+    _profile_requested = False
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        with span("rerun", profiled=True):
+            yield
+    finally:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"rerun_{datetime.now().strftime('%Y%m%d_%H%M%S')}.prof")
+        profiler.dump_stats(path)
+        with _lock:
+            _byte_counters["profiles"] += 1
+        _write_log({"ts": datetime.now().isoformat(), "span": "profile", "path": path})
+
+def latest_profile_summary(limit=15):
+    """最近一次cProfile结果中累计耗时最高的函数"""
+    if not os.path.exists(PROFILE_DIR):
+        return None
+    profiles = sorted(f for f in os.listdir(PROFILE_DIR) if f.endswith(".prof"))
+    if not profiles:
+        return None
+    output = io.StringIO()
+    stats = pstats.Stats(os.path.join(PROFILE_DIR, profiles[-1]), stream=output)
+    stats.sort_stats("cumulative").print_stats(limit)
+    return profiles[-1], output.getvalue()
+
+def is_admin(username):
+    return bool(username) and username in ADMIN_USERS
+
+def display_perf_panel(current_user):
+    """管理员侧边栏性能面板"""
+    if not is_admin(current_user):
+        return
+    with st.sidebar.expander("🛠️ 性能监控"):
+        stats = get_span_stats()
+        if stats:
+            rows = sorted(stats.items(), key=lambda item: item[1]["mean_ms"] * item[1]["count"], reverse=True)
+            st.dataframe(
+                [{"片段": name, "次数": value["count"], "平均ms": round(value["mean_ms"], 2),
+                  "p95ms": round(value["p95_ms"], 2), "最大ms": round(value["max_ms"], 2)}
+                 for name, value in rows],
+                use_container_width=True,
+                hide_index=True
+            )
+        else:
+            st.caption("暂无计时数据")
+
+        counters = get_byte_counters()
+        st.caption(f"读取 {counters.get('read', 0) / 1024:.1f}KB · 写入 {counters.get('written', 0) / 1024:.1f}KB")
+        if PERF_LOG_PATH:
+            st.caption(f"计时日志: {PERF_LOG_PATH}")
+
+        if st.button("📸 采集下一次运行", key="perf_request_profile", use_container_width=True):
+            request_profile()
+            st.rerun()
+        summary = latest_profile_summary()
+        if summary:
+            name, text = summary
+            st.caption(f"最近采集: {name}")
+            st.code(text, language="text")
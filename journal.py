@@ -0,0 +1,157 @@
+# journal.py
+import json
+import os
+import threading
+
+from instrumentation import span, count_bytes
+from shared_storage import file_lock, file_signature
+
+
+class JsonJournal:
+    """JSON快照 + 追加日志
+
+    快照文件保存完整状态，日志文件每行一条JSON操作记录。
+    加载时读取快照后按顺序重放日志；写入时只追加本次变更的操作，
+    日志条数超过阈值时再把当前状态压缩进快照并清空日志。
+
+    多个进程可以共用同一组文件：写入都在文件锁内进行。调用方保存的位置
+    (快照签名, 已应用的日志字节数) 用于判断其他进程是否写入过——只追加了日志时
+    重放新增的部分即可，快照被替换（其他进程压缩过）时需要重新加载。
+    """
+
+    def __init__(self, snapshot_path, log_path, compact_threshold=200):
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path
+        self.compact_threshold = compact_threshold
+        self.log_count = 0
+        self._lock = threading.Lock()
+
+    def _snapshot_id(self):
+        signature = file_signature(self.snapshot_path)
+        return signature[:2] if signature else None
+
+    def _log_size(self):
+        signature = file_signature(self.log_path)
+        return signature[2] if signature else 0
+
+    def position(self):
+        """当前文件的位置 (快照签名, 日志大小)"""
+        return self._snapshot_id(), self._log_size()
+
+    def load(self, apply_op, initial=None):
+        """读取快照并重放日志，返回完整状态"""
+        return self.load_with_position(apply_op, initial)[0]
+
+    def load_with_position(self, apply_op, initial=None):
+        """读取快照并重放日志，返回 (完整状态, 位置)"""
+        with span("journal.load", journal=os.path.basename(self.snapshot_path)):
+            with file_lock(self.log_path, shared=True):
+                return self._load(apply_op, initial)
+
+    def _load(self, apply_op, initial):
+        state = initial if initial is not None else {}
+        snapshot_id = self._snapshot_id()
+        if snapshot_id is not None:
+            count_bytes("read", os.path.getsize(self.snapshot_path))
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                state.update(json.load(f))
+        count, offset = self._replay(state, apply_op, 0)
+        self.log_count = count
+        return state, (snapshot_id, offset)
+
+    def _replay(self, state, apply_op, offset):
+        """从日志的 offset 字节处开始重放完整的行，返回 (重放条数, 新的偏移)"""
+        if not os.path.exists(self.log_path):
+            return 0, 0
+        count = 0
+        with open(self.log_path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        count_bytes("read", len(data))
+        # 最后一行可能还在写入中，只处理到最后一个换行符
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                op = json.loads(line)
+            except ValueError:
+                # 写入中断留下的半行，忽略即可
+                continue
+            apply_op(state, op)
+            count += 1
+        return count, offset + end
+
+    def changed(self, position):
+        """自 position 之后文件是否被（任何进程）修改过"""
+        return position != self.position()
+
+    def sync(self, state, apply_op, position):
+        """把其他进程追加的操作应用到 state，返回新的位置
+
+        快照被替换或日志被截断时无法增量同步，返回 None，调用方应重新加载。
+        """
+        if position is None:
+            return None
+        snapshot_id, offset = position
+        with file_lock(self.log_path, shared=True):
+            if self._snapshot_id() != snapshot_id or self._log_size() < offset:
+                return None
+            if self._log_size() == offset:
+                return position
+            with span("journal.sync", journal=os.path.basename(self.snapshot_path)):
+                count, offset = self._replay(state, apply_op, offset)
+            self.log_count += count
+            return snapshot_id, offset
+
+    def append(self, ops, position=None):
+        """把一批操作一次性追加到日志，返回调用方的新位置
+
+        追加前日志末尾正好是调用方的位置时直接前移；否则其他进程在中间写入过，
+        位置保持不变，之后 sync 会连同自己的操作一起重放（各操作重放是幂等的）。
+        """
+        if not ops:
+            return position
+        payload = "".join(json.dumps(op, ensure_ascii=False) + "\n" for op in ops)
+        size = len(payload.encode('utf-8'))
+        with span("journal.append", journal=os.path.basename(self.log_path), ops=len(ops), bytes=size):
+            with self._lock, file_lock(self.log_path):
+                before = self.position()
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(payload)
+                    f.flush()
+                self.log_count += len(ops)
+                if position == before:
+                    position = self.position()
+        count_bytes("written", size)
+        return position
+
+    def needs_compaction(self):
+        """日志是否已超过压缩阈值"""
+        return self.log_count >= self.compact_threshold
+
+    def compact(self, state, apply_op=None, position=None):
+        """把完整状态写入快照（原子替换）并清空日志，返回新的位置
+
+        给出 position 时先补上其他进程追加的操作再写入；快照已被其他进程替换时放弃压缩，
+        返回 None 让调用方重新加载。
+        """
+        tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        with span("journal.compact", journal=os.path.basename(self.snapshot_path)), \
+                self._lock, file_lock(self.log_path):
+            if position is not None and apply_op is not None and self.changed(position):
+                snapshot_id, offset = position
+                if self._snapshot_id() != snapshot_id or self._log_size() < offset:
+                    return None
+                self._replay(state, apply_op, offset)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            count_bytes("written", os.path.getsize(tmp_path))
+            os.replace(tmp_path, self.snapshot_path)
+            if os.path.exists(self.log_path):
+                os.remove(self.log_path)
+            self.log_count = 0
+            return self.position()
@@ -1,9 +1,14 @@
 # main_modern.py
 import streamlit as st
-import course2
-from modern_styles import get_modern_css
+from modern_styles import get_minified_css, get_home_fragments
 from auth import *
 from schedule import display_schedule_section
+from user_directory import get_user_directory
+from period_config import get_period_schedule
+from fragments import section_fragment, rerun_section, invalidate, display_section_timings, current_session_id
+from event_bus import get_event_bus, describe_event, EVENT_SECTIONS
+from instrumentation import profile_rerun, display_perf_panel
+from groups import load_groups, refresh_groups, save_groups, create_group, join_group, leave_group, get_user_groups, get_visible_users
 
 # 设置页面配置
 st.set_page_config(
@@ -13,8 +18,8 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-# 应用现代化样式
-st.markdown(get_modern_css(), unsafe_allow_html=True)
+# 应用现代化样式（压缩后的样式只构建一次）
+st.markdown(get_minified_css(), unsafe_allow_html=True)
 
 # 初始化session state
 if 'active_tab' not in st.session_state:
@@ -22,13 +27,41 @@ if 'active_tab' not in st.session_state:
 if 'show_login_modal' not in st.session_state:
     st.session_state.show_login_modal = False
 
-# 初始化用户系统
-if 'users' not in st.session_state:
-    st.session_state.users = course2.load_users()
+# 初始化用户系统（用户目录在进程内共享）
+user_directory = get_user_directory()
+# 作息配置在启动时加载并校验，之后按文件修改时间重新加载
+get_period_schedule()
 if 'current_user' not in st.session_state:
     st.session_state.current_user = None
 if 'user_relationships' not in st.session_state:
     st.session_state.user_relationships = load_user_relationships()
+if 'groups' not in st.session_state:
+    st.session_state.groups = load_groups()
+if 'auth_token' not in st.session_state:
+    st.session_state.auth_token = None
+
+# 其他会话或服务进程保存的变更：文件签名变化时才增量同步
+user_directory.refresh()
+st.session_state.user_relationships = refresh_user_relationships(st.session_state.user_relationships)
+st.session_state.groups = refresh_groups(st.session_state.groups)
+
+# 已登录会话只查令牌缓存，不再重复校验密码；令牌失效时退出登录
+if st.session_state.current_user and st.session_state.auth_token:
+    if resolve_session_user(st.session_state.auth_token) != st.session_state.current_user:
+        st.session_state.current_user = None
+        st.session_state.auth_token = None
+
+def current_visible_users():
+    """当前用户的可见用户集合（绑定用户 + 同组成员）"""
+    binded_users = get_binded_users(st.session_state.current_user, st.session_state.user_relationships)
+    return get_visible_users(st.session_state.current_user, binded_users, st.session_state.groups)
+
+def current_timetables():
+    """当前课表数据（按需从存储加载）"""
+    # 课表模块依赖 pandas，首次用到课表时才导入，未登录的访客不必加载
+    import course2
+    course2.init_timetable_session_state()
+    return st.session_state.timetables
 
 def modern_login_system():
     """现代化登录系统"""
@@ -51,6 +84,10 @@ def modern_login_system():
             ''', unsafe_allow_html=True)
             
             if st.button("🚪 退出登录", key="logout_btn", use_container_width=True):
+                get_event_bus().unsubscribe(current_session_id())
+                st.session_state.notifications = []
+                end_user_session(st.session_state.auth_token)
+                st.session_state.auth_token = None
                 st.session_state.current_user = None
                 st.rerun()
         else:
@@ -61,20 +98,7 @@ def modern_login_system():
 def modern_login_modal():
     """简化版登录界面 - 不使用模态框"""
     if st.session_state.show_login_modal:
-        # 创建一个居中的登录框
-        st.markdown("""
-        <style>
-        .login-container {
-            max-width: 500px;
-            margin: 2rem auto;
-            padding: 2rem;
-            background: white;
-            border-radius: 15px;
-            box-shadow: 0 10px 30px rgba(0, 0, 0, 0.1);
-        }
-        </style>
-        """, unsafe_allow_html=True)
-        
+        # 创建一个居中的登录框（样式已包含在全站样式中）
         st.markdown('<div class="login-container">', unsafe_allow_html=True)
         
         st.markdown('<h2 style="text-align: center; margin-bottom: 1.5rem;">🔐 欢迎回来</h2>', unsafe_allow_html=True)
@@ -88,13 +112,18 @@ def modern_login_modal():
             col1, col2 = st.columns(2)
             with col1:
                 if st.button("🚀 立即登录", use_container_width=True, key="login_submit"):
-                    if authenticate_user(username, password, st.session_state.users):
+                    if authenticate_user(username, password, user_directory):
                         st.session_state.current_user = username
+                        st.session_state.auth_token = start_user_session(username)
                         st.session_state.show_login_modal = False
                         st.success("🎉 登录成功！")
                         st.rerun()
                     else:
-                        st.error("❌ 用户名或密码错误")
+                        retry_after = get_login_retry_after(username)
+                        if retry_after:
+                            st.error(f"❌ 尝试次数过多，请 {retry_after} 秒后再试")
+                        else:
+                            st.error("❌ 用户名或密码错误")
             with col2:
                 if st.button("❌ 关闭", use_container_width=True, key="login_cancel"):
                     st.session_state.show_login_modal = False
@@ -107,10 +136,10 @@ def modern_login_modal():
             col1, col2 = st.columns(2)
             with col1:
                 if st.button("✨ 创建账户", use_container_width=True, key="reg_submit"):
-                    success, message = register_user(new_username, new_password, st.session_state.users)
+                    success, message = register_user(new_username, new_password, user_directory)
                     if success:
-                        course2.save_users(st.session_state.users)
                         st.session_state.current_user = new_username
+                        st.session_state.auth_token = start_user_session(new_username)
                         st.session_state.show_login_modal = False
                         st.success(f"🎉 {message}")
                         st.rerun()
@@ -146,12 +175,18 @@ def modern_account_binding():
             <p>输入伙伴的用户名，发送学习连接邀请</p>
         """, unsafe_allow_html=True)
         target_username = st.text_input("伙伴用户名:", key="bind_target", placeholder="输入用户名")
+        if target_username and target_username not in user_directory:
+            suggestions = [name for name in user_directory.search_prefix(target_username, limit=9)
+                           if name != st.session_state.current_user][:8]
+            if suggestions:
+                st.caption(f"💡 匹配用户: {', '.join(suggestions)}")
         if st.button("🚀 发送邀请", use_container_width=True, key="send_bind_request"):
-            success, message = send_binding_request(target_username, st.session_state.current_user, st.session_state.user_relationships)
+            success, message = send_binding_request(target_username, st.session_state.current_user,
+                                                    st.session_state.user_relationships, user_directory)
             if success:
                 save_user_relationships(st.session_state.user_relationships)
                 st.success(f"✅ {message}")
-                st.rerun()
+                rerun_section()
             else:
                 st.error(f"❌ {message}")
         st.markdown("</div>", unsafe_allow_html=True)
@@ -165,6 +200,13 @@ def modern_account_binding():
         received_requests = user_rels.get("received_requests", [])
         
         if received_requests:
+            if len(received_requests) > 1:
+                if st.button(f"✅ 全部接受 ({len(received_requests)})", key="accept_all_requests", use_container_width=True):
+                    success, message = accept_all(st.session_state.current_user, st.session_state.user_relationships)
+                    if success:
+                        save_user_relationships(st.session_state.user_relationships)
+                        st.success(f"✅ {message}")
+                        invalidate("timetable", "schedule")
             for req_user in received_requests:
                 col_req1, col_req2 = st.columns([2, 1])
                 with col_req1:
@@ -177,14 +219,14 @@ def modern_account_binding():
                             if success:
                                 save_user_relationships(st.session_state.user_relationships)
                                 st.success(f"✅ {message}")
-                                st.rerun()
+                                invalidate("timetable", "schedule")
                     with col_btn2:
                         if st.button("❌", key=f"reject_{req_user}", use_container_width=True):
                             success, message = reject_binding_request(req_user, st.session_state.current_user, st.session_state.user_relationships)
                             if success:
                                 save_user_relationships(st.session_state.user_relationships)
                                 st.success(f"✅ {message}")
-                                st.rerun()
+                                rerun_section()
         else:
             st.info("📭 暂无待处理请求")
         st.markdown("</div>", unsafe_allow_html=True)
@@ -210,7 +252,7 @@ def modern_account_binding():
                         if success:
                             save_user_relationships(st.session_state.user_relationships)
                             st.success(f"✅ {message}")
-                            st.rerun()
+                            invalidate("timetable", "schedule")
                         else:
                             st.error(f"❌ {message}")
         else:
@@ -237,116 +279,115 @@ def modern_account_binding():
                         if success:
                             save_user_relationships(st.session_state.user_relationships)
                             st.success(f"✅ {message}")
-                            st.rerun()
+                            rerun_section()
                         else:
                             st.error(f"❌ {message}")
         else:
             st.info("📤 暂无已发送请求")
         st.markdown("</div>", unsafe_allow_html=True)
     
-    # 批量解除绑定功能
+    # 学习小组
+    modern_study_groups()
+    
+    # 批量管理功能
     st.markdown("""
     <div class="modern-card">
         <h3>🔄 批量管理</h3>
-        <p>快速解除所有绑定关系</p>
+        <p>按名单批量邀请伙伴，或快速解除所有绑定关系</p>
     """, unsafe_allow_html=True)
     
+    invite_text = st.text_area(
+        "伙伴名单:",
+        key="invite_list",
+        placeholder="每行一个用户名，也可以用逗号分隔",
+        height=100
+    )
+    if st.button("📨 批量发送邀请", key="invite_from_list", use_container_width=True):
+        success, message = invite_from_list(invite_text, st.session_state.current_user,
+                                            st.session_state.user_relationships, user_directory)
+        if success:
+            save_user_relationships(st.session_state.user_relationships)
+            st.success(f"✅ {message}")
+            rerun_section()
+        else:
+            st.error(f"❌ {message}")
+    
     if binded_users:
         st.warning("⚠️ 此操作将解除与所有伙伴的连接关系")
         if st.button("🗑️ 解除所有绑定", key="unbind_all", use_container_width=True, type="secondary"):
-            # 解除所有绑定
-            for binded_user in binded_users[:]:  # 使用副本进行迭代
-                success, message = unbind_user(binded_user, st.session_state.current_user, st.session_state.user_relationships)
-                if success:
-                    st.success(f"✅ 已解除与 {binded_user} 的绑定")
-                else:
-                    st.error(f"❌ 解除 {binded_user} 绑定时出错: {message}")
-            
-            save_user_relationships(st.session_state.user_relationships)
-            st.success("🎉 所有绑定关系已解除")
-            st.rerun()
+            success, message = unbind_all(st.session_state.current_user, st.session_state.user_relationships)
+            if success:
+                save_user_relationships(st.session_state.user_relationships)
+                st.success(f"🎉 {message}")
+                invalidate("timetable", "schedule")
+            else:
+                st.error(f"❌ {message}")
     else:
         st.info("暂无绑定关系可管理")
     
     st.markdown("</div>", unsafe_allow_html=True)
 
-def modern_home_page():
-    """现代化首页"""
+def modern_study_groups():
+    """学习小组界面 - 小组成员之间共享课表和日程"""
     st.markdown("""
     <div class="modern-card">
-        <h1>🎯 欢迎来到荔枝营地！</h1>
-        <p style="font-size: 1.2rem; color: #64748b; margin-bottom: 2rem;">
-        一个专为学习者打造的智能协作平台，让学习变得更简单、更有趣
-        </p>
-    </div>
+        <h3>👪 学习小组</h3>
+        <p>加入小组后，组内成员无需两两绑定即可互相查看课表和日程</p>
     """, unsafe_allow_html=True)
     
-    # 功能特性展示 - 使用统一高度的卡片
-    st.subheader("✨ 平台特色")
-    
-    # 创建列并添加CSS类确保高度一致
-    col1, col2, col3, col4 = st.columns(4)
-    
+    col1, col2 = st.columns(2)
     with col1:
-        st.markdown("""
-        <div class="feature-card">
-            <h3>🤝 智能连接</h3>
-            <p>快速找到志同道合的学习伙伴，建立学习小组</p>
-        </div>
-        """, unsafe_allow_html=True)
-    
+        group_name = st.text_input("小组名称:", key="new_group_name", placeholder="如：高数学习小组")
+        if st.button("➕ 创建小组", key="create_group", use_container_width=True):
+            success, message = create_group(group_name, st.session_state.current_user, st.session_state.groups)
+            if success:
+                save_groups(st.session_state.groups)
+                st.success(f"✅ {message}")
+                rerun_section()
+            else:
+                st.error(f"❌ {message}")
     with col2:
-        st.markdown("""
-        <div class="feature-card">
-            <h3>📅 日程同步</h3>
-            <p>实时同步学习计划，避免时间冲突</p>
-        </div>
-        """, unsafe_allow_html=True)
+        group_code = st.text_input("小组码:", key="join_group_code", placeholder="输入6位小组码")
+        if st.button("🚪 加入小组", key="join_group", use_container_width=True):
+            success, message = join_group(group_code, st.session_state.current_user, st.session_state.groups)
+            if success:
+                save_groups(st.session_state.groups)
+                st.success(f"✅ {message}")
+                invalidate("timetable", "schedule")
+            else:
+                st.error(f"❌ {message}")
     
-    with col3:
-        st.markdown("""
-        <div class="feature-card">
-            <h3>📚 课程管理</h3>
-            <p>智能课表管理，学习进度一目了然</p>
-        </div>
-        """, unsafe_allow_html=True)
+    my_groups = get_user_groups(st.session_state.current_user, st.session_state.groups)
+    if my_groups:
+        for group_id, group in my_groups.items():
+            col_group, col_action = st.columns([3, 1])
+            with col_group:
+                st.success(f"👪 {group['name']} · 小组码 {group_id} · {len(group['members'])} 名成员")
+            with col_action:
+                if st.button("退出", key=f"leave_group_{group_id}", use_container_width=True):
+                    success, message = leave_group(group_id, st.session_state.current_user, st.session_state.groups)
+                    if success:
+                        save_groups(st.session_state.groups)
+                        st.success(f"✅ {message}")
+                        invalidate("timetable", "schedule")
+                    else:
+                        st.error(f"❌ {message}")
+    else:
+        st.info("🔍 暂未加入任何小组")
     
-    with col4:
-        st.markdown("""
-        <div class="feature-card">
-            <h3>🎯 进度追踪</h3>
-            <p>可视化学习进度，激励持续进步</p>
-        </div>
-        """, unsafe_allow_html=True)
+    st.markdown("</div>", unsafe_allow_html=True)
+
+def modern_home_page():
+    """现代化首页"""
+    fragments = get_home_fragments()
+    st.markdown(fragments["welcome"], unsafe_allow_html=True)
+    
+    # 功能特性展示 - 使用统一高度的卡片
+    st.subheader("✨ 平台特色")
+    st.markdown(fragments["features"], unsafe_allow_html=True)
     
     # 使用指南
-    st.markdown("""
-    <div class="modern-card">
-        <h2>🚀 快速开始</h2>
-        <div style="display: grid; grid-template-columns: repeat(auto-fit, minmax(250px, 1fr)); gap: 1.5rem; margin-top: 1.5rem;">
-            <div style="text-align: center; padding: 1.5rem; background: #f8fafc; border-radius: 15px;">
-                <div style="font-size: 2rem; margin-bottom: 1rem;">1️⃣</div>
-                <h4>注册登录</h4>
-                <p style="color: #64748b;">创建个人学习账户</p>
-            </div>
-            <div style="text-align: center; padding: 1.5rem; background: #f8fafc; border-radius: 15px;">
-                <div style="font-size: 2rem; margin-bottom: 1rem;">2️⃣</div>
-                <h4>连接伙伴</h4>
-                <p style="color: #64748b;">添加学习小伙伴</p>
-            </div>
-            <div style="text-align: center; padding: 1.5rem; background: #f8fafc; border-radius: 15px;">
-                <div style="font-size: 2rem; margin-bottom: 1rem;">3️⃣</div>
-                <h4>设置计划</h4>
-                <p style="color: #64748b;">上传课表和日程</p>
-            </div>
-            <div style="text-align: center; padding: 1.5rem; background: #f8fafc; border-radius: 15px;">
-                <div style="font-size: 2rem; margin-bottom: 1rem;">4️⃣</div>
-                <h4>开始学习</h4>
-                <p style="color: #64748b;">协作共享信息</p>
-            </div>
-        </div>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(fragments["quick_start"], unsafe_allow_html=True)
     
     # 统计信息（如果已登录）
     if st.session_state.current_user:
@@ -368,6 +409,84 @@ def modern_home_page():
         
         st.markdown("</div></div>", unsafe_allow_html=True)
 
+@section_fragment("首页")
+def home_section():
+    """首页区块"""
+    modern_home_page()
+
+@section_fragment("学习日程")
+def schedule_section():
+    """学习日程区块"""
+    st.header("📅 学习日程管理")
+    st.write("规划你的学习时间，与伙伴同步进度")
+    display_schedule_section(st.session_state.current_user, current_visible_users, current_timetables)
+
+@section_fragment("我的课表")
+def timetable_section():
+    """课表区块"""
+    st.header("📚 智能课表")
+    st.write("管理课程安排，智能提醒学习时间")
+    
+    if not st.session_state.current_user:
+        st.warning("👋 请先登录以使用课表功能")
+    else:
+        try:
+            import course2
+            binded_users = get_binded_users(st.session_state.current_user, st.session_state.user_relationships)
+            course2.timetable_management_tab_modified(binded_users, current_visible_users())
+        except Exception as e:
+            st.error(f"❌ 加载课表功能时出现错误: {str(e)}")
+            st.info("💡 请检查控制台获取完整错误信息")
+
+@section_fragment("课表侧边栏")
+def timetable_sidebar_section():
+    """课表侧边栏区块"""
+    import course2
+    binded_users = get_binded_users(st.session_state.current_user, st.session_state.user_relationships)
+    course2.timetable_sidebar(binded_users, current_visible_users())
+
+# 通知区块的轮询间隔（秒）和保留的通知条数
+NOTIFY_POLL_SECONDS = 3
+NOTIFICATION_LIMIT = 20
+
+@section_fragment("通知", run_every=NOTIFY_POLL_SECONDS)
+def notification_section():
+    """通知区块：定时取走事件总线推送给本会话的事件，只重新加载受影响的数据"""
+    current_user = st.session_state.current_user
+    bus = get_event_bus()
+    session_id = current_session_id()
+    bus.subscribe(session_id, current_user, current_visible_users())
+    notifications = st.session_state.setdefault('notifications', [])
+    
+    events = bus.poll(session_id)
+    if events:
+        notifications.extend(events)
+        del notifications[:-NOTIFICATION_LIMIT]
+        sections = set()
+        for event in events:
+            st.toast(describe_event(event), icon="🔔")
+            sections.update(EVENT_SECTIONS.get(event['kind'], ()))
+        # 关系变化时重新读取关系表，其余只标记受影响的区块过期
+        if "binding" in sections:
+            st.session_state.user_relationships = refresh_user_relationships(st.session_state.user_relationships)
+            sections.discard("binding")
+        invalidate(*sections)
+    
+    with st.expander(f"🔔 通知 ({len(notifications)})"):
+        if not notifications:
+            st.caption("暂无新通知")
+        for event in reversed(notifications):
+            st.caption(f"{event['time'][5:16]} · {describe_event(event)}")
+        if notifications and st.button("✅ 全部已读", key="ack_notifications", use_container_width=True):
+            bus.acknowledge(current_user, max(event['id'] for event in notifications))
+            notifications.clear()
+            rerun_section()
+
+@section_fragment("伙伴连接")
+def binding_section():
+    """伙伴连接区块"""
+    modern_account_binding()
+
 def main():
     """主函数"""
     # 显示现代化登录系统
@@ -381,36 +500,28 @@ def main():
     
     tab1, tab2, tab3, tab4 = st.tabs(["🎯 首页", "📅 学习日程", "📚 我的课表", "🤝 伙伴连接"])
     
+    # 每个标签页是独立的fragment，区块内的操作只重新运行该区块
     with tab1:
-        modern_home_page()
+        home_section()
     
     with tab2:
-        st.header("📅 学习日程管理")
-        st.write("规划你的学习时间，与伙伴同步进度")
-        display_schedule_section(st.session_state.current_user, 
-                               lambda: get_binded_users(st.session_state.current_user, st.session_state.user_relationships))
+        schedule_section()
     
     with tab3:
-        st.header("📚 智能课表")
-        st.write("管理课程安排，智能提醒学习时间")
-        
-        if not st.session_state.current_user:
-            st.warning("👋 请先登录以使用课表功能")
-        else:
-            try:
-                import importlib
-                importlib.reload(course2)
-                
-                binded_users = get_binded_users(st.session_state.current_user, st.session_state.user_relationships)
-                course2.timetable_management_tab_modified(binded_users)
-                
-            except Exception as e:
-                st.error(f"❌ 加载课表功能时出现错误: {str(e)}")
-                st.info("💡 请检查控制台获取完整错误信息")
+        timetable_section()
     
     with tab4:
-        modern_account_binding()
+        binding_section()
+    
+    if st.session_state.current_user:
+        with st.sidebar:
+            notification_section()
+            timetable_sidebar_section()
+    
+    display_section_timings()
+    display_perf_panel(st.session_state.current_user)
 
 # 运行主程序
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with profile_rerun():
+        main()
@@ -1,4 +1,8 @@
 # modern_styles.py
+import functools
+import html
+import re
+
 def get_modern_css():
     return """
     <style>
@@ -160,6 +164,23 @@ def get_modern_css():
         box-shadow: 0 25px 50px rgba(102, 126, 234, 0.3);
     }
     
+    /* 功能卡片网格 - 一次渲染全部卡片 */
+    .feature-grid {
+        display: grid;
+        grid-template-columns: repeat(4, 1fr);
+        gap: 1rem;
+    }
+    
+    /* 登录框 */
+    .login-container {
+        max-width: 500px;
+        margin: 2rem auto;
+        padding: 2rem;
+        background: white;
+        border-radius: 15px;
+        box-shadow: 0 10px 30px rgba(0, 0, 0, 0.1);
+    }
+    
     /* 确保所有功能卡片列的高度一致 */
     .feature-column > div {
         height: 100%;
@@ -251,7 +272,40 @@ def get_modern_css():
         font-weight: 500;
         margin: 0.25rem;
     }
-    
+
+    /* 伙伴周视图 */
+    .week-grid {
+        width: 100%;
+        border-collapse: collapse;
+        table-layout: fixed;
+        font-size: 0.8rem;
+    }
+
+    .week-grid th, .week-grid td {
+        border: 1px solid #e2e8f0;
+        padding: 0.35rem;
+        vertical-align: top;
+    }
+
+    .week-grid th {
+        background: #f1f5f9;
+        font-weight: 600;
+        text-align: center;
+    }
+
+    .week-grid td.busy {
+        background: #eef2ff;
+    }
+
+    .week-grid .who {
+        display: block;
+        margin-bottom: 0.2rem;
+    }
+
+    .week-grid .who b {
+        color: #4f46e5;
+    }
+
     /* 响应式调整 */
     @media (max-width: 768px) {
         .main-title {
@@ -268,6 +322,10 @@ def get_modern_css():
             font-size: 0.9rem;
         }
         
+        .feature-grid {
+            grid-template-columns: repeat(2, 1fr);
+        }
+        
         .feature-card {
             height: 180px; /* 移动端调整高度 */
             padding: 1.5rem;
@@ -317,4 +375,79 @@ def get_modern_css():
         animation: fadeInUp 0.6s ease-out;
     }
     </style>
-    """
\ No newline at end of file
+    """
+
+def minify_css(css):
+    """压缩CSS：去掉注释和多余空白"""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    css = re.sub(r":\s+", ":", css)
+    css = css.replace(";}", "}")
+    return css.strip()
+
+@functools.lru_cache(maxsize=None)
+def get_minified_css():
+    """构建一次并缓存压缩后的全站样式"""
+    css = get_modern_css()
+    body = css.split("<style>", 1)[1].rsplit("</style>", 1)[0]
+    return f"<style>{minify_css(body)}</style>"
+
+# 首页静态内容
+FEATURE_CARDS = [
+    ("🤝 智能连接", "快速找到志同道合的学习伙伴，建立学习小组"),
+    ("📅 日程同步", "实时同步学习计划，避免时间冲突"),
+    ("📚 课程管理", "智能课表管理，学习进度一目了然"),
+    ("🎯 进度追踪", "可视化学习进度，激励持续进步"),
+]
+
+QUICK_START_STEPS = [
+    ("1️⃣", "注册登录", "创建个人学习账户"),
+    ("2️⃣", "连接伙伴", "添加学习小伙伴"),
+    ("3️⃣", "设置计划", "上传课表和日程"),
+    ("4️⃣", "开始学习", "协作共享信息"),
+]
+
+def _compact_html(markup):
+    return re.sub(r">\s+<", "><", markup.strip())
+
+@functools.lru_cache(maxsize=None)
+def get_home_fragments():
+    """构建一次并缓存首页的静态HTML片段"""
+    welcome = """
+    <div class="modern-card">
+        <h1>🎯 欢迎来到荔枝营地！</h1>
+        <p style="font-size: 1.2rem; color: #64748b; margin-bottom: 2rem;">
+        一个专为学习者打造的智能协作平台，让学习变得更简单、更有趣
+        </p>
+    </div>
+    """
+    
+    feature_cards = "".join(
+        f'<div class="feature-card"><h3>{html.escape(title)}</h3><p>{html.escape(text)}</p></div>'
+        for title, text in FEATURE_CARDS
+    )
+    
+    steps = "".join(
+        f"""
+            <div style="text-align: center; padding: 1.5rem; background: #f8fafc; border-radius: 15px;">
+                <div style="font-size: 2rem; margin-bottom: 1rem;">{icon}</div>
+                <h4>{html.escape(title)}</h4>
+                <p style="color: #64748b;">{html.escape(text)}</p>
+            </div>"""
+        for icon, title, text in QUICK_START_STEPS
+    )
+    quick_start = f"""
+    <div class="modern-card">
+        <h2>🚀 快速开始</h2>
+        <div style="display: grid; grid-template-columns: repeat(auto-fit, minmax(250px, 1fr)); gap: 1.5rem; margin-top: 1.5rem;">
+            {steps}
+        </div>
+    </div>
+    """
+    
+    return {
+        "welcome": _compact_html(welcome),
+        "features": _compact_html(f'<div class="feature-grid">{feature_cards}</div>'),
+        "quick_start": _compact_html(quick_start),
+    }
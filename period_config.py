@@ -0,0 +1,205 @@
+# period_config.py
+import datetime
+import hashlib
+import json
+import os
+import re
+import threading
+from array import array
+
+from shared_storage import data_path
+
+PERIOD_CONFIG_FILE = os.environ.get("LIZHI_PERIOD_CONFIG", data_path("period_schedule.json"))
+
+MINUTES_PER_DAY = 24 * 60
+NO_PERIOD = 0
+DEFAULT_SEMESTER_WEEKS = 16
+
+# 未提供配置文件时使用的默认作息
+DEFAULT_CONFIG = {
+    "institution": "默认作息",
+    "periods": [
+        {"period": 1, "start": "08:00", "end": "09:35"},
+        {"period": 2, "start": "09:50", "end": "12:15"},
+        {"period": 3, "start": "13:30", "end": "15:05"},
+        {"period": 4, "start": "15:20", "end": "16:55"},
+        {"period": 5, "start": "17:05", "end": "18:40"},
+        {"period": 6, "start": "19:20", "end": "21:45"},
+    ],
+    # 可选的学期设置 {"start": "2026-09-14", "weeks": 16}；未设置开学日期时按当前日期推算（见 timetable_model.semester_start）
+}
+
+_CLOCK_PATTERN = re.compile(r"^([01]?\d|2[0-3]):([0-5]\d)$")
+
+_lock = threading.Lock()
+_loaded = {"mtime": None, "schedule": None, "error": None}
+
+
+def _to_minutes(clock):
+    match = _CLOCK_PATTERN.match(str(clock).strip())
+    if not match:
+        raise ValueError(f"时间格式应为 HH:MM: {clock}")
+    return int(match.group(1)) * 60 + int(match.group(2))
+
+
+def _to_clock(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+class PeriodSchedule:
+    """编译后的作息时间表
+
+    minute_to_period[m] 为一天中第 m 分钟所在的节次（不在上课时间为0）；
+    next_period[m] 为第 m 分钟及之后最先开始的节次（当天没有则为0）。
+    两个数组都在加载时预先计算，时间与节次之间的转换都是一次数组访问。
+    semester_start 为配置的第一周周一（未配置时为 None），semester_weeks 为学期周数。
+    """
+
+    __slots__ = ("institution", "periods", "intervals", "minute_to_period", "next_period", "digest",
+                 "semester_start", "semester_weeks")
+
+    def __init__(self, institution, intervals, semester_start=None, semester_weeks=DEFAULT_SEMESTER_WEEKS):
+        self.institution = institution
+        self.semester_start = semester_start
+        self.semester_weeks = semester_weeks
+        self.intervals = dict(sorted(intervals.items()))
+        self.periods = tuple(self.intervals)
+        self.minute_to_period = array('B', [NO_PERIOD]) * MINUTES_PER_DAY
+        self.next_period = array('B', [NO_PERIOD]) * (MINUTES_PER_DAY + 1)
+        for period, (start, end) in self.intervals.items():
+            for minute in range(start, end):
+                self.minute_to_period[minute] = period
+        upcoming = NO_PERIOD
+        starts = {start: period for period, (start, _) in self.intervals.items()}
+        for minute in range(MINUTES_PER_DAY - 1, -1, -1):
+            upcoming = starts.get(minute, upcoming)
+            self.next_period[minute] = upcoming
+        payload = json.dumps([institution, sorted(self.intervals.items()),
+                              semester_start and semester_start.isoformat(), semester_weeks], ensure_ascii=False)
+        self.digest = hashlib.md5(payload.encode('utf-8')).hexdigest()[:8]
+
+    @classmethod
+    def from_config(cls, config):
+        """校验配置并编译，配置有误时抛出 ValueError"""
+        if not isinstance(config, dict) or not isinstance(config.get("periods"), list) or not config["periods"]:
+            raise ValueError("配置需要包含非空的 periods 列表")
+        intervals = {}
+        for entry in config["periods"]:
+            try:
+                period = int(entry["period"])
+                start = _to_minutes(entry["start"])
+                end = _to_minutes(entry["end"])
+            except (KeyError, TypeError) as e:
+                raise ValueError(f"节次配置缺少 period/start/end: {entry}") from e
+            if not 1 <= period <= 255:
+                raise ValueError(f"节次编号应在1到255之间: {period}")
+            if period in intervals:
+                raise ValueError(f"第{period}节重复配置")
+            if start >= end:
+                raise ValueError(f"第{period}节的结束时间需要晚于开始时间")
+            intervals[period] = (start, end)
+        ordered = sorted(intervals.items(), key=lambda item: item[1])
+        for (period_a, (_, end_a)), (period_b, (start_b, _)) in zip(ordered, ordered[1:]):
+            if start_b < end_a:
+                raise ValueError(f"第{period_a}节与第{period_b}节的时间重叠")
+        semester_start, semester_weeks = _parse_semester(config.get("semester"))
+        return cls(str(config.get("institution", "")), intervals, semester_start, semester_weeks)
+
+    def _minute(self, moment):
+        return moment.hour * 60 + moment.minute
+
+    def period_at(self, moment):
+        """某一时刻（time 或 datetime）所在的节次，不在上课时间返回 None"""
+        return self.minute_to_period[self._minute(moment)] or None
+
+    def next_period_at(self, moment):
+        """某一时刻之后（含当前分钟）当天最先开始的节次，没有则返回 None"""
+        return self.next_period[self._minute(moment)] or None
+
+    def clock_range(self, period):
+        """节次的 (开始, 结束) 时间字符串，未配置的节次返回 ("", "")"""
+        interval = self.intervals.get(period)
+        if interval is None:
+            return "", ""
+        return _to_clock(interval[0]), _to_clock(interval[1])
+
+    def bounds(self, date, period):
+        """某天某节课的 (开始datetime, 结束datetime)，未配置的节次返回 None"""
+        interval = self.intervals.get(period)
+        if interval is None:
+            return None
+        midnight = datetime.datetime.combine(date, datetime.time())
+        return (midnight + datetime.timedelta(minutes=interval[0]),
+                midnight + datetime.timedelta(minutes=interval[1]))
+
+    def to_config(self):
+        config = {
+            "institution": self.institution,
+            "periods": [
+                {"period": period, "start": _to_clock(start), "end": _to_clock(end)}
+                for period, (start, end) in self.intervals.items()
+            ],
+        }
+        semester = {"weeks": self.semester_weeks}
+        if self.semester_start:
+            semester["start"] = self.semester_start.isoformat()
+        config["semester"] = semester
+        return config
+
+
+def _parse_semester(semester):
+    """校验学期设置，返回 (第一周周一或 None, 周数)"""
+    if semester is None:
+        return None, DEFAULT_SEMESTER_WEEKS
+    if not isinstance(semester, dict):
+        raise ValueError("semester 应为包含 start/weeks 的对象")
+    start = semester.get("start")
+    if start is not None:
+        try:
+            start = datetime.date.fromisoformat(str(start))
+        except ValueError as e:
+            raise ValueError(f"开学日期格式应为 YYYY-MM-DD: {start}") from e
+        if start.weekday() != 0:
+            raise ValueError(f"开学日期应为星期一: {start}")
+    try:
+        weeks = int(semester.get("weeks", DEFAULT_SEMESTER_WEEKS))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"学期周数应为整数: {semester.get('weeks')}") from e
+    if not 1 <= weeks <= 30:
+        raise ValueError(f"学期周数应在1到30之间: {weeks}")
+    return start, weeks
+
+
+DEFAULT_SCHEDULE = PeriodSchedule.from_config(DEFAULT_CONFIG)
+
+
+def get_period_schedule():
+    """当前的作息时间表：启动时加载并校验一次，之后只在配置文件修改后重新加载
+
+    配置文件不存在或有误时使用默认作息，错误信息可通过 get_period_config_error 获取。
+    """
+    try:
+        mtime = os.path.getmtime(PERIOD_CONFIG_FILE)
+    except OSError:
+        mtime = None
+    if _loaded["schedule"] is not None and _loaded["mtime"] == mtime:
+        return _loaded["schedule"]
+
+    with _lock:
+        if _loaded["schedule"] is not None and _loaded["mtime"] == mtime:
+            return _loaded["schedule"]
+        schedule, error = DEFAULT_SCHEDULE, None
+        if mtime is not None:
+            try:
+                with open(PERIOD_CONFIG_FILE, 'r', encoding='utf-8') as f:
+                    schedule = PeriodSchedule.from_config(json.load(f))
+            except (OSError, ValueError) as e:
+                error = f"作息配置 {PERIOD_CONFIG_FILE} 无效，已使用默认作息: {e}"
+        _loaded.update(mtime=mtime, schedule=schedule, error=error)
+        return schedule
+
+
+def get_period_config_error():
+    """最近一次加载作息配置时的错误信息，没有错误时为 None"""
+    get_period_schedule()
+    return _loaded["error"]
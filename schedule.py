@@ -2,14 +2,25 @@
 import streamlit as st
 import json
 import os
-from datetime import datetime
+from datetime import datetime, time, timedelta
+
+from conflicts import get_user_conflicts, invalidate_user_conflicts
+from event_bus import get_event_bus
+from timetable_model import WEEKDAYS
+from schedule_index import TIME_FORMAT, RECURRENCE_OPTIONS, get_schedule_index, recurrence_text
+
+from fragments import rerun_section, consume_invalidation
+from instrumentation import timed, count_bytes
+from shared_storage import root_path, file_lock, file_signature, replace_file
+
+SCHEDULE_FILE = root_path("saved_texts.json")
 
 def load_schedule_data():
     """加载日程数据"""
-    DATA_FILE = "saved_texts.json"
-    if os.path.exists(DATA_FILE):
+    if os.path.exists(SCHEDULE_FILE):
         try:
-            with open(DATA_FILE, 'r', encoding='utf-8') as f:
+            count_bytes("read", os.path.getsize(SCHEDULE_FILE))
+            with open(SCHEDULE_FILE, 'r', encoding='utf-8') as f:
                 return json.load(f)
         except:
             return []
@@ -17,16 +28,103 @@ def load_schedule_data():
 
 def save_schedule_data(data):
     """保存日程数据"""
-    DATA_FILE = "saved_texts.json"
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    with file_lock(SCHEDULE_FILE):
+        replace_file(SCHEDULE_FILE, lambda f: json.dump(data, f, ensure_ascii=False, indent=2))
+
+def update_schedule_data(mutate):
+    """在文件锁内读取最新的日程、调用 mutate(日程列表) 修改后写回，返回修改后的列表
+
+    其他会话或服务进程同时保存的日程不会被覆盖。
+    """
+    with file_lock(SCHEDULE_FILE):
+        data = load_schedule_data()
+        mutate(data)
+        replace_file(SCHEDULE_FILE, lambda f: json.dump(data, f, ensure_ascii=False, indent=2))
+    return data
+
+def _sync_saved_texts(data):
+    st.session_state.saved_texts = data
+    st.session_state.saved_texts_signature = file_signature(SCHEDULE_FILE)
+
+def filter_schedule_texts(texts, search_term="", category_filter="所有分类", sort_option="最新优先"):
+    """按关键词和分类过滤日程，并按指定方式排序"""
+    filtered_texts = texts
+    
+    if search_term:
+        keyword = search_term.lower()
+        filtered_texts = [
+            text for text in filtered_texts
+            if keyword in text['content'].lower() or keyword in text['title'].lower()
+        ]
+    
+    if category_filter != "所有分类":
+        filtered_texts = [
+            text for text in filtered_texts
+            if text.get('category', '未分类') == category_filter
+        ]
+    
+    # 排序
+    if sort_option == "最新优先":
+        filtered_texts = sorted(filtered_texts, key=lambda x: x['created_at'], reverse=True)
+    elif sort_option == "最早优先":
+        filtered_texts = sorted(filtered_texts, key=lambda x: x['created_at'])
+    elif sort_option == "标题A-Z":
+        filtered_texts = sorted(filtered_texts, key=lambda x: x['title'])
+    elif sort_option == "标题Z-A":
+        filtered_texts = sorted(filtered_texts, key=lambda x: x['title'], reverse=True)
+    
+    return filtered_texts
+
+def display_schedule_range(current_user, visible_users):
+    """按周查看自己和伙伴设置了时间的日程（包括重复日程的每一次）"""
+    st.subheader("📆 时间段内的日程")
+    
+    today = datetime.now().date()
+    col1, col2 = st.columns([1, 2])
+    with col1:
+        week_start = st.date_input(
+            "从哪天开始的一周:",
+            value=today - timedelta(days=today.weekday()),
+            key="schedule_range_start"
+        )
+    with col2:
+        partners = sorted(user for user in visible_users if user != current_user)
+        selected = st.multiselect(
+            "查看谁的日程:",
+            ["我"] + partners,
+            default=["我"] + partners,
+            key="schedule_range_users"
+        )
+    
+    authors = [current_user if name == "我" else name for name in selected]
+    range_start = datetime.combine(week_start, time())
+    range_end = range_start + timedelta(weeks=1)
+    index = get_schedule_index(st.session_state.saved_texts, st.session_state.get('saved_texts_signature'))
+    found = index.overlapping(authors, range_start, range_end)
+    
+    if not found:
+        st.caption("这段时间内没有设置了时间的日程")
+        return
+    for start_at, end_at, entry in found:
+        author = entry.get('author', '未知')
+        who = "我" if author == current_user else author
+        repeat = " 🔁" if recurrence_text(entry) else ""
+        st.markdown(
+            f"- **{start_at.strftime('%m-%d')} {WEEKDAYS[start_at.weekday()]}** "
+            f"{start_at.strftime('%H:%M')}~{end_at.strftime('%H:%M')} · {who} · {entry.get('title', '')}{repeat}"
+        )
 
-def display_schedule_section(current_user, get_binded_users_func):
-    """显示日程分享部分"""
+@timed()
+def display_schedule_section(current_user, get_visible_users_func, get_timetables_func=None):
+    """显示日程分享部分 - get_visible_users_func 返回可见用户集合（绑定用户和同组成员），
+    get_timetables_func 返回课表数据，用于检查日程与课程的冲突"""
     
-    # 初始化数据
-    if 'saved_texts' not in st.session_state:
-        st.session_state.saved_texts = load_schedule_data()
+    # 初始化数据；可见范围变化时重新读取，以显示新伙伴的日程
+    invalidated = consume_invalidation("schedule")
+    if (invalidated or 'saved_texts' not in st.session_state
+            or st.session_state.get('saved_texts_signature') != file_signature(SCHEDULE_FILE)):
+        with file_lock(SCHEDULE_FILE, shared=True):
+            _sync_saved_texts(load_schedule_data())
     
     if 'text_counter' not in st.session_state:
         if st.session_state.saved_texts:
@@ -46,17 +144,17 @@ def display_schedule_section(current_user, get_binded_users_func):
         st.warning("请先登录以查看和分享日程")
         return
     
-    # 获取绑定用户列表
-    binded_users = get_binded_users_func()
+    # 获取可见用户集合
+    visible_users = get_visible_users_func()
     
-    # 显示保存的文本 - 只显示当前用户和绑定用户的文本
+    # 显示保存的文本 - 只显示当前用户和可见用户的文本
     st.markdown("---")
     
-    # 过滤文本：只显示当前用户和绑定用户的文本
+    # 过滤文本：只显示当前用户和可见用户的文本
     visible_texts = []
     for text in st.session_state.saved_texts:
         author = text.get('author', '未知')
-        if author == current_user or author in binded_users:
+        if author == current_user or author in visible_users:
             visible_texts.append(text)
     
     # 顶部统计卡片
@@ -90,31 +188,15 @@ def display_schedule_section(current_user, get_binded_users_func):
         with col3:
             sort_option = st.selectbox("排序方式:", ["最新优先", "最早优先", "标题A-Z", "标题Z-A"], key="sort_schedule")
         
-        # 过滤文本
-        filtered_texts = visible_texts
-        
-        if search_term:
-            filtered_texts = [
-                text for text in filtered_texts
-                if search_term.lower() in text['content'].lower() or 
-                   search_term.lower() in text['title'].lower()
-            ]
-        
-        if category_filter != "所有分类":
-            filtered_texts = [
-                text for text in filtered_texts
-                if text.get('category', '未分类') == category_filter
-            ]
+        # 过滤和排序文本
+        filtered_texts = filter_schedule_texts(visible_texts, search_term, category_filter, sort_option)
         
-        # 排序
-        if sort_option == "最新优先":
-            filtered_texts = sorted(filtered_texts, key=lambda x: x['created_at'], reverse=True)
-        elif sort_option == "最早优先":
-            filtered_texts = sorted(filtered_texts, key=lambda x: x['created_at'])
-        elif sort_option == "标题A-Z":
-            filtered_texts = sorted(filtered_texts, key=lambda x: x['title'])
-        elif sort_option == "标题Z-A":
-            filtered_texts = sorted(filtered_texts, key=lambda x: x['title'], reverse=True)
+        # 与自己课程时间冲突的日程
+        conflicting = {}
+        if get_timetables_func is not None:
+            for conflict in get_user_conflicts(get_timetables_func(), st.session_state.saved_texts, current_user):
+                if conflict['kind'] == 'schedule':
+                    conflicting.setdefault(conflict['schedule_id'], []).append(conflict['description'])
         
         # 显示过滤后的文本
         if not filtered_texts:
@@ -144,6 +226,13 @@ def display_schedule_section(current_user, get_binded_users_func):
                         if text_entry['tags']:
                             st.caption(f"🏷️ {', '.join(text_entry['tags'])}")
                     
+                    if text_entry.get('start_at'):
+                        repeat = recurrence_text(text_entry)
+                        st.caption(f"⏰ {text_entry['start_at']} ~ {text_entry.get('end_at') or ''}"
+                                   + (f" · 🔁 {repeat}" if repeat else ""))
+                    for description in conflicting.get(text_entry['id'], []):
+                        st.warning(f"⚠️ {description}")
+                    
                     # 文本内容
                     with st.expander("📝 查看日程内容", expanded=(i == 0)):
                         st.text_area(
@@ -167,17 +256,17 @@ def display_schedule_section(current_user, get_binded_users_func):
                         with col2:
                             if st.button("✏️ 编辑", key=f"edit_{text_entry['id']}"):
                                 st.session_state.editing_id = text_entry['id']
-                                st.rerun()
+                                rerun_section()
                         
                         with col3:
                             if st.button("🗑️ 删除", key=f"delete_{text_entry['id']}"):
-                                st.session_state.saved_texts = [
-                                    text for text in st.session_state.saved_texts 
-                                    if text['id'] != text_entry['id']
-                                ]
-                                save_schedule_data(st.session_state.saved_texts)
+                                def remove(data, entry_id=text_entry['id']):
+                                    data[:] = [text for text in data if text['id'] != entry_id]
+                                _sync_saved_texts(update_schedule_data(remove))
+                                invalidate_user_conflicts(current_user, timetables=False)
+                                get_event_bus().publish("schedule", current_user, action="删除", title=text_entry['title'])
                                 st.success("日程已删除")
-                                st.rerun()
+                                rerun_section()
                     else:
                         with col2:
                             st.button("🔒 锁定", key=f"lock_{text_entry['id']}", disabled=True)
@@ -202,22 +291,31 @@ def display_schedule_section(current_user, get_binded_users_func):
                     col1, col2 = st.columns(2)
                     with col1:
                         if st.button("💾 保存修改", key="save_edit_schedule", use_container_width=True):
-                            text_to_edit['title'] = edited_title
-                            text_to_edit['content'] = edited_content
-                            text_to_edit['updated_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                            text_to_edit['char_count'] = len(edited_content)
+                            def edit(data):
+                                for text in data:
+                                    if text['id'] == editing_id:
+                                        text['title'] = edited_title
+                                        text['content'] = edited_content
+                                        text['updated_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                                        text['char_count'] = len(edited_content)
                             
-                            save_schedule_data(st.session_state.saved_texts)
+                            _sync_saved_texts(update_schedule_data(edit))
+                            invalidate_user_conflicts(current_user, timetables=False)
+                            get_event_bus().publish("schedule", current_user, action="修改", title=edited_title)
                             del st.session_state.editing_id
                             st.success("修改已保存!")
-                            st.rerun()
+                            rerun_section()
                     
                     with col2:
                         if st.button("❌ 取消编辑", key="cancel_edit_schedule", use_container_width=True):
                             del st.session_state.editing_id
-                            st.rerun()
+                            rerun_section()
                     st.markdown('</div>', unsafe_allow_html=True)
     
+    # 按时间段查看自己和伙伴的日程
+    st.markdown("---")
+    display_schedule_range(current_user, visible_users)
+    
     # 添加新日程
     st.markdown("---")
     st.subheader("✨ 添加新日程")
@@ -259,6 +357,46 @@ def display_schedule_section(current_user, get_binded_users_func):
             key="schedule_category_select"
         )
     
+    # 可选的时间段，用于检查与课程的冲突
+    has_time = st.checkbox("⏰ 设置日程时间（检查与课程的冲突）", key="schedule_has_time")
+    if has_time:
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            schedule_date = st.date_input("日期:", key="schedule_date_input")
+        with col2:
+            start_time = st.time_input("开始时间:", value=time(14, 0), key="schedule_start_input")
+        with col3:
+            end_time = st.time_input("结束时间:", value=time(15, 0), key="schedule_end_input")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            recurrence = st.selectbox(
+                "重复:",
+                list(RECURRENCE_OPTIONS),
+                format_func=RECURRENCE_OPTIONS.get,
+                key="schedule_recurrence_select"
+            )
+        with col2:
+            recurrence_until = None
+            if recurrence != "none":
+                recurrence_until = st.date_input(
+                    "重复截止日期:",
+                    value=schedule_date + timedelta(weeks=4),
+                    min_value=schedule_date,
+                    key="schedule_until_input"
+                )
+        
+        # 与伙伴日程的重叠
+        if end_time > start_time:
+            new_start = datetime.combine(schedule_date, start_time)
+            new_end = datetime.combine(schedule_date, end_time)
+            index = get_schedule_index(st.session_state.saved_texts, st.session_state.get('saved_texts_signature'))
+            partners = sorted(user for user in visible_users if user != current_user)
+            overlaps = index.overlapping(partners, new_start, new_end)
+            for start_at, end_at, entry in overlaps:
+                st.info(f"👥 {entry.get('author')} 同一时间有日程「{entry.get('title', '')}」"
+                        f"（{start_at.strftime('%H:%M')}~{end_at.strftime('%H:%M')}）")
+    
     # 保存按钮
     if st.button("💾 保存日程", use_container_width=True, key="save_schedule_btn"):
         if st.session_state.current_text.strip():
@@ -274,20 +412,31 @@ def display_schedule_section(current_user, get_binded_users_func):
                 'updated_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 'char_count': len(st.session_state.current_text)
             }
+            if has_time:
+                if end_time <= start_time:
+                    st.warning("⚠️ 结束时间需要晚于开始时间")
+                    return
+                text_entry['start_at'] = datetime.combine(schedule_date, start_time).strftime(TIME_FORMAT)
+                text_entry['end_at'] = datetime.combine(schedule_date, end_time).strftime(TIME_FORMAT)
+                if recurrence != "none":
+                    text_entry['recurrence'] = recurrence
+                    text_entry['recurrence_until'] = recurrence_until.isoformat()
             
-            # 添加到保存的文本列表
-            st.session_state.saved_texts.append(text_entry)
-            st.session_state.text_counter += 1
-            
-            # 保存到文件
-            save_schedule_data(st.session_state.saved_texts)
+            # 在文件锁内按最新数据分配ID并追加，其他会话/进程同时保存的日程不会丢失
+            def add(data):
+                text_entry['id'] = max((text['id'] for text in data), default=-1) + 1
+                data.append(text_entry)
+            _sync_saved_texts(update_schedule_data(add))
+            st.session_state.text_counter = text_entry['id'] + 1
+            invalidate_user_conflicts(current_user, timetables=False)
+            get_event_bus().publish("schedule", current_user, action="发布", title=text_entry['title'])
             
             # 清空当前输入
             st.session_state.current_text = ""
             st.session_state.current_title = f"文本_{st.session_state.text_counter + 1}"
             
             st.success("✅ 日程已保存!")
-            st.rerun()
+            rerun_section()
         else:
             st.warning("⚠️ 请输入日程内容")
     
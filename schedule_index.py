@@ -0,0 +1,160 @@
+# schedule_index.py
+import datetime
+import threading
+from bisect import bisect_left, bisect_right
+
+from timetable_model import SEMESTER_WEEKS, semester_end
+
+TIME_FORMAT = "%Y-%m-%d %H:%M"
+
+RECURRENCE_OPTIONS = {"none": "不重复", "daily": "每天", "weekly": "每周"}
+_RECURRENCE_STEP = {"daily": datetime.timedelta(days=1), "weekly": datetime.timedelta(weeks=1)}
+
+# 未设置截止日期的重复日程最多展开的次数
+MAX_OCCURRENCES = 366
+
+_lock = threading.Lock()
+_cached = {"key": None, "index": None}
+
+
+def parse_time(value):
+    """解析日程的时间字段（YYYY-MM-DD HH:MM），无效时返回 None"""
+    if not value:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def entry_interval(entry):
+    """日程第一次发生的 (开始, 结束)；没有设置时间的旧日程返回 None"""
+    start_at = parse_time(entry.get('start_at'))
+    if start_at is None:
+        return None
+    end_at = parse_time(entry.get('end_at'))
+    if end_at is None or end_at <= start_at:
+        end_at = start_at + datetime.timedelta(hours=1)
+    return start_at, end_at
+
+
+def open_ended_until(first_date, last_day=None):
+    """未设置截止日期的重复日程展开到的日期：本学期末 last_day；在学期结束后开始的日程展开一个学期的长度"""
+    until = last_day or semester_end()
+    if first_date > until:
+        until = first_date + datetime.timedelta(weeks=SEMESTER_WEEKS)
+    return until
+
+
+def occurrences(entry, last_day=None):
+    """日程的每一次发生 [(开始, 结束), ...]
+
+    重复日程展开到 recurrence_until（含当天），未设置时见 open_ended_until。
+    逐条展开大量日程时由调用方取一次学期末 last_day 传入。
+    """
+    interval = entry_interval(entry)
+    if interval is None:
+        return []
+    start_at, end_at = interval
+    step = _RECURRENCE_STEP.get(entry.get('recurrence'))
+    if step is None:
+        return [interval]
+
+    try:
+        until = datetime.date.fromisoformat(entry['recurrence_until'])
+    except (KeyError, TypeError, ValueError):
+        until = open_ended_until(start_at.date(), last_day)
+    result = []
+    while start_at.date() <= until and len(result) < MAX_OCCURRENCES:
+        result.append((start_at, end_at))
+        start_at += step
+        end_at += step
+    return result or [interval]
+
+
+def recurrence_text(entry):
+    """重复规则的说明文字，不重复时为空字符串"""
+    recurrence = entry.get('recurrence')
+    if recurrence not in _RECURRENCE_STEP:
+        return ""
+    until = entry.get('recurrence_until')
+    return f"{RECURRENCE_OPTIONS[recurrence]}重复" + (f"至 {until}" if until else "")
+
+
+class AuthorIntervals:
+    """一位作者所有日程的时间段，按时长分组，每组按开始时间排序
+
+    按时长（分钟）的二进制位数每两位分一组，同组时长相差不到4倍。与 [start, end) 重叠的时间段开始时间一定在
+    (start - 组内最长时长, end) 内，每组二分出这个范围后只检查范围内的时间段；
+    少数很长的日程（如整个学期）自成一组，不会让其他查询退化为全表扫描。
+    """
+
+    __slots__ = ("groups", "count")
+
+    def __init__(self, intervals):
+        buckets = {}
+        for item in intervals:
+            minutes = max(int((item[1] - item[0]).total_seconds()) // 60, 1)
+            buckets.setdefault(minutes.bit_length() // 2, []).append(item)
+        self.groups = []
+        for items in buckets.values():
+            items.sort(key=lambda item: (item[0], item[1]))
+            self.groups.append((
+                [start for start, _, _ in items],
+                [end for _, end, _ in items],
+                [entry for _, _, entry in items],
+                max(end - start for start, end, _ in items),
+            ))
+        self.count = len(intervals)
+
+    def __len__(self):
+        return self.count
+
+    def overlapping(self, start, end):
+        """与 [start, end) 重叠的 [(开始, 结束, 日程), ...]，按开始时间排序"""
+        found = []
+        for starts, ends, entries, longest in self.groups:
+            for i in range(bisect_right(starts, start - longest), bisect_left(starts, end)):
+                if ends[i] > start:
+                    found.append((starts[i], ends[i], entries[i]))
+        if len(self.groups) > 1:
+            found.sort(key=lambda item: (item[0], item[1]))
+        return found
+
+
+class ScheduleIndex:
+    """按作者划分的日程时间索引，只包含设置了时间的日程"""
+
+    def __init__(self, schedules, last_day=None):
+        last_day = last_day or semester_end()
+        grouped = {}
+        for entry in schedules:
+            for start_at, end_at in occurrences(entry, last_day):
+                grouped.setdefault(entry.get('author'), []).append((start_at, end_at, entry))
+        self.by_author = {author: AuthorIntervals(intervals) for author, intervals in grouped.items()}
+
+    def overlapping(self, authors, start, end):
+        """指定作者们与 [start, end) 重叠的日程 [(开始, 结束, 日程), ...]，按开始时间排序"""
+        found = []
+        for author in authors:
+            intervals = self.by_author.get(author)
+            if intervals:
+                found.extend(intervals.overlapping(start, end))
+        found.sort(key=lambda item: (item[0], item[1]))
+        return found
+
+
+def get_schedule_index(schedules, version):
+    """日程的时间索引，按日程数据的版本（如 saved_texts_signature）缓存；version 为 None 时不缓存"""
+    # 未设置截止日期的重复日程展开到学期末，学期变化后需要重新构建
+    last_day = semester_end()
+    key = (version, last_day)
+    if version is not None:
+        with _lock:
+            if _cached["key"] == key:
+                return _cached["index"]
+    index = ScheduleIndex([entry for entry in schedules if entry.get('start_at')], last_day)
+    if version is not None:
+        with _lock:
+            _cached.update(key=key, index=index)
+    return index
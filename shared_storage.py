@@ -0,0 +1,91 @@
+# shared_storage.py
+import contextlib
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，只能保证进程内互斥
+    fcntl = None
+
+from instrumentation import count_bytes
+
+# 数据根目录：多个服务进程指向同一目录即可共享数据
+DATA_ROOT = os.environ.get("LIZHI_DATA_ROOT", ".")
+DATA_DIR = os.path.join(DATA_ROOT, "timetable_data")
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+_held = threading.local()
+
+
+def root_path(name):
+    """数据根目录下的文件（关系、小组、日程等）"""
+    return os.path.join(DATA_ROOT, name)
+
+
+def data_path(*parts):
+    """timetable_data 目录下的文件"""
+    return os.path.join(DATA_DIR, *parts)
+
+
+def file_signature(path):
+    """文件的 (inode, 修改时间ns, 大小)，文件不存在时为 None
+
+    原子替换会换新的inode，追加写入会改变大小，比单独比较修改时间更可靠。
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _thread_lock(path):
+    with _thread_locks_guard:
+        return _thread_locks.setdefault(path, threading.RLock())
+
+
+@contextlib.contextmanager
+def file_lock(path, shared=False):
+    """跨进程的文件锁（path + ".lock" 上的 flock），同一线程内可重入
+
+    shared=True 为读锁，可与其他读锁同时持有。
+    """
+    held = getattr(_held, "paths", None)
+    if held is None:
+        held = _held.paths = {}
+    if held.get(path):
+        held[path] += 1
+        try:
+            yield
+        finally:
+            held[path] -= 1
+        return
+
+    lock = _thread_lock(path)
+    with lock:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path + ".lock", 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            held[path] = 1
+            try:
+                yield
+            finally:
+                held[path] = 0
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def replace_file(path, write, binary=False):
+    """先写临时文件再原子替换，其他会话和进程不会读到写了一半的文件"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with (open(tmp_path, 'wb') if binary else open(tmp_path, 'w', encoding='utf-8')) as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    count_bytes("written", os.path.getsize(tmp_path))
+    os.replace(tmp_path, path)
@@ -0,0 +1,205 @@
+# storage_maintenance.py
+import argparse
+import datetime
+import json
+import os
+import time
+
+from exporters import EXPORT_DIR
+from instrumentation import span
+from period_config import get_period_schedule
+from shared_storage import DATA_DIR, data_path, replace_file
+from timetable_model import semester_start
+from timetable_store import get_timetable_store, delete_op
+
+# 每个用户最多保存的课表数和表格编码字节数（内容相同的课表只计一次）
+USER_TIMETABLE_QUOTA = int(os.environ.get("LIZHI_USER_TIMETABLE_QUOTA", "50"))
+USER_BYTES_QUOTA = int(os.environ.get("LIZHI_USER_QUOTA_MB", "20")) * 1024 * 1024
+
+# 导出缓存超过这么多天未更新即删除，下次下载时重新生成
+EXPORT_MAX_AGE_DAYS = 7
+# 写入中断留下的临时文件超过这么久（秒）视为孤立文件
+TMP_FILE_MAX_AGE = 3600
+
+MAINTENANCE_REPORT_FILE = data_path("maintenance.json")
+
+
+def user_usage(records, user):
+    """用户已保存的 (课表数, 表格编码字节数)"""
+    count, payloads = 0, {}
+    for record in records.values():
+        if record.get('uploaded_by') == user:
+            count += 1
+            payloads.setdefault(record.get('file_hash') or id(record), record)
+    return count, sum(record.nbytes() for record in payloads.values())
+
+
+def check_quota(records, user, record, replacing=False):
+    """检查保存 record 后是否超出用户配额，返回 (是否允许, 提示信息)
+
+    replacing 为 True 表示作为已有课表的新版本保存，不增加课表数。
+    """
+    count, used = user_usage(records, user)
+    if not replacing and count >= USER_TIMETABLE_QUOTA:
+        return False, f"课表数量已达上限（{USER_TIMETABLE_QUOTA} 个），请先删除不需要的课表"
+    already_stored = any(other.get('uploaded_by') == user and other.get('file_hash') == record.get('file_hash')
+                         for other in records.values())
+    added = 0 if already_stored else record.nbytes()
+    if used + added > USER_BYTES_QUOTA:
+        return False, f"课表存储空间已达上限（{USER_BYTES_QUOTA // (1024 * 1024)}MB），请先删除不需要的课表"
+    return True, ""
+
+
+def check_write_quota(records, ops):
+    """按顺序检查一批课表存储操作（put_op/delete_op）是否使上传者超出配额，返回 (是否允许, 提示信息)
+
+    所有写入课表的路径都在写入前调用；替换已有课表不增加课表数。
+    """
+    records = dict(records)
+    for op in ops:
+        previous = records.pop(op["name"], None)
+        if op["op"] != "put":
+            continue
+        record = op["record"]
+        allowed, message = check_quota(records, record.get('uploaded_by'), record, replacing=previous is not None)
+        if not allowed:
+            return False, message
+        records[op["name"]] = record
+    return True, ""
+
+
+def _directory_size(path, suffix=None):
+    total = 0
+    if os.path.isdir(path):
+        for entry in os.scandir(path):
+            if entry.is_file() and (suffix is None or entry.name.endswith(suffix)):
+                total += entry.stat().st_size
+    return total
+
+
+def storage_sizes(store=None):
+    """课表快照、日志、导出缓存的字节数"""
+    stats = (store or get_timetable_store()).stats()
+    sizes = {
+        "snapshot": stats["snapshot_bytes"],
+        "wal": stats["wal_bytes"],
+        "exports": _directory_size(EXPORT_DIR),
+    }
+    sizes["total"] = sum(sizes.values())
+    return sizes
+
+
+def find_orphans(records, users):
+    """上传者已不在用户目录中的课表；用户目录为空时（可能读取失败）不做判断"""
+    if not len(users):
+        return []
+    return [name for name, record in records.items() if record.get('uploaded_by') not in users]
+
+
+def find_export_garbage(records, now=None):
+    """可以删除的导出缓存：对应课表已删除、学期或作息已变化、长时间未使用，以及残留的临时文件"""
+    if not os.path.isdir(EXPORT_DIR):
+        return []
+    now = now or time.time()
+    live_hashes = {record.get('file_hash') for record in records.values()}
+    current_suffix = (f"{semester_start():%Y%m%d}", get_period_schedule().digest)
+    garbage = []
+    for entry in os.scandir(EXPORT_DIR):
+        if not entry.is_file():
+            continue
+        age = now - entry.stat().st_mtime
+        if entry.name.endswith(".tmp"):
+            if age > TMP_FILE_MAX_AGE:
+                garbage.append(entry.path)
+            continue
+        try:
+            key, semester, digest = entry.name.rsplit(".", 1)[0].rsplit("_", 2)
+        except ValueError:
+            garbage.append(entry.path)
+            continue
+        if ((semester, digest) != current_suffix
+                or (not key.startswith("group_") and key.split("-", 1)[0] not in live_hashes)
+                or age > EXPORT_MAX_AGE_DAYS * 86400):
+            garbage.append(entry.path)
+    return garbage
+
+
+def find_tmp_garbage(now=None):
+    """数据目录中写入中断留下的临时文件"""
+    if not os.path.isdir(DATA_DIR):
+        return []
+    now = now or time.time()
+    return [entry.path for entry in os.scandir(DATA_DIR)
+            if entry.is_file() and entry.name.endswith(".tmp") and now - entry.stat().st_mtime > TMP_FILE_MAX_AGE]
+
+
+def run_maintenance(users, store=None, dry_run=False, remove_orphans=False):
+    """整理课表存储：清理失效的哈希值和缓存文件，并压缩快照与日志
+
+    内容相同的课表由课表存储共享同一份内容，压缩时只写入仍被引用的内容，不删除用户可见的课表。
+    上传者已不在用户目录中的课表默认只列入报告，remove_orphans 时才删除。
+    users 为用户目录（支持 in 和 len）；是 UserDirectory 时同时把仍以明文保存的密码迁移为哈希。
+    返回整理报告，dry_run 时只报告不修改。
+    """
+    store = store or get_timetable_store()
+    plaintext = users.plaintext_users() if hasattr(users, "plaintext_users") else []
+    if plaintext and not dry_run:
+        users.scrub_plaintext()
+    before = storage_sizes(store)
+    with span("storage_maintenance", dry_run=dry_run), store.transaction():
+        orphans = find_orphans(store.records(), users)
+        removed_hashes = 0
+        if not dry_run:
+            if remove_orphans:
+                # 哈希值在压缩时按剩余课表统一清理
+                store.apply([delete_op(name) for name in orphans])
+            removed_hashes = store.compact(prune_hashes=True)
+        remaining = store.records()
+        stats = store.stats()
+    garbage = find_export_garbage(remaining) + find_tmp_garbage()
+    if not dry_run:
+        for path in garbage:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    report = {
+        "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "dry_run": dry_run,
+        "orphans": orphans,
+        "removed_orphans": orphans if remove_orphans else [],
+        "timetables": stats["timetables"],
+        "unique_payloads": stats["unique_payloads"],
+        "removed_hashes": removed_hashes,
+        "plaintext_password_users": plaintext,
+        "removed_files": [os.path.basename(path) for path in garbage],
+        "before": before,
+        "after": before if dry_run else storage_sizes(store),
+    }
+    if not dry_run:
+        replace_file(MAINTENANCE_REPORT_FILE, lambda f: json.dump(report, f, ensure_ascii=False, indent=2))
+    return report
+
+
+def last_maintenance_report():
+    """上次整理的报告，没有整理过时为 None"""
+    try:
+        with open(MAINTENANCE_REPORT_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="整理课表存储：清理失效数据并压缩")
+    parser.add_argument("--dry-run", action="store_true", help="只列出将被清理的内容，不做修改")
+    parser.add_argument("--remove-orphans", action="store_true", help="同时删除上传者已不存在的课表（默认只报告）")
+    args = parser.parse_args()
+
+    from user_directory import UserDirectory
+    report = run_maintenance(UserDirectory(), dry_run=args.dry_run, remove_orphans=args.remove_orphans)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+# timetable_diff.py
+import collections
+import datetime
+import threading
+
+import numpy as np
+import pandas as pd
+
+from timetable_model import WEEKDAYS, get_timetable_model
+
+# 每个课表最多保留的历史版本数
+MAX_VERSIONS = 20
+
+_CHANGES_CACHE_SIZE = 256
+_changes_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _grids(record):
+    """课表记录中的所有表格 {工作表名: DataFrame}，单表课表的键为 None"""
+    return record.get('sheets') or {None: record['dataframe']}
+
+
+def _padded_values(df, rows, cols):
+    values = np.full((rows, cols), np.nan, dtype=object)
+    values[:df.shape[0], :df.shape[1]] = df.to_numpy(dtype=object)
+    return values
+
+
+def changed_cells(old, new):
+    """两个表格中取值不同的单元格位置（按两者中较大的尺寸对齐，空值之间视为相同）"""
+    rows = max(old.shape[0], new.shape[0])
+    cols = max(old.shape[1], new.shape[1])
+    old_values = _padded_values(old, rows, cols)
+    new_values = _padded_values(new, rows, cols)
+    both_missing = pd.isna(old_values) & pd.isna(new_values)
+    differs = (old_values != new_values) & ~both_missing
+    return np.nonzero(differs), old_values
+
+
+def diff_frames(old, new):
+    """计算从新表格还原旧表格所需的反向差异：旧尺寸、旧列名和变化单元格的旧值"""
+    (row_index, col_index), old_values = changed_cells(old, new)
+    cells = [
+        (int(r), int(c), old_values[r, c])
+        for r, c in zip(row_index, col_index)
+        if r < old.shape[0] and c < old.shape[1]
+    ]
+    return {'shape': old.shape, 'columns': list(old.columns), 'cells': cells}
+
+
+def apply_reverse_delta(new, delta):
+    """用反向差异从新表格还原旧表格"""
+    rows, cols = delta['shape']
+    values = _padded_values(new, max(rows, new.shape[0]), max(cols, new.shape[1]))
+    for r, c, value in delta['cells']:
+        values[r, c] = value
+    return pd.DataFrame(values[:rows, :cols], columns=delta['columns']).infer_objects()
+
+
+def build_version(old_record, new_record):
+    """构造旧记录相对新记录的版本条目：只保存差异，新版本中已删除的工作表才完整保存"""
+    old_grids = _grids(old_record)
+    new_grids = _grids(new_record)
+    grids = {}
+    for key, old_df in old_grids.items():
+        if key in new_grids:
+            grids[key] = {'delta': diff_frames(old_df, new_grids[key])}
+        else:
+            grids[key] = {'full': old_df}
+    return {
+        'file_name': old_record['file_name'],
+        'file_hash': old_record['file_hash'],
+        'upload_time': old_record['upload_time'],
+        'replaced_at': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'multi_sheet': 'sheets' in old_record,
+        'grids': grids,
+    }
+
+
+def add_version(old_record, new_record):
+    """新上传的课表替换旧课表，旧课表作为差异追加到版本链"""
+    versions = list(old_record.get('versions', []))
+    versions.append(build_version(old_record, new_record))
+    merged = dict(new_record)
+    merged['versions'] = versions[-MAX_VERSIONS:]
+    return merged
+
+
+def _restore(record, version):
+    grids = _grids(record)
+    restored = {}
+    for key, stored in version['grids'].items():
+        restored[key] = stored['full'] if 'full' in stored else apply_reverse_delta(grids[key], stored['delta'])
+    previous = {
+        'file_name': version['file_name'],
+        'file_hash': version['file_hash'],
+        'upload_time': version['upload_time'],
+        'uploaded_by': record.get('uploaded_by'),
+        'is_locked': record.get('is_locked', False),
+        'dataframe': next(iter(restored.values())),
+    }
+    if version['multi_sheet']:
+        previous['sheets'] = restored
+    return previous
+
+
+def previous_version(record, steps=1):
+    """还原 steps 个版本之前的课表记录，不存在时返回 None"""
+    versions = record.get('versions', [])
+    if steps < 1 or steps > len(versions):
+        return None
+    current = record
+    for version in reversed(versions[-steps:]):
+        current = _restore(current, version)
+    return current
+
+
+def _slot_key(slot):
+    return slot.day, slot.period, slot.name
+
+
+def course_changes(old_record, new_record):
+    """两个版本之间的课程变化：新增、删除、以及教师/地点/周次的修改"""
+    old_slots = {}
+    for slot in get_timetable_model(old_record).slots:
+        old_slots.setdefault(_slot_key(slot), slot)
+    new_slots = {}
+    for slot in get_timetable_model(new_record).slots:
+        new_slots.setdefault(_slot_key(slot), slot)
+
+    changes = []
+    for key in sorted(new_slots.keys() - old_slots.keys()):
+        slot = new_slots[key]
+        changes.append(('added', f"{WEEKDAYS[slot.day]} 第{slot.period}节 {slot.name}（{slot.weeks_text}）"))
+    for key in sorted(old_slots.keys() - new_slots.keys()):
+        slot = old_slots[key]
+        changes.append(('removed', f"{WEEKDAYS[slot.day]} 第{slot.period}节 {slot.name}（{slot.weeks_text}）"))
+    for key in sorted(old_slots.keys() & new_slots.keys()):
+        old_slot, new_slot = old_slots[key], new_slots[key]
+        details = [
+            f"{label} {getattr(old_slot, field) or '无'} → {getattr(new_slot, field) or '无'}"
+            for field, label in (('teacher', '教师'), ('room', '地点'), ('weeks_text', '周次'))
+            if getattr(old_slot, field) != getattr(new_slot, field)
+        ]
+        if details:
+            changes.append(('changed', f"{WEEKDAYS[new_slot.day]} 第{new_slot.period}节 {new_slot.name}: {'，'.join(details)}"))
+    return changes
+
+
+def count_changed_cells(old_record, new_record):
+    """两个版本之间变化的单元格总数（不是课表网格的表格也能比较）"""
+    old_grids = _grids(old_record)
+    new_grids = _grids(new_record)
+    total = 0
+    for key in old_grids.keys() | new_grids.keys():
+        if key not in old_grids or key not in new_grids:
+            df = old_grids.get(key, new_grids.get(key))
+            total += int(df.notna().to_numpy().sum())
+            continue
+        (row_index, _), _ = changed_cells(old_grids[key], new_grids[key])
+        total += len(row_index)
+    return total
+
+
+def changes_since_previous(record):
+    """当前版本相对上一版本的变化 (课程变化列表, 变化单元格数)，按两个版本的 file_hash 缓存"""
+    versions = record.get('versions')
+    if not versions:
+        return None
+    key = (record['file_hash'], versions[-1]['file_hash'])
+    with _cache_lock:
+        cached = _changes_cache.get(key)
+        if cached is not None:
+            _changes_cache.move_to_end(key)
+            return cached
+    previous = previous_version(record)
+    cached = (course_changes(previous, record), count_changed_cells(previous, record))
+    with _cache_lock:
+        _changes_cache[key] = cached
+        while len(_changes_cache) > _CHANGES_CACHE_SIZE:
+            _changes_cache.popitem(last=False)
+    return cached
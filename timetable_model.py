@@ -0,0 +1,370 @@
+# timetable_model.py
+import collections
+import datetime
+import math
+import os
+import re
+import threading
+
+from period_config import get_period_schedule
+
+# 学期总周数（环境变量优先，其次为作息配置中的 semester.weeks），决定周次位掩码的宽度，修改后需重启
+SEMESTER_WEEKS = int(os.environ.get("LIZHI_SEMESTER_WEEKS") or get_period_schedule().semester_weeks)
+ALL_WEEKS = (1 << SEMESTER_WEEKS) - 1
+
+# 指定的第一周周一；未指定时按当前日期推算，见 semester_start
+_SEMESTER_START_OVERRIDE = os.environ.get("LIZHI_SEMESTER_START")
+# 未配置开学日期时推算学期用的 (月, 日)：春季、秋季学期分别从该日起的第一个周一开始
+TERM_START_DATES = ((2, 24), (9, 9))
+
+WEEKDAYS = ["星期一", "星期二", "星期三", "星期四", "星期五", "星期六", "星期日"]
+WEEKDAY_INDEX = {name: i for i, name in enumerate(WEEKDAYS)}
+WEEKDAY_INDEX.update({"周一": 0, "周二": 1, "周三": 2, "周四": 3, "周五": 4, "周六": 5, "周日": 6,
+                      "星期天": 6, "周天": 6})
+
+CHINESE_NUMBERS = {"一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9, "十": 10}
+COURSE_TYPES = ("必修", "限选", "任选")
+
+_COURSE_PATTERN = re.compile(r"^(.*)[(（]([^()（）]*)[)）]\s*$")
+_PERIOD_PATTERN = re.compile(r"第\s*(\d+)\s*节")
+_SHEET_WEEK_PATTERN = re.compile(r"^第\s*(\d+)\s*周$")
+
+_MODEL_CACHE_SIZE = 256
+_model_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _chinese_to_int(text):
+    if text.isdigit():
+        return int(text)
+    if text == "十":
+        return 10
+    if text.startswith("十"):
+        return 10 + CHINESE_NUMBERS[text[1]]
+    if text.endswith("十"):
+        return CHINESE_NUMBERS[text[0]] * 10
+    if "十" in text:
+        tens, ones = text.split("十")
+        return CHINESE_NUMBERS[tens] * 10 + CHINESE_NUMBERS[ones]
+    return CHINESE_NUMBERS[text]
+
+
+def week_range_mask(first, last):
+    """第 first 周到第 last 周的位掩码（第N周对应第N-1位）"""
+    first = max(first, 1)
+    last = min(last, SEMESTER_WEEKS)
+    if first > last:
+        return 0
+    return ((1 << (last - first + 1)) - 1) << (first - 1)
+
+
+ODD_WEEKS = sum(1 << (week - 1) for week in range(1, SEMESTER_WEEKS + 1, 2))
+EVEN_WEEKS = ALL_WEEKS & ~ODD_WEEKS
+
+
+def parse_week_spec(text):
+    """把周次描述转换为位掩码，如 全周、前八周、后八周、2-8周、4周、单周、双周、1,3,5周、1-8周(单)；无法识别时视为全周"""
+    spec = re.sub(r"\s", "", str(text or "")).replace("第", "")
+    if not spec or spec in ("全周", "每周"):
+        return ALL_WEEKS
+
+    parity = ALL_WEEKS
+    if "单" in spec:
+        parity = ODD_WEEKS
+    elif "双" in spec:
+        parity = EVEN_WEEKS
+    spec = re.sub(r"[单双()（）]", "", spec)
+
+    half = re.fullmatch(r"([前后])([一二三四五六七八九十\d]+)周", spec)
+    if half:
+        count = _chinese_to_int(half.group(2))
+        if half.group(1) == "前":
+            return week_range_mask(1, count) & parity
+        return week_range_mask(SEMESTER_WEEKS - count + 1, SEMESTER_WEEKS) & parity
+
+    spec = spec.rstrip("周")
+    if not spec:
+        return parity
+    mask = 0
+    for part in re.split(r"[,，、]", spec):
+        bounds = re.fullmatch(r"(\d+)(?:[-~－—至到](\d+))?", part)
+        if not bounds:
+            return ALL_WEEKS
+        first = int(bounds.group(1))
+        last = int(bounds.group(2) or first)
+        mask |= week_range_mask(first, last)
+    return mask & parity
+
+
+def weeks_to_text(mask):
+    """位掩码转换为简短的周次描述，如 1-8,10周"""
+    if mask & ALL_WEEKS == ALL_WEEKS:
+        return "全周"
+    parts = []
+    week = 1
+    while week <= SEMESTER_WEEKS:
+        if mask >> (week - 1) & 1:
+            start = week
+            while week < SEMESTER_WEEKS and mask >> week & 1:
+                week += 1
+            parts.append(str(start) if start == week else f"{start}-{week}")
+        week += 1
+    return ",".join(parts) + "周" if parts else "无"
+
+
+class CourseSlot:
+    """课表中的一门课：星期、节次、课程信息和上课周的位掩码"""
+
+    __slots__ = ("day", "period", "name", "teacher", "course_type", "room", "weeks_text", "weeks")
+
+    def __init__(self, day, period, name, teacher="", course_type="", room="", weeks_text="全周", weeks=ALL_WEEKS):
+        self.day = day
+        self.period = period
+        self.name = name
+        self.teacher = teacher
+        self.course_type = course_type
+        self.room = room
+        self.weeks_text = weeks_text
+        self.weeks = weeks
+
+    def active_in(self, week):
+        return week is not None and 1 <= week <= SEMESTER_WEEKS and bool(self.weeks >> (week - 1) & 1)
+
+    def time_range(self, schedule=None):
+        """按作息配置得到的 (开始, 结束) 时间字符串；逐门课调用时由调用方传入一次取得的 schedule"""
+        return (schedule or get_period_schedule()).clock_range(self.period)
+
+    def __repr__(self):
+        return f"CourseSlot({WEEKDAYS[self.day]} 第{self.period}节 {self.name} {self.weeks_text})"
+
+
+def parse_course_text(text):
+    """解析一个课程描述，如 线性代数(杨晶；必修；全周；六教6A016)，返回 (课程名, 教师, 类型, 周次, 地点)"""
+    text = text.strip()
+    match = _COURSE_PATTERN.match(text)
+    if not match or not match.group(1).strip():
+        # 没有括号信息（或内容被截断），只保留课程名
+        return text.rstrip("(（").strip(), "", "", "全周", ""
+
+    name = match.group(1).strip()
+    fields = [field.strip() for field in re.split(r"[；;]", match.group(2)) if field.strip()]
+    teacher = course_type = room = ""
+    weeks_text = "全周"
+    week_index = next((i for i, field in enumerate(fields) if field.endswith("周")), None)
+    if week_index is not None:
+        weeks_text = fields[week_index]
+        if week_index + 1 < len(fields):
+            room = "；".join(fields[week_index + 1:])
+        fields = fields[:week_index]
+    for field in fields:
+        if field in COURSE_TYPES:
+            course_type = field
+        elif not teacher:
+            teacher = field
+    return name, teacher, course_type, weeks_text, room
+
+
+def parse_cell(value):
+    """解析一个单元格，一个时段可能有多门课（换行分隔）"""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return []
+    courses = []
+    for line in re.split(r"[\r\n]+", str(value)):
+        if line.strip():
+            courses.append(parse_course_text(line))
+    return courses
+
+
+def _locate_grid(df):
+    """找到星期所在的列和表头行：星期可能在列名中，也可能在前几行中"""
+    day_columns = {}
+    for column in df.columns:
+        day = WEEKDAY_INDEX.get(str(column).strip())
+        if day is not None:
+            day_columns[column] = day
+    if day_columns:
+        return day_columns, 0
+
+    for row_number in range(min(len(df), 5)):
+        row = df.iloc[row_number]
+        for column in df.columns:
+            value = row[column]
+            day = WEEKDAY_INDEX.get(str(value).strip()) if isinstance(value, str) else None
+            if day is not None:
+                day_columns[column] = day
+        if day_columns:
+            return day_columns, row_number + 1
+    return {}, 0
+
+
+def slots_from_dataframe(df, weeks_filter=ALL_WEEKS):
+    """把课表网格转换为课程列表；weeks_filter 用于按周分表的工作表"""
+    if df is None or df.empty:
+        return []
+    day_columns, first_row = _locate_grid(df)
+    if not day_columns:
+        return []
+    # 一次性从首列提取节次，跳过不是 第N节 的行（如名单、备注）
+    periods = df.iloc[first_row:, 0].astype(str).str.extract(_PERIOD_PATTERN, expand=False).dropna()
+
+    slots = []
+    for row_label, period in periods.items():
+        period = int(period)
+        for column, day in day_columns.items():
+            for name, teacher, course_type, weeks_text, room in parse_cell(df.at[row_label, column]):
+                weeks = parse_week_spec(weeks_text) & weeks_filter
+                if weeks:
+                    slots.append(CourseSlot(day, period, name, teacher, course_type, room, weeks_text, weeks))
+    return slots
+
+
+class TimetableModel:
+    """一份课表编译后的课程列表，按星期分组，支持按日期/周次查询"""
+
+    def __init__(self, slots):
+        self.slots = sorted(slots, key=lambda slot: (slot.day, slot.period))
+        self.by_day = [[] for _ in WEEKDAYS]
+        for slot in self.slots:
+            self.by_day[slot.day].append(slot)
+        # 所有课程上课周的并集，用于快速判断某周是否有课
+        self.weeks = 0
+        for slot in self.slots:
+            self.weeks |= slot.weeks
+
+    @classmethod
+    def from_record(cls, record):
+        sheets = record.get('sheets')
+        if not sheets:
+            return cls(slots_from_dataframe(record.get('dataframe')))
+        slots = []
+        for sheet_name, df in sheets.items():
+            # 名为 第N周 的工作表只在该周有效
+            week_match = _SHEET_WEEK_PATTERN.match(str(sheet_name).strip())
+            weeks_filter = week_range_mask(int(week_match.group(1)), int(week_match.group(1))) if week_match else ALL_WEEKS
+            slots.extend(slots_from_dataframe(df, weeks_filter))
+        return cls(slots)
+
+    def courses_on_day(self, day, week):
+        if week is None or not self.weeks >> (week - 1) & 1:
+            return []
+        return [slot for slot in self.by_day[day] if slot.active_in(week)]
+
+    def courses_in_week(self, week):
+        return [slot for slot in self.slots if slot.active_in(week)]
+
+
+def _model_key(record):
+    # 没有 file_hash 的旧记录按文件名、上传者和上传时间区分，不依赖对象的内存地址（地址会被复用）
+    return record.get('file_hash') or (record.get('file_name'), record.get('uploaded_by'), record.get('upload_time'))
+
+
+def get_timetable_model(record):
+    """获取课表的编译结果，按 file_hash 缓存（同一文件只编译一次）"""
+    key = _model_key(record)
+    with _cache_lock:
+        model = _model_cache.get(key)
+        if model is not None:
+            _model_cache.move_to_end(key)
+            return model
+    model = TimetableModel.from_record(record)
+    with _cache_lock:
+        _model_cache[key] = model
+        while len(_model_cache) > _MODEL_CACHE_SIZE:
+            _model_cache.popitem(last=False)
+    return model
+
+
+def derive_semester_start(today):
+    """按日期推算正在进行或即将开始的学期的第一周周一（假期中返回下一个学期）"""
+    starts = []
+    for year in (today.year - 1, today.year, today.year + 1):
+        for month, day in TERM_START_DATES:
+            first = datetime.date(year, month, day)
+            starts.append(first + datetime.timedelta(days=-first.weekday() % 7))
+    return next(start for start in sorted(starts) if today < start + datetime.timedelta(weeks=SEMESTER_WEEKS))
+
+
+def semester_start(today=None):
+    """当前学期第一周的周一：依次取环境变量 LIZHI_SEMESTER_START、作息配置中的开学日期，都没有时按今天推算"""
+    if _SEMESTER_START_OVERRIDE:
+        return datetime.date.fromisoformat(_SEMESTER_START_OVERRIDE)
+    configured = get_period_schedule().semester_start
+    if configured:
+        return configured
+    return derive_semester_start(today or datetime.date.today())
+
+
+def semester_end(start=None):
+    """学期最后一周的星期日"""
+    return date_of(SEMESTER_WEEKS, 6, start)
+
+
+def week_of(date, start=None):
+    """日期所在的教学周，在学期开始前或结束后返回 None"""
+    if isinstance(date, datetime.datetime):
+        date = date.date()
+    week = (date - (start or semester_start())).days // 7 + 1
+    return week if 1 <= week <= SEMESTER_WEEKS else None
+
+
+def date_of(week, day, start=None):
+    """第 week 周星期 day（0为星期一）的日期"""
+    return (start or semester_start()) + datetime.timedelta(weeks=week - 1, days=day)
+
+
+def user_models(timetables, user):
+    """用户上传的所有课表的编译结果"""
+    return [get_timetable_model(record) for record in timetables.values() if record.get('uploaded_by') == user]
+
+
+def courses_on_date(timetables, user, date):
+    """用户在某天的课程，按节次排序"""
+    if isinstance(date, datetime.datetime):
+        date = date.date()
+    week = week_of(date)
+    if week is None:
+        return []
+    slots = [slot for model in user_models(timetables, user) for slot in model.courses_on_day(date.weekday(), week)]
+    return sorted(slots, key=lambda slot: slot.period)
+
+
+def courses_in_week(timetables, user, week):
+    """用户在第 week 周的全部课程，按星期和节次排序"""
+    slots = [slot for model in user_models(timetables, user) for slot in model.courses_in_week(week)]
+    return sorted(slots, key=lambda slot: (slot.day, slot.period))
+
+
+def current_course(timetables, user, now=None):
+    """用户此刻正在上的课，没有则返回 None"""
+    now = now or datetime.datetime.now()
+    period = get_period_schedule().period_at(now)
+    if period is None:
+        return None
+    return next((slot for slot in courses_on_date(timetables, user, now) if slot.period == period), None)
+
+
+def next_class(timetables, user, now=None):
+    """用户的下一节课，返回 (上课时间, CourseSlot)
+
+    学期开始前从第一周找起；学期已结束或本学期没有后续课程时返回 None。
+    """
+    now = now or datetime.datetime.now()
+    models = user_models(timetables, user)
+    if not models:
+        return None
+    schedule = get_period_schedule()
+    start = semester_start(now.date())
+    date = max(now.date(), start)
+    last_day = semester_end(start)
+    while date <= last_day:
+        week = week_of(date, start)
+        upcoming = []
+        for model in models:
+            for slot in model.courses_on_day(date.weekday(), week):
+                bounds = schedule.bounds(date, slot.period)
+                if bounds and bounds[0] > now:
+                    upcoming.append((bounds[0], slot))
+        if upcoming:
+            return min(upcoming, key=lambda item: item[0])
+        date += datetime.timedelta(days=1)
+    return None
@@ -0,0 +1,243 @@
+# timetable_record.py
+import collections.abc
+import threading
+
+import numpy as np
+import pandas as pd
+
+MISSING = -1
+
+
+class StringPool:
+    """表格共享的取值池：相同的课程名、教师、地点等只保存一份，表格中只存整数编码
+
+    取值只增不减；课表存储压缩时换用新池并把现有表格重新编码，旧池在没有表格引用后释放（见 new_string_pool）。
+    """
+
+    def __init__(self):
+        self._codes = {}
+        self._values = []
+        self._array = np.empty(0, dtype=object)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def encode(self, values):
+        """把二维取值数组编码为 int32 数组，空值编码为 -1"""
+        values = np.asarray(values, dtype=object)
+        missing = pd.isna(values)
+        codes = np.full(values.shape, MISSING, dtype=np.int32)
+        with self._lock:
+            for index in zip(*np.nonzero(~missing)):
+                value = values[index]
+                # 以类型区分取值，避免 1、1.0 和 True 共用编码
+                key = (type(value), value)
+                code = self._codes.get(key)
+                if code is None:
+                    code = len(self._values)
+                    self._codes[key] = code
+                    self._values.append(value)
+                codes[index] = code
+        return codes
+
+    def intern(self, values):
+        """返回池中与 values 相等的已有对象（不存在时加入），用于共享列名等少量取值"""
+        codes = self.encode([list(values)])[0] if len(values) else []
+        return tuple(self._values[code] if code != MISSING else value for code, value in zip(codes, values))
+
+    def decode(self, codes):
+        """把编码数组还原为取值数组，-1 还原为 NaN"""
+        array = self._array
+        if len(array) < len(self._values):
+            with self._lock:
+                self._array = array = np.array(self._values + [np.nan], dtype=object)[:-1]
+        values = np.full(codes.shape, np.nan, dtype=object)
+        present = codes != MISSING
+        values[present] = array[codes[present]]
+        return values
+
+
+_current_pool = StringPool()
+
+
+def current_string_pool():
+    """新建或加载的表格使用的取值池"""
+    return _current_pool
+
+
+def new_string_pool():
+    """换用一个空的取值池并返回它：之后新建和加载的表格编码到新池中，旧池随引用它的表格一起释放"""
+    global _current_pool
+    _current_pool = StringPool()
+    return _current_pool
+
+
+class CompactGrid:
+    """以取值池编码保存的表格：列名 + int32 编码矩阵，以及编码所属的取值池"""
+
+    __slots__ = ("columns", "encoded")
+
+    def __init__(self, columns, codes, pool=None):
+        pool = _current_pool if pool is None else pool
+        self.columns = pool.intern(list(columns))
+        # 取值池和编码作为一个元组整体替换，重新编码时其他线程不会读到不匹配的两者
+        self.encoded = (pool, codes)
+
+    @classmethod
+    def from_frame(cls, df):
+        pool = _current_pool
+        return cls(df.columns, pool.encode(df.to_numpy(dtype=object)), pool)
+
+    @property
+    def pool(self):
+        return self.encoded[0]
+
+    @property
+    def codes(self):
+        return self.encoded[1]
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    def to_frame(self):
+        """还原为DataFrame（仅用于显示和导出）"""
+        pool, codes = self.encoded
+        return pd.DataFrame(pool.decode(codes), columns=list(self.columns)).infer_objects()
+
+    def rebind(self, pool):
+        """把编码迁移到另一个取值池"""
+        old_pool, codes = self.encoded
+        if old_pool is pool:
+            return
+        self.columns = pool.intern(list(self.columns))
+        self.encoded = (pool, pool.encode(old_pool.decode(codes)))
+
+    def nbytes(self):
+        return self.codes.nbytes
+
+    def __getstate__(self):
+        # 序列化时只写入本表用到的取值，加载时并入当前的取值池
+        pool, codes = self.encoded
+        present = codes[codes != MISSING]
+        used, local_codes = np.unique(present, return_inverse=True)
+        local = np.full(codes.shape, MISSING, dtype=np.int32)
+        local[codes != MISSING] = local_codes
+        return self.columns, list(pool.decode(used)), local
+
+    def __setstate__(self, state):
+        columns, local_values, local = state
+        pool = _current_pool
+        self.columns = pool.intern(list(columns))
+        if local_values:
+            mapping = pool.encode([local_values])[0]
+            local = np.where(local == MISSING, MISSING, mapping[np.maximum(local, 0)]).astype(np.int32)
+        self.encoded = (pool, local)
+
+
+class TimetableRecord(collections.abc.MutableMapping):
+    """紧凑的课表记录：表格以 CompactGrid 保存，按字典方式访问时才还原为DataFrame
+
+    兼容原来的字典结构：record['dataframe']、record.get('sheets')、record['uploaded_by'] 等用法不变。
+    """
+
+    __slots__ = ("file_name", "upload_time", "uploaded_by", "is_locked", "file_hash",
+                 "grid", "sheet_grids", "versions", "extra")
+    FIELDS = ("file_name", "upload_time", "uploaded_by", "is_locked", "file_hash")
+
+    def __init__(self, file_name, upload_time, uploaded_by, is_locked, file_hash,
+                 grid, sheet_grids=None, versions=None, extra=None):
+        self.file_name = file_name
+        self.upload_time = upload_time
+        self.uploaded_by = uploaded_by
+        self.is_locked = is_locked
+        self.file_hash = file_hash
+        self.grid = grid
+        self.sheet_grids = sheet_grids
+        self.versions = versions
+        self.extra = extra
+
+    @classmethod
+    def from_mapping(cls, data):
+        """从字典形式的课表记录（包括旧版本保存的数据）转换"""
+        if isinstance(data, cls):
+            return data
+        record = cls(*(data.get(field) for field in cls.FIELDS), grid=None)
+        record.is_locked = bool(record.is_locked)
+        for key, value in data.items():
+            if key not in cls.FIELDS:
+                record[key] = value
+        return record
+
+    @property
+    def shape(self):
+        """主表格的 (行数, 列数)，不需要还原DataFrame"""
+        return self.grid.shape
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            return getattr(self, key)
+        if key == 'dataframe':
+            return self.grid.to_frame()
+        if key == 'sheets' and self.sheet_grids:
+            return {name: grid.to_frame() for name, grid in self.sheet_grids.items()}
+        if key == 'versions' and self.versions:
+            return self.versions
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            setattr(self, key, value)
+        elif key == 'dataframe':
+            self.grid = CompactGrid.from_frame(value)
+        elif key == 'sheets':
+            self.sheet_grids = {name: CompactGrid.from_frame(df) for name, df in value.items()}
+            # 'dataframe' 与第一个工作表共用同一份编码
+            self.grid = next(iter(self.sheet_grids.values()))
+        elif key == 'versions':
+            self.versions = value
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key == 'sheets':
+            self.sheet_grids = None
+        elif key == 'versions':
+            self.versions = None
+        elif self.extra and key in self.extra:
+            del self.extra[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key == 'sheets':
+            return bool(self.sheet_grids)
+        if key == 'versions':
+            return bool(self.versions)
+        return key in self.FIELDS or key == 'dataframe' or bool(self.extra and key in self.extra)
+
+    def __iter__(self):
+        yield from self.FIELDS
+        yield 'dataframe'
+        if self.sheet_grids:
+            yield 'sheets'
+        if self.versions:
+            yield 'versions'
+        yield from self.extra or ()
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def nbytes(self):
+        """表格编码占用的字节数（不含共享取值池）"""
+        grids = {id(self.grid): self.grid}
+        grids.update((id(grid), grid) for grid in (self.sheet_grids or {}).values())
+        return sum(grid.nbytes() for grid in grids.values())
+
+    def __repr__(self):
+        return f"TimetableRecord({self.file_name!r}, uploaded_by={self.uploaded_by!r}, shape={self.shape})"
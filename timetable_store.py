@@ -0,0 +1,400 @@
+# timetable_store.py
+import collections
+import contextlib
+import datetime
+import itertools
+import json
+import os
+import pickle
+import struct
+import threading
+import zlib
+
+import streamlit as st
+
+from instrumentation import span, count_bytes
+from shared_storage import data_path, file_lock, file_signature, replace_file
+from timetable_record import TimetableRecord, new_string_pool
+
+SNAPSHOT_FILE = data_path("timetables.snapshot")
+WAL_FILE = data_path("timetables.wal")
+# 旧版本整体保存的课表和元数据，首次启动时迁移进快照
+LEGACY_TIMETABLES_FILE = data_path("timetables.pkl")
+LEGACY_METADATA_FILE = data_path("metadata.json")
+
+# 日志超过快照大小（且不小于这个字节数）时压缩进新快照，启动时最多重放与快照同量级的日志
+WAL_COMPACT_MIN_BYTES = 1 << 20
+
+SNAPSHOT_FORMAT = 1
+# 日志文件头：魔数 + 对应的快照代数；每条记录：长度 + CRC32 + pickle 的操作
+WAL_MAGIC = b"LZWAL1\0\0"
+WAL_HEADER = struct.Struct(">8sQ")
+WAL_RECORD = struct.Struct(">II")
+
+# 各 TimetableStore 实例的状态版本号全局递增，缓存重建后会话也能发现变化
+_versions = itertools.count(1)
+
+
+def put_op(name, record):
+    """新增或替换课表的日志操作"""
+    record = TimetableRecord.from_mapping(record)
+    return {"op": "put", "name": name, "record": record, "file_hash": record.get('file_hash')}
+
+
+def delete_op(name, file_hash=None):
+    """删除课表的日志操作，同时移除该课表及其历史版本的文件哈希值（仍被其他课表使用的除外）"""
+    return {"op": "delete", "name": name, "file_hash": file_hash}
+
+
+def record_hashes(record):
+    """课表当前版本和各历史版本的文件哈希值"""
+    hashes = {version.get('file_hash') for version in record.get('versions') or ()}
+    hashes.add(record.get('file_hash'))
+    hashes.discard(None)
+    return hashes
+
+
+class TimetableStore:
+    """课表存储：快照 + 预写日志
+
+    快照保存全部课表和已上传文件的哈希值，每次修改只向日志追加一条带长度和CRC校验的记录并 fsync，
+    不再整体重写课表文件。日志超过快照大小时把当前状态写入新快照（临时文件 + 原子替换），
+    再换一个只有文件头的新日志；日志头记录快照代数，压缩中途崩溃留下的旧日志会被忽略。
+
+    内容相同（file_hash 相同）的课表共用同一份表格编码：内存中只保留一份，快照中 pickle 只写一次，
+    日志中后来的记录只保存对已有内容的引用。
+
+    启动恢复读取快照后重放日志，遇到写了一半或校验失败的记录就停下并截掉残缺的尾部。
+    多个进程共用同一组文件：读写都在日志的文件锁内进行，其他进程追加的记录按偏移增量重放，
+    快照被替换时重新加载。
+    """
+
+    def __init__(self, snapshot_path=SNAPSHOT_FILE, wal_path=WAL_FILE,
+                 legacy_paths=(LEGACY_TIMETABLES_FILE, LEGACY_METADATA_FILE)):
+        self.snapshot_path = snapshot_path
+        self.wal_path = wal_path
+        self.legacy_paths = legacy_paths
+        self.version = next(_versions)
+        self.wal_records = 0
+        self.recovered_bytes = 0
+        self._lock = threading.RLock()
+        self._records = {}
+        self._file_hashes = set()
+        # file_hash → (主表格, 各工作表)，以及引用该内容的课表数
+        self._payloads = {}
+        self._payload_refs = collections.Counter()
+        self._generation = 0
+        # False 表示尚未加载；快照不存在时为 None
+        self._snapshot_id = False
+        self._wal_seen = None
+        self._wal_offset = 0
+        self._wal_stale = False
+        with self.transaction():
+            pass
+
+    # ---- 读取 ----
+
+    def _files_changed(self):
+        snapshot = file_signature(self.snapshot_path)
+        wal = file_signature(self.wal_path)
+        return ((snapshot[:2] if snapshot else None) != self._snapshot_id
+                or ((wal[0], wal[2]) if wal else None) != self._wal_seen)
+
+    def refresh(self):
+        """读入其他进程写入的修改，状态有变化时返回 True"""
+        if not self._files_changed():
+            return False
+        version = self.version
+        with self.transaction():
+            pass
+        return self.version != version
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """持有进程内锁和文件锁并同步到最新状态；块内的读取和 apply 不会与其他写入交错"""
+        with self._lock, file_lock(self.wal_path):
+            self._sync()
+            yield self
+
+    def records(self):
+        """全部课表（字典副本，记录对象共享）"""
+        with self._lock:
+            return dict(self._records)
+
+    def file_hashes(self):
+        with self._lock:
+            return set(self._file_hashes)
+
+    def snapshot(self):
+        """一次取出 (课表, 文件哈希值, 版本号)"""
+        with self._lock:
+            return dict(self._records), set(self._file_hashes), self.version
+
+    def _sync(self):
+        snapshot = file_signature(self.snapshot_path)
+        wal = file_signature(self.wal_path)
+        if (snapshot[:2] if snapshot else None) != self._snapshot_id:
+            self._load_snapshot()
+        elif self._wal_seen is not None and (wal is None or wal[0] != self._wal_seen[0] or wal[2] < self._wal_offset):
+            # 日志被替换或截短（其他进程压缩过但快照恰好未变），从快照重新开始
+            self._load_snapshot()
+        self._replay()
+
+    def _load_snapshot(self):
+        signature = file_signature(self.snapshot_path)
+        # 重新加载的表格编码到新的取值池，旧表格不再使用的取值随旧池释放
+        new_string_pool()
+        with span("timetable_store.load_snapshot"):
+            if signature is None:
+                records, file_hashes = self._read_legacy()
+                generation = 0
+            else:
+                with open(self.snapshot_path, 'rb') as f:
+                    state = pickle.load(f)
+                    count_bytes("read", f.tell())
+                if state.get("format") != SNAPSHOT_FORMAT:
+                    raise ValueError(f"无法识别的课表快照格式: {state.get('format')}")
+                records = state["records"]
+                file_hashes = set(state["file_hashes"])
+                generation = state["generation"]
+        self._records = records
+        self._file_hashes = file_hashes
+        self._payloads, self._payload_refs = {}, collections.Counter()
+        for record in records.values():
+            self._share_payload(record)
+        self._generation = generation
+        self._snapshot_id = signature[:2] if signature else None
+        self._wal_seen = None
+        self._wal_offset = 0
+        self._wal_stale = False
+        self.wal_records = 0
+        self.version = next(_versions)
+        if signature is None and records:
+            # 迁移旧版本的数据，之后只读写快照和日志
+            self._replay()
+            self._compact()
+
+    def _read_legacy(self):
+        timetables_path, metadata_path = self.legacy_paths
+        records, file_hashes = {}, set()
+        if os.path.exists(timetables_path):
+            with open(timetables_path, 'rb') as f:
+                records = pickle.load(f)
+                count_bytes("read", f.tell())
+            # 旧版本保存的字典记录转换为紧凑记录
+            records = {name: TimetableRecord.from_mapping(record) for name, record in records.items()}
+        if os.path.exists(metadata_path):
+            with open(metadata_path, 'r', encoding='utf-8') as f:
+                file_hashes = set(json.load(f).get('uploaded_file_hashes', []))
+        return records, file_hashes
+
+    def _replay(self):
+        """从已应用的位置继续重放日志中的完整记录，截掉写入中断留下的残缺尾部"""
+        if not os.path.exists(self.wal_path):
+            self._wal_seen, self._wal_offset = None, 0
+            return
+        with open(self.wal_path, 'r+b') as f:
+            stat = os.fstat(f.fileno())
+            offset = self._wal_offset
+            if offset == 0:
+                header = f.read(WAL_HEADER.size)
+                if len(header) < WAL_HEADER.size or WAL_HEADER.unpack(header)[0] != WAL_MAGIC \
+                        or WAL_HEADER.unpack(header)[1] != self._generation:
+                    # 文件头残缺，或是压缩前的旧日志：内容已在快照中，下次写入时换新日志
+                    self._wal_stale = True
+                    self._wal_seen, self._wal_offset = (stat.st_ino, stat.st_size), 0
+                    return
+                offset = WAL_HEADER.size
+            f.seek(offset)
+            data = f.read()
+            count_bytes("read", len(data))
+            position = count = 0
+            with span("timetable_store.replay", bytes=len(data)):
+                while position + WAL_RECORD.size <= len(data):
+                    length, crc = WAL_RECORD.unpack_from(data, position)
+                    start = position + WAL_RECORD.size
+                    payload = data[start:start + length]
+                    if len(payload) < length or zlib.crc32(payload) != crc:
+                        break
+                    try:
+                        op = pickle.loads(payload)
+                    except Exception:
+                        break
+                    self._apply(op)
+                    position = start + length
+                    count += 1
+            size = stat.st_size
+            if position < len(data):
+                # 写入中途崩溃留下的残缺记录：持有写锁，截掉后追加从完整记录处继续
+                self.recovered_bytes += len(data) - position
+                f.truncate(offset + position)
+                size = offset + position
+        self._wal_offset = offset + position
+        self._wal_seen = (stat.st_ino, size)
+        if count:
+            self.wal_records += count
+            self.version = next(_versions)
+
+    def _share_payload(self, record):
+        """让 record 使用同一 file_hash 已有的表格编码（没有时登记为共享内容）"""
+        file_hash = record.file_hash
+        if not file_hash:
+            return
+        shared = self._payloads.get(file_hash)
+        if shared is None or shared[0] is None:
+            self._payloads[file_hash] = (record.grid, record.sheet_grids)
+        else:
+            record.grid, record.sheet_grids = shared
+        self._payload_refs[file_hash] += 1
+
+    def _release_payload(self, record):
+        file_hash = record.file_hash if record is not None else None
+        if not file_hash or file_hash not in self._payload_refs:
+            return
+        self._payload_refs[file_hash] -= 1
+        if self._payload_refs[file_hash] <= 0:
+            del self._payload_refs[file_hash]
+            self._payloads.pop(file_hash, None)
+
+    def _apply(self, op):
+        name, file_hash = op["name"], op.get("file_hash")
+        if op["op"] == "put":
+            # 先登记新记录再释放旧记录，替换为相同内容时共享内容不会被提前移除
+            previous = self._records.get(name)
+            self._share_payload(op["record"])
+            self._release_payload(previous)
+            self._records[name] = op["record"]
+            if file_hash:
+                self._file_hashes.add(file_hash)
+        elif op["op"] == "delete":
+            removed = self._records.pop(name, None)
+            self._release_payload(removed)
+            released = record_hashes(removed) if removed is not None else set()
+            if file_hash:
+                released.add(file_hash)
+            if released:
+                self._file_hashes -= released - self._used_hashes()
+
+    def _used_hashes(self):
+        """现有课表及其历史版本使用的文件哈希值"""
+        used = set()
+        for record in self._records.values():
+            used |= record_hashes(record)
+        return used
+
+    def _wal_form(self, op, deleted_hashes):
+        """写入日志的形式：内容已在存储中的课表只记录引用，重放时从共享内容还原"""
+        record = op.get("record")
+        file_hash = op.get("file_hash")
+        if op["op"] != "put" or file_hash not in self._payloads or file_hash in deleted_hashes:
+            return op
+        reference = TimetableRecord(record.file_name, record.upload_time, record.uploaded_by, record.is_locked,
+                                    record.file_hash, grid=None, versions=record.versions, extra=record.extra)
+        return dict(op, record=reference)
+
+    # ---- 写入 ----
+
+    def apply(self, ops):
+        """把一批操作作为日志记录追加（一次 fsync）并应用到内存状态，返回新的版本号"""
+        if not ops:
+            return self.version
+        with self.transaction():
+            # 同一批中被删除的内容不能作为引用（重放到这条记录时可能已不存在）
+            deleted_hashes = {self._records[op["name"]].file_hash for op in ops
+                              if op["op"] == "delete" and op["name"] in self._records}
+            payloads = [pickle.dumps(self._wal_form(op, deleted_hashes), protocol=pickle.HIGHEST_PROTOCOL)
+                        for op in ops]
+            data = b"".join(WAL_RECORD.pack(len(payload), zlib.crc32(payload)) + payload for payload in payloads)
+            if self._wal_stale or self._wal_seen is None:
+                self._reset_wal()
+            with span("timetable_store.append", ops=len(ops), bytes=len(data)):
+                with open(self.wal_path, 'ab') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    self._wal_offset = f.tell()
+                    self._wal_seen = (os.fstat(f.fileno()).st_ino, self._wal_offset)
+            count_bytes("written", len(data))
+            for op in ops:
+                self._apply(op)
+            self.wal_records += len(ops)
+            self.version = next(_versions)
+            if self._wal_offset > max(WAL_COMPACT_MIN_BYTES, self._snapshot_size()):
+                self._compact()
+            return self.version
+
+    def _snapshot_size(self):
+        signature = file_signature(self.snapshot_path)
+        return signature[2] if signature else 0
+
+    def _reset_wal(self):
+        """换成只有文件头的新日志（原子替换）"""
+        replace_file(self.wal_path, lambda f: f.write(WAL_HEADER.pack(WAL_MAGIC, self._generation)), binary=True)
+        signature = file_signature(self.wal_path)
+        self._wal_seen = (signature[0], signature[2])
+        self._wal_offset = WAL_HEADER.size
+        self._wal_stale = False
+
+    def compact(self, prune_hashes=False):
+        """把当前状态写入新快照并清空日志；prune_hashes 时只保留仍有课表使用的文件哈希值
+
+        返回移除的哈希值个数。
+        """
+        with self.transaction():
+            removed = 0
+            if prune_hashes:
+                used = self._used_hashes()
+                removed = len(self._file_hashes - used)
+                self._file_hashes &= used
+            self._compact()
+            self.version = next(_versions)
+            return removed
+
+    def _compact(self):
+        # 先原子替换快照再换新日志：两步之间崩溃时旧日志的代数较小，恢复时会被忽略
+        generation = self._generation + 1
+        state = {
+            "format": SNAPSHOT_FORMAT,
+            "generation": generation,
+            "records": self._records,
+            "file_hashes": sorted(self._file_hashes),
+            "saved_at": datetime.datetime.now().isoformat(),
+        }
+        with span("timetable_store.compact", timetables=len(self._records)):
+            self._reencode()
+            replace_file(self.snapshot_path, lambda f: pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL),
+                         binary=True)
+            self._generation = generation
+            self._snapshot_id = file_signature(self.snapshot_path)[:2]
+            self._reset_wal()
+        self.wal_records = 0
+
+    def _reencode(self):
+        """把现有表格重新编码到新的取值池，已删除课表留下的取值随旧池释放"""
+        pool = new_string_pool()
+        grids = {}
+        for record in self._records.values():
+            for grid in (record.grid, *(record.sheet_grids or {}).values()):
+                if grid is not None:
+                    grids[id(grid)] = grid
+        for grid in grids.values():
+            grid.rebind(pool)
+
+    def stats(self):
+        """快照和日志的大小，用于侧边栏的存储信息"""
+        wal = file_signature(self.wal_path)
+        return {
+            "snapshot_bytes": self._snapshot_size(),
+            "wal_bytes": wal[2] if wal else 0,
+            "wal_records": self.wal_records,
+            "generation": self._generation,
+            "recovered_bytes": self.recovered_bytes,
+            "timetables": len(self._records),
+            "unique_payloads": len(self._payloads),
+        }
+
+
+@st.cache_resource
+def get_timetable_store():
+    """进程内共享的课表存储（首次调用时完成启动恢复）"""
+    return TimetableStore()
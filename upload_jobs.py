@@ -0,0 +1,101 @@
+# upload_jobs.py
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import span
+
+STATUS_LABELS = {
+    "queued": "排队中",
+    "parsing": "解析中",
+    "storing": "保存中",
+    "done": "已完成",
+    "failed": "失败",
+}
+FINISHED_STATUSES = ("done", "failed")
+
+# 已结束的任务保留多久（秒），之后从队列中清除
+FINISHED_JOB_TTL = 3600
+
+
+class UploadJob:
+    """一个上传文件的导入任务及其进度"""
+
+    def __init__(self, file, user, is_locked=False):
+        self.id = uuid.uuid4().hex[:12]
+        self.file = file
+        self.file_name = file.name
+        self.user = user
+        self.is_locked = is_locked
+        self.status = "queued"
+        self.progress = 0.0
+        self.message = ""
+        self.timetable_name = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    def set_stage(self, status, progress, message=""):
+        self.status = status
+        self.progress = progress
+        self.message = message
+
+    def report_parse_progress(self, done, total, sheet_name):
+        """excel_reader.read_workbook 的进度回调：解析阶段占总进度的 10%~80%"""
+        self.set_stage("parsing", 0.1 + 0.7 * done / total, f"已解析 {done}/{total} 个工作表")
+
+    def _finish(self, status, message="", timetable_name=None):
+        self.status = status
+        self.message = message
+        self.timetable_name = timetable_name
+        self.progress = 1.0
+        self.finished_at = time.time()
+        # 任务结束后释放文件内容
+        self.file = None
+
+
+class UploadQueue:
+    """后台导入队列：在线程池中执行导入任务，页面只负责提交和显示进度
+
+    process(job) 完成解析、整理和保存，返回最终的课表名称；抛出的异常记录为任务失败。
+    """
+
+    def __init__(self, process, max_workers=2):
+        self.process = process
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="upload-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, file, user, is_locked=False):
+        """提交一个上传文件，返回任务"""
+        job = UploadJob(file, user, is_locked)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job)
+        return job
+
+    def get_jobs(self, job_ids):
+        """按提交顺序返回仍在队列中的任务"""
+        with self._lock:
+            return [self._jobs[job_id] for job_id in job_ids if job_id in self._jobs]
+
+    def _prune(self):
+        expired = time.time() - FINISHED_JOB_TTL
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished and job.finished_at < expired]:
+            del self._jobs[job_id]
+
+    def _run(self, job):
+        job.set_stage("parsing", 0.05, "正在读取文件")
+        try:
+            with span("upload_job", file=job.file_name):
+                timetable_name = self.process(job)
+            job._finish("done", f"已保存为 {timetable_name}", timetable_name)
+        except ImportError:
+            job._finish("failed", "读取.xls文件需要安装xlrd库，请运行: pip install xlrd")
+        except Exception as e:
+            job._finish("failed", str(e))
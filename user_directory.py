@@ -0,0 +1,136 @@
+# user_directory.py
+import streamlit as st
+import bisect
+import os
+import threading
+
+from credentials import hash_password
+from journal import JsonJournal
+from shared_storage import DATA_DIR, file_lock
+
+USERS_FILE = os.path.join(DATA_DIR, "users.json")
+USERS_LOG = os.path.join(DATA_DIR, "users.log")
+
+def apply_user_op(users, op):
+    """把一条用户操作应用到用户表（用于日志重放）"""
+    if op.get("op") == "put" and op.get("user"):
+        users[op["user"]] = op.get("record", {})
+
+class UserDirectory:
+    """进程级用户目录 - 用户名索引、前缀搜索，注册和修改只追加日志"""
+
+    def __init__(self, snapshot_path=USERS_FILE, log_path=USERS_LOG):
+        self._journal = JsonJournal(snapshot_path, log_path, compact_threshold=1000)
+        self._lock = threading.RLock()
+        self._users = {}
+        self._sorted_names = []
+        self._position = None
+        self.reload()
+
+    def reload(self):
+        """从磁盘重新加载快照和日志"""
+        with self._lock:
+            directory = os.path.dirname(self._journal.snapshot_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._users, self._position = self._journal.load_with_position(apply_user_op, {})
+            self._sorted_names = sorted(self._users)
+
+    def plaintext_users(self):
+        """仍以明文保存密码的用户名"""
+        with self._lock:
+            return sorted(username for username, record in self._users.items() if "password" in record)
+
+    def scrub_plaintext(self):
+        """一次性迁移（由 storage_maintenance 显式执行）：把仍以明文保存的密码转换为哈希并立即压缩，
+        快照和日志中不再留有明文；返回迁移的用户数。加载目录本身从不改写用户数据。
+        """
+        with self._lock, file_lock(self._journal.log_path):
+            # 在锁内重新读取：其他进程可能已经完成迁移
+            self._users, self._position = self._journal.load_with_position(apply_user_op, {})
+            self._sorted_names = sorted(self._users)
+            migrated = 0
+            for username, record in list(self._users.items()):
+                if "password" in record:
+                    scrubbed = {key: value for key, value in record.items() if key != "password"}
+                    scrubbed["password_hash"] = hash_password(str(record["password"]))
+                    self._users[username] = scrubbed
+                    migrated += 1
+            if migrated:
+                self._position = self._journal.compact(self._users)
+            return migrated
+
+    def _apply_op(self, users, op):
+        """重放其他进程追加的操作，同时维护有序用户名列表"""
+        username = op.get("user")
+        if op.get("op") == "put" and username and username not in users:
+            bisect.insort(self._sorted_names, username)
+        apply_user_op(users, op)
+
+    def refresh(self):
+        """其他进程注册或修改了用户时同步；只比较文件签名，没有变化时几乎没有开销"""
+        if not self._journal.changed(self._position):
+            return
+        with self._lock:
+            position = self._journal.sync(self._users, self._apply_op, self._position)
+            if position is None:
+                self.reload()
+            else:
+                self._position = position
+
+    def __contains__(self, username):
+        return username in self._users
+
+    def __getitem__(self, username):
+        return self._users[username]
+
+    def __len__(self):
+        return len(self._users)
+
+    def get(self, username, default=None):
+        return self._users.get(username, default)
+
+    def __setitem__(self, username, record):
+        """新增或更新用户，只向日志追加一行"""
+        with self._lock:
+            previous = self._users.get(username)
+            self._position = self._journal.append([{"op": "put", "user": username, "record": record}],
+                                                  self._position)
+            if username not in self._users:
+                bisect.insort(self._sorted_names, username)
+            self._users[username] = record
+            # 明文密码迁移为哈希后立即压缩，旧的明文不能留在快照里等到日志攒满
+            scrubbed = previous is not None and "password" in previous and "password" not in record
+            if scrubbed or self._journal.needs_compaction():
+                position = self._journal.compact(self._users, self._apply_op, self._position)
+                if position is None:
+                    self.reload()
+                else:
+                    self._position = position
+
+    def setdefault(self, username, record):
+        """用户不存在时添加并返回 record，已存在时返回已有记录；在文件锁内检查，多个进程同时注册同名用户时只有一个成功"""
+        with self._lock, file_lock(self._journal.log_path):
+            self.refresh()
+            if username in self._users:
+                return self._users[username]
+            self[username] = record
+            return record
+
+    def search_prefix(self, prefix, limit=10):
+        """按前缀查找用户名，基于有序列表二分定位"""
+        if not prefix:
+            return []
+        with self._lock:
+            start = bisect.bisect_left(self._sorted_names, prefix)
+            matches = []
+            for name in self._sorted_names[start:start + limit]:
+                if not name.startswith(prefix):
+                    break
+                matches.append(name)
+        return matches
+
+@st.cache_resource
+def get_user_directory():
+    """获取进程内共享的用户目录（每个进程只加载一次）"""
+    return UserDirectory()
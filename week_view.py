@@ -0,0 +1,115 @@
+# week_view.py
+import collections
+import html
+import threading
+
+import numpy as np
+import pandas as pd
+
+from period_config import get_period_schedule
+from timetable_model import WEEKDAYS, get_timetable_model
+
+_CACHE_SIZE = 64
+_stack_cache = collections.OrderedDict()
+_html_cache = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def _cache_get(cache, key):
+    with _lock:
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+
+def _cache_put(cache, key, value):
+    with _lock:
+        cache[key] = value
+        while len(cache) > _CACHE_SIZE:
+            cache.popitem(last=False)
+
+
+def model_frame(record):
+    """课表的课程列表转换为 DataFrame（星期、节次、课程、地点、上课周位掩码）"""
+    slots = get_timetable_model(record).slots
+    return pd.DataFrame({
+        'day': [slot.day for slot in slots],
+        'period': [slot.period for slot in slots],
+        'course': [slot.name for slot in slots],
+        'room': [slot.room for slot in slots],
+        'weeks': np.array([slot.weeks for slot in slots], dtype=np.int64),
+    })
+
+
+def stack_timetables(records):
+    """把多位用户的课表叠加为一张长表，按参与课表的 file_hash 集合缓存
+
+    records 为 [(用户名, 课表记录), ...]
+    """
+    key = frozenset((user, record.get('file_hash')) for user, record in records)
+    stacked = _cache_get(_stack_cache, key)
+    if stacked is None:
+        frames = [model_frame(record).assign(user=user) for user, record in records]
+        frames = [frame for frame in frames if not frame.empty]
+        if frames:
+            stacked = pd.concat(frames, ignore_index=True)
+        else:
+            stacked = pd.DataFrame(columns=['day', 'period', 'course', 'room', 'weeks', 'user'])
+        _cache_put(_stack_cache, key, stacked)
+    return key, stacked
+
+
+def week_grid(stacked, week):
+    """第 week 周的 (节次, 星期) 网格，每格为 [(用户, 课程, 地点), ...]"""
+    if stacked.empty:
+        return {}
+    weeks = stacked['weeks'].to_numpy(dtype=np.int64)
+    active = stacked[(weeks >> (week - 1)) & 1 == 1].sort_values(['period', 'day', 'user'])
+    grid = {}
+    for day, period, user, course, room in zip(active['day'], active['period'], active['user'],
+                                               active['course'], active['room']):
+        grid.setdefault((int(period), int(day)), []).append((user, course, room))
+    return grid
+
+
+def render_week_grid(records, week, current_user=None):
+    """渲染伙伴周视图的HTML表格，按参与课表和周次缓存"""
+    key, stacked = stack_timetables(records)
+    period_schedule = get_period_schedule()
+    cache_key = (key, week, current_user, period_schedule.digest)
+    markup = _cache_get(_html_cache, cache_key)
+    if markup is not None:
+        return markup
+
+    grid = week_grid(stacked, week)
+    periods = sorted(set(period_schedule.periods) | {period for period, _ in grid})
+    header = "".join(f"<th>{day}</th>" for day in WEEKDAYS)
+    rows = []
+    for period in periods:
+        start, end = period_schedule.clock_range(period)
+        cells = [f"<th>第{period}节<br><small>{start}-{end}</small></th>"]
+        for day in range(len(WEEKDAYS)):
+            entries = grid.get((period, day), [])
+            if not entries:
+                cells.append("<td></td>")
+                continue
+            items = "".join(
+                f'<span class="who" title="{html.escape(room)}"><b>{"我" if user == current_user else html.escape(user)}</b> '
+                f'{html.escape(course)}</span>'
+                for user, course, room in entries
+            )
+            cells.append(f'<td class="busy">{items}</td>')
+        rows.append(f"<tr>{''.join(cells)}</tr>")
+    markup = (f'<table class="week-grid"><thead><tr><th></th>{header}</tr></thead>'
+              f'<tbody>{"".join(rows)}</tbody></table>')
+    _cache_put(_html_cache, cache_key, markup)
+    return markup
+
+
+def free_slots(records, week):
+    """第 week 周所有参与者都没课的 (节次, 星期) 列表"""
+    _, stacked = stack_timetables(records)
+    grid = week_grid(stacked, week)
+    return [(period, day) for period in get_period_schedule().periods for day in range(len(WEEKDAYS))
+            if (period, day) not in grid]